@@ -0,0 +1,206 @@
+import numpy as np
+
+ASSIGNMENT_MODES = ('greedy', 'optimal')
+
+def greedy_assign(n_osm, pair_osm, pair_bwb, pair_dist):
+    """Assign each OSM point, in order, to its closest still unmatched BWB
+    candidate. Pairs must be sorted by OSM then BWB position."""
+
+    assignments = []
+    bwb_matched = set()
+
+    bounds = np.searchsorted(pair_osm, np.arange(n_osm + 1))
+    for i in range(n_osm):
+        closest_distance = float('inf')
+        closest_bwb = None
+
+        for k in range(bounds[i], bounds[i + 1]):
+            j = int(pair_bwb[k])
+            if j in bwb_matched:
+                continue
+            if pair_dist[k] < closest_distance:
+                closest_distance = float(pair_dist[k])
+                closest_bwb = j
+
+        if closest_bwb is not None:
+            assignments.append((i, closest_bwb, closest_distance))
+            bwb_matched.add(closest_bwb)
+
+    return assignments
+
+def connected_components(pair_osm, pair_bwb):
+    """Split the bipartite candidate graph into connected components.
+
+    Returns a list of edge-position arrays, one per component, ordered by the
+    smallest OSM position in the component.
+    """
+
+    # Union-find over OSM nodes (even ids) and BWB nodes (odd ids)
+    parent = {}
+
+    def find(node):
+        root = node
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(node, node) != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    for i, j in zip(pair_osm.tolist(), pair_bwb.tolist()):
+        root_a, root_b = find(2 * i), find(2 * j + 1)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    roots = np.array([find(2 * i) for i in pair_osm.tolist()], dtype=np.int64)
+    if len(roots) == 0:
+        return []
+
+    order = np.argsort(roots, kind='stable')
+    boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+    return np.split(order, boundaries)
+
+def min_cost_assignment(cost):
+    """Hungarian algorithm for a rectangular cost matrix with rows <= columns.
+
+    Returns the column assigned to every row so that the total cost is
+    minimal.
+    """
+
+    n_rows, n_cols = cost.shape
+    u = np.zeros(n_rows + 1)
+    v = np.zeros(n_cols + 1)
+    # row_of[c] is the (1-based) row assigned to column c; column 0 is virtual
+    row_of = np.zeros(n_cols + 1, dtype=np.int64)
+    way = np.zeros(n_cols + 1, dtype=np.int64)
+
+    for row in range(1, n_rows + 1):
+        row_of[0] = row
+        col = 0
+        min_slack = np.full(n_cols + 1, np.inf)
+        used = np.zeros(n_cols + 1, dtype=bool)
+        while True:
+            used[col] = True
+            current_row = row_of[col]
+            free = ~used[1:]
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = col
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+
+            col = next_col
+            if row_of[col] == 0:
+                break
+
+        while col:
+            previous = way[col]
+            row_of[col] = row_of[previous]
+            col = previous
+
+    assigned = np.empty(n_rows, dtype=np.int64)
+    for col in range(1, n_cols + 1):
+        if row_of[col]:
+            assigned[row_of[col] - 1] = col - 1
+    return assigned
+
+def optimal_assign(pair_osm, pair_bwb, pair_dist):
+    """Globally optimal one-to-one assignment over the candidate pairs.
+
+    Each connected component of the candidate graph is solved independently:
+    first the number of matches is maximised, then the total distance is
+    minimised. Results are deterministic and sorted by OSM position.
+    """
+
+    assignments = []
+    for edges in connected_components(pair_osm, pair_bwb):
+        comp_osm = pair_osm[edges]
+        comp_bwb = pair_bwb[edges]
+        comp_dist = pair_dist[edges]
+
+        if len(edges) == 1:
+            assignments.append((int(comp_osm[0]), int(comp_bwb[0]), float(comp_dist[0])))
+            continue
+
+        osm_nodes, osm_local = np.unique(comp_osm, return_inverse=True)
+        bwb_nodes, bwb_local = np.unique(comp_bwb, return_inverse=True)
+
+        # Missing edges cost more than any complete set of real edges, so the
+        # solver always prefers an extra match over a shorter total distance
+        missing = float(comp_dist.max() + 1.0) * (min(len(osm_nodes), len(bwb_nodes)) + 1)
+        cost = np.full((len(osm_nodes), len(bwb_nodes)), missing)
+        cost[osm_local, bwb_local] = comp_dist
+
+        transposed = len(osm_nodes) > len(bwb_nodes)
+        if transposed:
+            cost = cost.T
+        assigned = min_cost_assignment(cost)
+
+        for row, col in enumerate(assigned):
+            a, b = (col, row) if transposed else (row, col)
+            if cost[row, col] < missing:
+                assignments.append((int(osm_nodes[a]), int(bwb_nodes[b]), float(cost[row, col])))
+
+    assignments.sort()
+    return assignments
+
+def assign(n_osm, pair_osm, pair_bwb, pair_dist, mode='greedy'):
+    """Dispatch to the requested assignment strategy"""
+
+    if mode == 'greedy':
+        return greedy_assign(n_osm, pair_osm, pair_bwb, pair_dist)
+    if mode == 'optimal':
+        return optimal_assign(pair_osm, pair_bwb, pair_dist)
+    raise ValueError(f"Unknown assignment mode: {mode!r} (expected one of {ASSIGNMENT_MODES})")
+
+def sweep_assign(pair_osm, pair_bwb, pair_dist):
+    """Distance-ordered greedy matching: candidate pairs are taken shortest
+    first while both ends are still free.
+
+    Returns the accepted distances in ascending order. Because pairs are
+    consumed in distance order, the matching for any radius r is exactly the
+    prefix of accepted pairs shorter than r, so one pass answers every radius.
+    """
+
+    order = np.lexsort((pair_bwb, pair_osm, pair_dist))
+    osm_matched = set()
+    bwb_matched = set()
+    accepted = []
+
+    for k in order.tolist():
+        i, j = int(pair_osm[k]), int(pair_bwb[k])
+        if i in osm_matched or j in bwb_matched:
+            continue
+        osm_matched.add(i)
+        bwb_matched.add(j)
+        accepted.append(float(pair_dist[k]))
+
+    return np.array(accepted, dtype=float)
+
+def sweep_statistics(accepted, radii, n_osm, n_bwb):
+    """Match counts and distance quantiles for each radius from the accepted
+    distances of sweep_assign"""
+
+    rows = []
+    for radius in sorted(radii):
+        count = int(np.searchsorted(accepted, radius, side='left'))
+        distances = accepted[:count]
+        row = {
+            'radius_m': float(radius),
+            'matches': count,
+            'bwb_only': n_bwb - count,
+            'osm_only': n_osm - count,
+            'coverage_pct': count / n_bwb * 100 if n_bwb else 0.0,
+        }
+        for name, q in (('p50_m', 0.5), ('p90_m', 0.9), ('p95_m', 0.95)):
+            row[name] = float(np.quantile(distances, q)) if count else None
+        row['mean_m'] = float(distances.mean()) if count else None
+        row['max_m'] = float(distances.max()) if count else None
+        rows.append(row)
+    return rows
@@ -0,0 +1,231 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from snapshot_cache import CACHE_DIR, file_sha256
+
+BUILD_CACHE_DIR = os.path.join(CACHE_DIR, 'build')
+
+# Bump when the record layout changes so old records are ignored
+BUILD_CACHE_VERSION = 1
+
+def value_digest(value):
+    """SHA-256 of a stage result. DataFrames (also inside tuples and lists)
+    are hashed by content, since equal frames can pickle differently after
+    a round trip through the cache; anything else by its pickle."""
+
+    digest = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, (tuple, list)):
+            digest.update(f"{type(value).__name__}:{len(value)}".encode('utf-8'))
+            for item in value:
+                update(item)
+            return
+        if hasattr(value, 'columns') and hasattr(value, 'dtypes'):
+            import pandas as pd
+            try:
+                rows = pd.util.hash_pandas_object(value, index=True).to_numpy()
+            except TypeError:
+                pass
+            else:
+                digest.update(json.dumps([list(map(str, value.columns)), list(map(str, value.dtypes))]).encode('utf-8'))
+                digest.update(rows.tobytes())
+                return
+        digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    update(value)
+    return digest.hexdigest()
+
+class Artifact:
+    """Output of a build stage, addressed by the digest of its value (see
+    value_digest). The value itself is only read from the cache when a
+    stage that has to run asks for it."""
+
+    def __init__(self, cache, digest, value=None, loaded=False):
+        self.cache = cache
+        self.digest = digest
+        self._value = value
+        self._loaded = loaded
+
+    @property
+    def value(self):
+        if not self._loaded:
+            with open(self.cache._object_path(self.digest), 'rb') as f:
+                self._value = pickle.load(f)
+            self._loaded = True
+        return self._value
+
+class BuildCache:
+    """Content-addressed cache of pipeline stages.
+
+    A stage's key hashes its name, its parameters, the content of its input
+    files, the digests of the artifacts it consumes and the source of the
+    scripts. When the key matches the last build of that stage and its
+    output files are untouched, the stage is skipped and its artifact is
+    reused; otherwise it runs and everything downstream sees a new digest
+    only if its result actually changed.
+
+    File hashes are remembered by size and modification time, so an
+    unchanged refresh only stats files. One record per stage name is kept,
+    and objects no record refers to are removed.
+    """
+
+    def __init__(self, directory=BUILD_CACHE_DIR, force=False):
+        self.directory = directory
+        self.force = force
+        self._file_hashes = self._read_json('files.json') or {}
+        self._code = None
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _object_path(self, digest):
+        return self._path('objects', digest + '.pkl')
+
+    def _record_path(self, name):
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+        return self._path('stages', safe + '.json')
+
+    def _read_json(self, *parts):
+        try:
+            with open(self._path(*parts), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_json(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def file_digest(self, path):
+        """SHA-256 of a file, rehashed only when its size or mtime changed"""
+
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self._file_hashes.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = file_sha256(path)
+        self._file_hashes[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self._write_json(self._path('files.json'), self._file_hashes)
+        return digest
+
+    def code_digest(self):
+        """Digest of the scripts, so a code change rebuilds every stage"""
+
+        if self._code is None:
+            here = os.path.dirname(os.path.abspath(__file__))
+            names = sorted(name for name in os.listdir(here) if name.endswith('.py'))
+            self._code = self.key('code', [[name, self.file_digest(os.path.join(here, name))] for name in names])
+        return self._code
+
+    @staticmethod
+    def key(*parts):
+        """Stable digest of JSON-serializable parts; artifacts count by digest"""
+
+        def default(value):
+            return value.digest if isinstance(value, Artifact) else str(value)
+
+        text = json.dumps(parts, sort_keys=True, default=default)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _outputs_intact(self, outputs):
+        for path, (size, mtime_ns, digest) in outputs.items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns) and self.file_digest(path) != digest:
+                return False
+        return True
+
+    def lookup(self, name, inputs=(), params=(), outputs=(), force=False):
+        """(artifact, key) of a stage: its cached Artifact, or None when it
+        has to run and its result be stored under key.
+
+        inputs are file paths or upstream Artifacts, params any
+        JSON-serializable values, outputs the files the stage writes.
+        """
+
+        sources = [input if isinstance(input, Artifact) else [input, self.file_digest(input)]
+                   for input in inputs]
+        key = self.key(BUILD_CACHE_VERSION, name, self.code_digest(), sources, list(params))
+        record = self._read_json('stages', os.path.basename(self._record_path(name)))
+
+        if (not (self.force or force) and record is not None and record['key'] == key
+                and os.path.exists(self._object_path(record['digest']))
+                and self._outputs_intact(record['outputs'])):
+            print(f"[build] {name}: up to date")
+            return Artifact(self, record['digest']), key
+        return None, key
+
+    def store(self, name, key, value, outputs=(), seconds=None):
+        """Record the result of a stage that ran; returns its Artifact"""
+
+        digest = value_digest(value)
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(object_path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, object_path)
+
+        recorded = {}
+        for path in outputs:
+            stat = os.stat(path)
+            recorded[path] = [stat.st_size, stat.st_mtime_ns, self.file_digest(path)]
+        record_path = self._record_path(name)
+        record = self._read_json('stages', os.path.basename(record_path))
+        changed = record is None or record['digest'] != digest
+        self._write_json(record_path, {'name': name, 'key': key, 'digest': digest, 'outputs': recorded,
+                                       'built': time.time()})
+        if changed:
+            self.collect_garbage()
+        took = '' if seconds is None else f" in {seconds:.2f}s"
+        print(f"[build] {name}: built{took}{'' if changed else ', result unchanged'}")
+        return Artifact(self, digest, value, loaded=True)
+
+    def stage(self, name, build, inputs=(), params=(), outputs=(), force=False):
+        """Run build() unless the stage is cached (see lookup); returns its
+        Artifact"""
+
+        artifact, key = self.lookup(name, inputs, params, outputs, force)
+        if artifact is not None:
+            return artifact
+        start = time.perf_counter()
+        value = build()
+        return self.store(name, key, value, outputs, time.perf_counter() - start)
+
+    def collect_garbage(self):
+        """Remove objects that no stage record refers to any more"""
+
+        stages = self._path('stages')
+        objects = self._path('objects')
+        if not os.path.isdir(stages) or not os.path.isdir(objects):
+            return
+        live = set()
+        for name in os.listdir(stages):
+            record = self._read_json('stages', name)
+            if record is not None:
+                live.add(record['digest'] + '.pkl')
+        for name in os.listdir(objects):
+            if name.endswith('.pkl') and name not in live:
+                os.remove(os.path.join(objects, name))
+
+def captured_output(function, *args, **kwargs):
+    """Call function and return what it printed, so a printed report can be
+    cached as text and replayed"""
+
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        function(*args, **kwargs)
+    return buffer.getvalue()
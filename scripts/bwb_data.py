@@ -0,0 +1,51 @@
+import numpy as np
+
+from fountain_filter import filter_features, property_where, table_mask
+from fountain_table import BWB_FIELDS, table_from_geojson
+from geojson_stream import iter_features
+from snapshot_cache import load_cached_table
+
+BWB_WFS_FILE = '../data/berlin_trinkbrunnen_wfs.json'
+
+def read_bwb_snapshot(path, where=None, bbox=None):
+    """Parse a BWB WFS snapshot into a FountainTable, streaming the features
+    and keeping only the properties the table needs (and, with where/bbox,
+    only the matching features)"""
+
+    features = iter_features(path, properties=list(BWB_FIELDS.values()))
+    features = filter_features(features, property_where(where), bbox)
+    return table_from_geojson(features, BWB_FIELDS)
+
+def load_bwb_table(path=BWB_WFS_FILE, use_cache=True):
+    """Load the BWB WFS snapshot as a FountainTable.
+
+    The first load converts the snapshot into memory-mapped columns under
+    ../data/cache; later loads open those directly until the snapshot's
+    content hash changes.
+    """
+
+    if not use_cache:
+        return read_bwb_snapshot(path)
+    return load_cached_table(path, read_bwb_snapshot, 'bwb')
+
+def load_bwb(where=None, bbox=None, path=BWB_WFS_FILE, use_cache=True):
+    """Load the BWB fountains that match where and lie inside bbox.
+
+    where maps table columns to a value or a list of accepted values, e.g.
+    {'betriebszustand': 'in Betrieb', 'typ': ['Trinkbrunnen']}; bbox is
+    (min_lon, min_lat, max_lon, max_lat). With the cache the predicates run
+    on the memory-mapped columns (categorical codes, lat/lon) and only the
+    selected rows are copied; without it, rejected features are dropped
+    while the snapshot is parsed.
+    """
+
+    unknown = set(where or ()) - set(BWB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown BWB column(s): {', '.join(sorted(unknown))}")
+    if not use_cache:
+        return read_bwb_snapshot(path, where, bbox)
+
+    table = load_bwb_table(path)
+    if not where and bbox is None:
+        return table
+    return table.take(np.flatnonzero(table_mask(table, where, bbox)))
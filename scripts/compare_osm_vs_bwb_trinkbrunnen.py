@@ -1,148 +1,217 @@
+import argparse
 import json
-import pandas as pd
-import geopandas as gpd
-import osmnx as ox
-import folium
-from folium import plugins
+import os
 import numpy as np
-from shapely.geometry import Point
-from geopy.distance import geodesic
+from bwb_data import BWB_WFS_FILE, load_bwb
+from build_cache import BuildCache, captured_output
+from fountain_filter import parse_bbox, parse_where
+from fountain_table import osm_table_from_features
+from osm_cache import BERLIN_PLACE, DRINKING_WATER_TAGS, cached_features_from_place, osm_source
+from osm_extract import read_osm_extract
+from kml_ingest import read_google_source
+from assignment import ASSIGNMENT_MODES, assign, sweep_assign, sweep_statistics
+from geodesy import lonlat_to_utm
+from matching import DEFAULT_TILE_SIZE_M, candidate_pairs_arrays, tiled_candidate_pairs
+from incremental_matching import (bwb_feature_keys, incremental_assign, load_match_state, match_state_path,
+                                  osm_feature_keys, save_match_state)
+from map_data import BWB_MAP_COLUMNS, OSM_MAP_COLUMNS, collection_from, map_data_path, map_outputs, write_map_data
+from tile_pyramid import DEFAULT_MAX_ZOOM, DEFAULT_MIN_ZOOM, build_pyramid
 import warnings
 warnings.filterwarnings('ignore')
 
-def fetch_osm_drinking_fountains():
-    """Fetch drinking fountain data from OpenStreetMap for Berlin"""
+COMPARISON_MAP_FILE = 'trinkbrunnen_osm_vs_bwb_comparison.html'
+
+def fetch_osm_drinking_fountains(osm_file=None, refresh=False):
+    """Fetch drinking fountain data from OpenStreetMap for Berlin, or read it
+    from a local .osm.pbf / .osm extract when osm_file is given"""
+    
+    if osm_file:
+        print(f"Reading drinking fountains from OSM extract {osm_file}...")
+        osm_df = read_osm_extract(osm_file).to_frame()
+        print(f"Found {len(osm_df)} drinking water features in the extract")
+        return osm_df
     
     print("Fetching drinking fountains from OpenStreetMap...")
     
-    # Define Berlin boundary
-    berlin = ox.geocode_to_gdf("Berlin, Germany")
-    
-    # Define tags for drinking fountains
-    tags = {
-        'amenity': 'drinking_water'
-    }
-    
     try:
-        # Fetch drinking water features
-        drinking_water = ox.features_from_place("Berlin, Germany", tags=tags)
+        # Fetch drinking water features (shared on-disk cache, see osm_cache.py)
+        drinking_water = cached_features_from_place(BERLIN_PLACE, DRINKING_WATER_TAGS, refresh=refresh)
         
         print(f"Found {len(drinking_water)} drinking water features in OSM")
         
-        # Convert to points (some might be polygons)
-        points = []
-        for idx, row in drinking_water.iterrows():
-            geom = row.geometry
-            if geom.geom_type == 'Point':
-                points.append({
-                    'osm_id': row.name[1] if isinstance(row.name, tuple) else row.name,
-                    'osm_type': row.name[0] if isinstance(row.name, tuple) else 'unknown',
-                    'lat': geom.y,
-                    'lon': geom.x,
-                    'name': row.get('name', ''),
-                    'operator': row.get('operator', ''),
-                    'source': row.get('source', ''),
-                    'description': row.get('description', ''),
-                    'website': row.get('website', ''),
-                    'geometry': geom
-                })
-            elif geom.geom_type in ['Polygon', 'MultiPolygon']:
-                # Use centroid for polygons
-                centroid = geom.centroid
-                points.append({
-                    'osm_id': row.name[1] if isinstance(row.name, tuple) else row.name,
-                    'osm_type': row.name[0] if isinstance(row.name, tuple) else 'unknown',
-                    'lat': centroid.y,
-                    'lon': centroid.x,
-                    'name': row.get('name', ''),
-                    'operator': row.get('operator', ''),
-                    'source': row.get('source', ''),
-                    'description': row.get('description', ''),
-                    'website': row.get('website', ''),
-                    'geometry': centroid
-                })
-        
-        osm_df = pd.DataFrame(points)
+        # Convert to points (centroids for polygons) in one vectorized pass
+        osm_df = osm_table_from_features(drinking_water).to_frame()
         print(f"Converted to {len(osm_df)} point features")
         
         return osm_df
         
     except Exception as e:
         print(f"Error fetching OSM data: {str(e)}")
+        import pandas as pd
         return pd.DataFrame()
 
-def load_bwb_data():
-    """Load the official BWB Trinkbrunnen data"""
+def load_osm_data(osm_file=None, refresh=False, bbox=None):
+    """fetch_osm_drinking_fountains, keeping only the fountains inside bbox"""
+    
+    osm_df = fetch_osm_drinking_fountains(osm_file, refresh=refresh)
+    if bbox is not None and len(osm_df):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        osm_df = osm_df[osm_df['lon'].between(min_lon, max_lon) & osm_df['lat'].between(min_lat, max_lat)]
+        osm_df = osm_df.reset_index(drop=True)
+        print(f"Kept {len(osm_df)} OSM drinking fountains inside the bounding box")
+    return osm_df
+
+def osm_data(osm_file=None, refresh=False, bbox=None):
+    """load_osm_data as a build stage: no OSM fountains is an error rather
+    than a result to cache and compare against"""
+    
+    osm_df = load_osm_data(osm_file, refresh, bbox)
+    if len(osm_df) == 0:
+        raise ValueError("No OSM data found. Cannot perform comparison.")
+    return osm_df
+
+def load_bwb_data(where=None, bbox=None):
+    """Load the official BWB Trinkbrunnen data, optionally only the
+    fountains matching where / inside bbox"""
     
     print("Loading official BWB Trinkbrunnen data...")
     
-    with open('../data/berlin_trinkbrunnen_wfs.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    bwb_points = []
-    for feature in data['features']:
-        coords = feature['geometry']['coordinates']
-        props = feature['properties']
-        
-        bwb_points.append({
-            'bwb_id': props.get('oid', ''),
-            'nummer': props.get('trinkbrunnennummer', ''),
-            'typ': props.get('typ', ''),
-            'strasse': props.get('strasse', ''),
-            'einbaujahr': props.get('einbaujahr', ''),
-            'betriebszustand': props.get('betriebszustand', ''),
-            'lat': coords[1],
-            'lon': coords[0],
-            'geometry': Point(coords[0], coords[1])
-        })
-    
-    bwb_df = pd.DataFrame(bwb_points)
+    bwb_df = load_bwb(where=where, bbox=bbox).to_frame()
     print(f"Loaded {len(bwb_df)} BWB Trinkbrunnen")
     
     return bwb_df
 
-def find_matches(osm_df, bwb_df, max_distance_m=50):
+def stage_params(where=None, bbox=None):
+    """where and bbox as build stage parameters; an empty filter counts as
+    none, so every entry point keys the 'load' and 'osm' stages alike"""
+    
+    return [where or None, list(bbox) if bbox else None]
+
+def load_stage(cache, where=None, bbox=None):
+    """load_bwb_data as the 'load' build stage, shared by the map scripts and
+    pipeline.py so they all key their maps on the same artifact"""
+    
+    return cache.stage('load', lambda: load_bwb_data(where, bbox), inputs=[BWB_WFS_FILE],
+                       params=stage_params(where, bbox))
+
+def osm_stage(cache, osm_file=None, refresh=False, bbox=None):
+    """osm_data as the 'osm' build stage, see load_stage"""
+    
+    osm_files, osm_params, stale = osm_source(osm_file)
+    return cache.stage('osm', lambda: osm_data(osm_file, refresh, bbox), inputs=osm_files,
+                       params=osm_params + stage_params(bbox=bbox)[1:], force=refresh or stale)
+
+def projected_coords(df):
+    """Return UTM 33N (EPSG:25833) x/y arrays for a frame, using the published
+    BWB rechtswert/hochwert where present and projecting lat/lon otherwise"""
+    
+    if 'rechtswert' in df.columns and 'hochwert' in df.columns:
+        import pandas as pd
+        x = pd.to_numeric(df['rechtswert'], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(df['hochwert'], errors='coerce').to_numpy(dtype=float)
+    else:
+        x = np.full(len(df), np.nan)
+        y = np.full(len(df), np.nan)
+    
+    missing = np.isnan(x) | np.isnan(y)
+    if missing.any():
+        lon = df['lon'].to_numpy(dtype=float)[missing]
+        lat = df['lat'].to_numpy(dtype=float)[missing]
+        x[missing], y[missing] = lonlat_to_utm(lon, lat)
+    
+    return x, y
+
+def match_arrays(df):
+    """Coordinate arrays of a frame in the layout the matcher works on"""
+    
+    x, y = projected_coords(df)
+    return {
+        'x': x,
+        'y': y,
+        'lat': df['lat'].to_numpy(dtype=float),
+        'lon': df['lon'].to_numpy(dtype=float),
+    }
+
+def candidate_pairs(osm_df, bwb_df, max_distance_m, refine=True, tile_size_m=None, workers=None):
+    """Return (osm_pos, bwb_pos, distance_m) arrays for all pairs closer than
+    max_distance_m. With tile_size_m the work is split into spatial tiles
+    that are matched in parallel worker processes."""
+    
+    osm = match_arrays(osm_df)
+    bwb = match_arrays(bwb_df)
+    
+    if tile_size_m:
+        return tiled_candidate_pairs(osm, bwb, max_distance_m, refine=refine,
+                                     tile_size_m=tile_size_m, workers=workers)
+    return candidate_pairs_arrays(osm, bwb, max_distance_m, refine=refine)
+
+def match_assignments(osm_df, bwb_df, max_distance_m, refine, assignment, tile_size_m, workers):
+    """(osm_pos, bwb_pos, distance_m) for every match, computed from scratch"""
+    
+    pair_osm, pair_bwb, pair_dist = candidate_pairs(osm_df, bwb_df, max_distance_m, refine=refine,
+                                                    tile_size_m=tile_size_m, workers=workers)
+    print(f"Evaluated {len(pair_osm)} candidate pairs within {max_distance_m}m")
+    return assign(len(osm_df), pair_osm, pair_bwb, pair_dist, mode=assignment)
+
+def incremental_assignments(osm_df, bwb_df, max_distance_m, refine, assignment, tile_size_m, workers,
+                            state_path=None):
+    """Like match_assignments, but re-match only the neighbourhoods of
+    fountains that changed since the previous incremental run, then
+    persist the patched match table for the next one"""
+    
+    state_path = state_path or match_state_path()
+    osm_keys, bwb_keys = osm_feature_keys(osm_df), bwb_feature_keys(bwb_df)
+    osm, bwb = match_arrays(osm_df), match_arrays(bwb_df)
+    
+    assignments, stats = incremental_assign(osm_keys, osm, bwb_keys, bwb, load_match_state(state_path),
+                                            max_distance_m, refine=refine, mode=assignment)
+    if assignments is None:
+        print(f"Full match ({stats})")
+        assignments = match_assignments(osm_df, bwb_df, max_distance_m, refine, assignment, tile_size_m, workers)
+    else:
+        print(f"Incremental match: {stats['osm_changed']} OSM and {stats['bwb_changed']} BWB fountains changed; "
+              f"re-matched {stats['osm_rematched']} OSM / {stats['bwb_rematched']} BWB in the affected "
+              f"neighbourhoods, kept {stats['kept']} matches")
+    
+    save_match_state(state_path, osm_keys, osm, bwb_keys, bwb, assignments,
+                     {'max_distance_m': max_distance_m, 'refine': refine, 'mode': assignment})
+    return assignments
+
+def find_matches(osm_df, bwb_df, max_distance_m=50, refine=True, assignment='greedy',
+                 tile_size_m=None, workers=None, incremental=False):
     """Find matches between OSM and BWB data based on proximity"""
     
-    print(f"\nFinding matches within {max_distance_m}m...")
+    print(f"\nFinding matches within {max_distance_m}m ({assignment} assignment)...")
+    if tile_size_m:
+        print(f"Using {tile_size_m:g}m tiles on {workers or os.cpu_count()} worker processes")
     
-    matches = []
-    osm_matched = set()
-    bwb_matched = set()
+    if incremental:
+        assignments = incremental_assignments(osm_df, bwb_df, max_distance_m, refine, assignment,
+                                              tile_size_m, workers)
+    else:
+        assignments = match_assignments(osm_df, bwb_df, max_distance_m, refine, assignment,
+                                        tile_size_m, workers)
     
-    for i, osm_row in osm_df.iterrows():
-        osm_point = (osm_row['lat'], osm_row['lon'])
-        
-        closest_distance = float('inf')
-        closest_bwb_idx = None
-        
-        for j, bwb_row in bwb_df.iterrows():
-            if j in bwb_matched:
-                continue
-                
-            bwb_point = (bwb_row['lat'], bwb_row['lon'])
-            distance = geodesic(osm_point, bwb_point).meters
-            
-            if distance < max_distance_m and distance < closest_distance:
-                closest_distance = distance
-                closest_bwb_idx = j
-        
-        if closest_bwb_idx is not None:
-            matches.append({
-                'osm_idx': i,
-                'bwb_idx': closest_bwb_idx,
-                'distance_m': closest_distance,
-                'osm_id': osm_row['osm_id'],
-                'bwb_id': bwb_df.iloc[closest_bwb_idx]['bwb_id'],
-                'osm_operator': osm_row['operator'],
-                'bwb_typ': bwb_df.iloc[closest_bwb_idx]['typ']
-            })
-            osm_matched.add(i)
-            bwb_matched.add(closest_bwb_idx)
+    matches = []
+    for i, j, distance in assignments:
+        osm_row = osm_df.iloc[i]
+        bwb_row = bwb_df.iloc[j]
+        matches.append({
+            'osm_idx': osm_df.index[i],
+            'bwb_idx': bwb_df.index[j],
+            'distance_m': distance,
+            'osm_id': osm_row['osm_id'],
+            'bwb_id': bwb_row['bwb_id'],
+            'osm_operator': osm_row['operator'],
+            'bwb_typ': bwb_row['typ']
+        })
     
+    import pandas as pd
     matches_df = pd.DataFrame(matches)
     
     # Identify unmatched entries
+    osm_matched = set(matches_df['osm_idx']) if len(matches_df) else set()
+    bwb_matched = set(matches_df['bwb_idx']) if len(matches_df) else set()
     osm_unmatched = osm_df[~osm_df.index.isin(osm_matched)].copy()
     bwb_unmatched = bwb_df[~bwb_df.index.isin(bwb_matched)].copy()
     
@@ -152,26 +221,11 @@ def find_matches(osm_df, bwb_df, max_distance_m=50):
     
     return matches_df, osm_unmatched, bwb_unmatched
 
-def create_comparison_map(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched):
-    """Create a Folium map comparing OSM and BWB data"""
-    
-    print("\nCreating comparison map...")
-    
-    # Calculate map center
-    all_lats = list(osm_df['lat']) + list(bwb_df['lat'])
-    all_lons = list(osm_df['lon']) + list(bwb_df['lon'])
-    center_lat = sum(all_lats) / len(all_lats)
-    center_lon = sum(all_lons) / len(all_lons)
-    
-    # Create base map
-    m = folium.Map(
-        location=[center_lat, center_lon],
-        zoom_start=11,
-        tiles='OpenStreetMap'
-    )
+def add_comparison_markers(m, osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched):
+    """One CircleMarker with its own popup per fountain, in three groups;
+    returns the groups"""
     
-    # Add tile layers
-    folium.TileLayer('cartodbpositron', name='CartoDB Positron').add_to(m)
+    import folium
     
     # Create feature groups for different datasets
     bwb_group = folium.FeatureGroup(name='BWB Official (244)', show=True)
@@ -227,8 +281,8 @@ def create_comparison_map(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatch
     
     # Add matched fountains (green)
     for idx, match in matches_df.iterrows():
-        osm_row = osm_df.iloc[match['osm_idx']]
-        bwb_row = bwb_df.iloc[match['bwb_idx']]
+        osm_row = osm_df.loc[match['osm_idx']]
+        bwb_row = bwb_df.loc[match['bwb_idx']]
         
         popup_html = f"""
         <div style="font-family: Arial, sans-serif; width: 300px;">
@@ -272,6 +326,180 @@ def create_comparison_map(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatch
     bwb_group.add_to(m)
     osm_group.add_to(m)
     matches_group.add_to(m)
+    return [bwb_group, osm_group, matches_group]
+
+BWB_ONLY_POPUP = """
+<div style="font-family: Arial, sans-serif; width: 250px;">
+    <h4 style="color: red; margin-bottom: 10px;">🚰 BWB Only</h4>
+    <p><b>Type:</b> {typ}</p>
+    <p><b>Number:</b> {nummer}</p>
+    <p><b>Street:</b> {strasse}</p>
+    <p><b>Year:</b> {einbaujahr}</p>
+    <p><b>Status:</b> {betriebszustand}</p>
+</div>
+"""
+
+OSM_ONLY_POPUP = """
+<div style="font-family: Arial, sans-serif; width: 250px;">
+    <h4 style="color: blue; margin-bottom: 10px;">💧 OSM Only</h4>
+    <p><b>OSM ID:</b> {osm_id}</p>
+    <p><b>Name:</b> {name}</p>
+    <p><b>Operator:</b> {operator}</p>
+    <p><b>Source:</b> {source}</p>
+</div>
+"""
+
+MATCH_POPUP = """
+<div style="font-family: Arial, sans-serif; width: 300px;">
+    <h4 style="color: green; margin-bottom: 10px;">✅ Matched</h4>
+    <p><b>Distance:</b> {distance_m}m</p>
+    <hr>
+    <h5>BWB Data:</h5>
+    <p><b>Type:</b> {typ}</p>
+    <p><b>Street:</b> {strasse}</p>
+    <p><b>Number:</b> {nummer}</p>
+    <hr>
+    <h5>OSM Data:</h5>
+    <p><b>OSM ID:</b> {osm_osm_id}</p>
+    <p><b>Operator:</b> {osm_operator}</p>
+    <p><b>Name:</b> {osm_name}</p>
+</div>
+"""
+
+def add_comparison_sidecar_layers(m, osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched, map_file):
+    """The three groups as layers over the data file shared by all maps:
+    the page only carries row positions (and match distances), the points
+    and popup fields are loaded after first paint. Returns the layers."""
+    
+    from map_layers import PointLayer
+    
+    data_file, data_url = map_data_path(map_file)
+    keys = write_map_data(data_file, {
+        'bwb': collection_from(bwb_df, BWB_MAP_COLUMNS),
+        'osm': collection_from(osm_df, OSM_MAP_COLUMNS),
+    })
+    
+    bwb_only = bwb_df.index.get_indexer(bwb_unmatched.index)
+    osm_only = osm_df.index.get_indexer(osm_unmatched.index)
+    matched_bwb = bwb_df.index.get_indexer(matches_df['bwb_idx']) if len(matches_df) else []
+    matched_osm = osm_df.index.get_indexer(matches_df['osm_idx']) if len(matches_df) else []
+    distances = [round(float(d), 1) for d in matches_df['distance_m']] if len(matches_df) else []
+    
+    layers = [
+        PointLayer(data_url=data_url, collection=keys['bwb'], subset=bwb_only, default_color='red', radius=8, weight=2,
+                   popup_template=BWB_ONLY_POPUP.strip(), tooltip_template="BWB Only: {typ}", max_width=300,
+                   name=f'BWB Official ({len(bwb_df)})'),
+        PointLayer(data_url=data_url, collection=keys['osm'], subset=osm_only, default_color='blue', radius=8, weight=2,
+                   popup_template=OSM_ONLY_POPUP.strip(), tooltip_template="OSM Only: {name}", max_width=300,
+                   missing='N/A', name='OSM Data'),
+        # Matches sit at the BWB location, with a line to the OSM node when
+        # they are more than 10 m apart
+        PointLayer(data_url=data_url, collection=keys['bwb'], subset=matched_bwb, extra={'distance_m': distances},
+                   joins={'osm': (keys['osm'], matched_osm)}, link=('osm', 'distance_m', 10),
+                   default_color='green', radius=8, weight=2,
+                   popup_template=MATCH_POPUP.strip(), tooltip_template="Match: {typ}",
+                   name='Matches'),
+    ]
+    for layer in layers:
+        layer.add_to(m)
+    return layers
+
+def add_comparison_canvas_layers(m, osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched):
+    """The three groups as packed coordinate arrays drawn on a canvas, for
+    comparisons with tens of thousands of fountains; returns the layers"""
+    
+    from map_layers import PackedPointLayer
+    
+    bwb_layer = PackedPointLayer(bwb_unmatched['lat'], bwb_unmatched['lon'],
+                                 {name: bwb_unmatched[name] for name in BWB_MAP_COLUMNS if name in bwb_unmatched},
+                                 default_color='red', radius=8, weight=2,
+                                 popup_template=BWB_ONLY_POPUP.strip(), tooltip_template="BWB Only: {typ}",
+                                 max_width=300, name=f'BWB Official ({len(bwb_df)})').add_to(m)
+    osm_layer = PackedPointLayer(osm_unmatched['lat'], osm_unmatched['lon'],
+                                 {name: osm_unmatched[name] for name in OSM_MAP_COLUMNS if name in osm_unmatched},
+                                 default_color='blue', radius=8, weight=2,
+                                 popup_template=OSM_ONLY_POPUP.strip(), tooltip_template="OSM Only: {name}",
+                                 max_width=300, name='OSM Data').add_to(m)
+    
+    # Matches sit at the BWB location, with a line to the OSM node when
+    # they are more than 10 m apart
+    bwb_matched = bwb_df.loc[matches_df['bwb_idx']] if len(matches_df) else bwb_df.iloc[:0]
+    osm_matched = osm_df.loc[matches_df['osm_idx']] if len(matches_df) else osm_df.iloc[:0]
+    columns = {name: bwb_matched[name] for name in BWB_MAP_COLUMNS if name in bwb_matched}
+    columns.update({f'osm_{name}': osm_matched[name] for name in OSM_MAP_COLUMNS if name in osm_matched})
+    distances = matches_df['distance_m'].to_numpy(dtype=float) if len(matches_df) else np.empty(0)
+    columns['distance_m'] = np.round(distances, 1)
+    far = distances > 10
+    segments = (bwb_matched['lat'].to_numpy()[far], bwb_matched['lon'].to_numpy()[far],
+                osm_matched['lat'].to_numpy()[far], osm_matched['lon'].to_numpy()[far])
+    matches_layer = PackedPointLayer(bwb_matched['lat'], bwb_matched['lon'], columns, segments=segments,
+                                     line_color='green', default_color='green', radius=8, weight=2,
+                                     popup_template=MATCH_POPUP.strip(), tooltip_template="Match: {typ}",
+                                     name='Matches').add_to(m)
+    return [bwb_layer, osm_layer, matches_layer]
+
+HEX_TOOLTIP = """
+<b>{matched} of {bwb}</b> BWB fountains in OSM ({coverage}%)<br>
+{osm} OSM fountains
+"""
+
+def add_comparison_hex_layer(m, osm_df, bwb_df, matches_df, points):
+    """Hexagon density layer over all three sets (hex_grid.py), coloured by
+    the share of BWB fountains matched in each cell. It replaces the point
+    layers up to hex_grid.DEFAULT_MAX_ZOOM."""
+    
+    from hex_grid import density_grids
+    from map_layers import HexDensityLayer
+    
+    matched_bwb = bwb_df.loc[matches_df['bwb_idx']] if len(matches_df) else bwb_df.iloc[:0]
+    grids = density_grids({
+        'bwb': (bwb_df['lat'].to_numpy(), bwb_df['lon'].to_numpy()),
+        'osm': (osm_df['lat'].to_numpy(), osm_df['lon'].to_numpy()),
+        'matched': (matched_bwb['lat'].to_numpy(), matched_bwb['lon'].to_numpy()),
+    }, coverage=('matched', 'bwb'))
+    print(f"Hexagon cells per zoom: {', '.join(f'{zoom}: {len(grid['q'])}' for zoom, grid in grids.items())}")
+    # Added after the point layers, which it hides while hexagons are shown
+    HexDensityLayer(grids, tooltip_template=HEX_TOOLTIP.strip(), missing='-', hide=points,
+                    name='Coverage (hexagons)').add_to(m)
+
+def create_comparison_map(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched, render='markers',
+                          map_file=COMPARISON_MAP_FILE, hexbins=False):
+    """Create a Folium map comparing OSM and BWB data. render 'sidecar'
+    loads the points from the data file shared by all maps, 'canvas' embeds
+    them as packed arrays drawn on a canvas. hexbins shows a hexagon
+    coverage layer instead of the points at low zoom."""
+    
+    import folium
+    from folium import plugins
+    
+    print("\nCreating comparison map...")
+    
+    # Calculate map center
+    all_lats = list(osm_df['lat']) + list(bwb_df['lat'])
+    all_lons = list(osm_df['lon']) + list(bwb_df['lon'])
+    center_lat = sum(all_lats) / len(all_lats)
+    center_lon = sum(all_lons) / len(all_lons)
+    
+    # Create base map
+    m = folium.Map(
+        location=[center_lat, center_lon],
+        zoom_start=11,
+        tiles='OpenStreetMap',
+        prefer_canvas=(render == 'canvas')
+    )
+    
+    # Add tile layers
+    folium.TileLayer('cartodbpositron', name='CartoDB Positron').add_to(m)
+    
+    if render == 'sidecar':
+        points = add_comparison_sidecar_layers(m, osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched, map_file)
+    elif render == 'canvas':
+        points = add_comparison_canvas_layers(m, osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched)
+    else:
+        points = add_comparison_markers(m, osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched)
+    
+    if hexbins:
+        add_comparison_hex_layer(m, osm_df, bwb_df, matches_df, points)
     
     # Add legend
     legend_html = f"""
@@ -307,12 +535,45 @@ def create_comparison_map(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatch
     plugins.Fullscreen().add_to(m)
     
     # Save map
-    map_file = 'trinkbrunnen_osm_vs_bwb_comparison.html'
     m.save(map_file)
     
     print(f"Comparison map saved as: {map_file}")
     return map_file
 
+def export_comparison_tiles(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched, directory,
+                            min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM):
+    """Write the matched, BWB-only and OSM-only sets as a tile pyramid with
+    a viewer page (tile_pyramid.py), for datasets too large for one map"""
+    
+    print(f"\nBuilding tile pyramid (zoom {min_zoom}-{max_zoom}) in {directory}...")
+    
+    matched_bwb = bwb_df.loc[matches_df['bwb_idx']] if len(matches_df) else bwb_df.iloc[:0]
+    layers = {
+        'matched': {
+            'lat': matched_bwb['lat'].to_numpy(), 'lon': matched_bwb['lon'].to_numpy(),
+            'properties': {
+                'bwb_id': matched_bwb['bwb_id'].to_numpy(),
+                'typ': matched_bwb['typ'].to_numpy(dtype=object),
+                'osm_id': matches_df['osm_id'].to_numpy() if len(matches_df) else [],
+                'distance_m': matches_df['distance_m'].round(1).to_numpy() if len(matches_df) else [],
+            },
+        },
+        'bwb_only': {
+            'lat': bwb_unmatched['lat'].to_numpy(), 'lon': bwb_unmatched['lon'].to_numpy(),
+            'properties': {name: bwb_unmatched[name].to_numpy(dtype=object)
+                           for name in ('bwb_id', 'nummer', 'typ', 'strasse')},
+        },
+        'osm_only': {
+            'lat': osm_unmatched['lat'].to_numpy(), 'lon': osm_unmatched['lon'].to_numpy(),
+            'properties': {name: osm_unmatched[name].to_numpy(dtype=object)
+                           for name in ('osm_id', 'osm_type', 'name', 'operator') if name in osm_unmatched},
+        },
+    }
+    tiles_per_zoom = build_pyramid(layers, directory, min_zoom, max_zoom)
+    print(f"Wrote {sum(tiles_per_zoom.values())} tiles; open {os.path.join(directory, 'index.html')} "
+          f"through a web server")
+    return tiles_per_zoom
+
 def generate_analysis_report(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched):
     """Generate a detailed analysis report"""
     
@@ -333,17 +594,19 @@ def generate_analysis_report(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unma
     
     if len(matches_df) > 0:
         print(f"\n📏 MATCH QUALITY:")
-        print(f"Average distance:      {matches_df['distance_m'].mean():5.1f}m")
-        print(f"Median distance:       {matches_df['distance_m'].median():5.1f}m")
-        print(f"Max distance:          {matches_df['distance_m'].max():5.1f}m")
+        distances = matches_df['distance_m'].to_numpy(dtype=float)
+        print(f"Average distance:      {np.mean(distances):5.1f}m")
+        print(f"Median distance:       {np.median(distances):5.1f}m")
+        print(f"Max distance:          {np.max(distances):5.1f}m")
         
-        close_matches = len(matches_df[matches_df['distance_m'] <= 10])
+        close_matches = int(np.count_nonzero(distances <= 10))
         print(f"Very close matches (≤10m): {close_matches} ({close_matches/len(matches_df)*100:.1f}%)")
     
     # Analyze BWB fountain types in unmatched
     if len(bwb_unmatched) > 0:
         print(f"\n🚰 MISSING BWB FOUNTAIN TYPES:")
         missing_types = bwb_unmatched['typ'].value_counts()
+        missing_types = missing_types[missing_types > 0]
         for typ, count in missing_types.items():
             print(f"  {typ:15}: {count:3d}")
     
@@ -361,35 +624,190 @@ def generate_analysis_report(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unma
         if year and year != 'null':
             print(f"  {year}: {count:3d} fountains")
 
+def load_google_data(path):
+    """Load the Google My Maps fountains from a KML/KMZ export or the GeoJSON
+    written by fetch_trinkbrunnen_google_maps.py --kml"""
+    
+    print(f"Loading Google My Maps Trinkbrunnen from {path}...")
+    google_df = read_google_source(path).to_frame()
+    print(f"Loaded {len(google_df)} located Google My Maps fountains")
+    return google_df
+
+def generate_google_report(google_df, bwb_df, max_distance_m=50, assignment='greedy'):
+    """Match the Google My Maps fountains against BWB the same way as OSM and
+    print how well they cover the official data"""
+    
+    print("\n" + "="*60)
+    print("GOOGLE MY MAPS vs BWB")
+    print("="*60)
+    
+    if len(google_df) == 0:
+        print("No Google fountains with coordinates; export the My Map as KML/KMZ")
+        print("and pass it with --google, or run fetch_trinkbrunnen_google_maps.py --kml.")
+        return
+    
+    pair_google, pair_bwb, pair_dist = candidate_pairs(google_df, bwb_df, max_distance_m)
+    matches = assign(len(google_df), pair_google, pair_bwb, pair_dist, mode=assignment)
+    distances = np.array([distance for _, _, distance in matches], dtype=float)
+    
+    print(f"Google My Maps fountains: {len(google_df):3d}")
+    print(f"Matched to BWB (≤{max_distance_m:g}m): {len(matches):3d} ({len(matches)/len(bwb_df)*100:5.1f}% of BWB)")
+    print(f"BWB fountains not on the My Map: {len(bwb_df) - len(matches):3d}")
+    print(f"Google-only fountains:    {len(google_df) - len(matches):3d}")
+    if len(distances):
+        print(f"Median distance:          {np.median(distances):5.1f}m")
+        print(f"Max distance:             {np.max(distances):5.1f}m")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare OSM and BWB Trinkbrunnen data for Berlin")
+    parser.add_argument('--osm-file', metavar='PATH',
+                        help="Read OSM data from a local .osm.pbf/.osm extract instead of Overpass")
+    parser.add_argument('--refresh-osm', action='store_true',
+                        help="Ignore the cached Overpass result and query again")
+    parser.add_argument('--max-distance', type=float, default=50,
+                        help="Maximum distance in metres for a match (default: 50)")
+    parser.add_argument('--assignment', choices=ASSIGNMENT_MODES, default='greedy',
+                        help="greedy: closest free BWB fountain in OSM order; "
+                             "optimal: minimum total distance per connected group (default: greedy)")
+    parser.add_argument('--sweep', type=parse_radii, metavar='RADII',
+                        help="Comma-separated radii in metres, e.g. 10,25,50,100; "
+                             "also writes match_sweep.json")
+    parser.add_argument('--tile-size', type=float, nargs='?', const=DEFAULT_TILE_SIZE_M, metavar='METRES',
+                        help="Match in spatial tiles on a process pool to spread the CPU work of very large "
+                             "inputs; the inputs and all pairs still stay in memory "
+                             f"(default tile size: {DEFAULT_TILE_SIZE_M}m)")
+    parser.add_argument('--workers', type=int, help="Worker processes for --tile-size (default: CPU count)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Re-match only around fountains that changed since the last --incremental run "
+                             "(match table kept in ../data/cache/matches)")
+    parser.add_argument('--google', metavar='PATH',
+                        help="Also compare a Google My Maps KML/KMZ export (or the GeoJSON made from it) with BWB")
+    parser.add_argument('--render', choices=('markers', 'sidecar', 'canvas'), default='markers',
+                        help="markers: one marker and popup per fountain; sidecar: load points and popup "
+                             "fields from the data file shared with the other maps; canvas: packed coordinate "
+                             "arrays drawn on a canvas, for 10k+ points (default: markers)")
+    parser.add_argument('--hexbins', action='store_true',
+                        help="Show hexagons with counts and match coverage instead of the points when zoomed out")
+    parser.add_argument('--tiles', metavar='DIR',
+                        help="Also export the comparison as a zoomable tile pyramid with a viewer page")
+    parser.add_argument('--tile-zooms', metavar='MIN-MAX', default=f"{DEFAULT_MIN_ZOOM}-{DEFAULT_MAX_ZOOM}",
+                        help=f"Zoom levels of the --tiles pyramid (default: {DEFAULT_MIN_ZOOM}-{DEFAULT_MAX_ZOOM})")
+    parser.add_argument('--where', action='append', metavar='COLUMN=VALUE[,VALUE...]',
+                        help="Only BWB fountains whose column has one of the values (repeatable; "
+                             "e.g. betriebszustand='in Betrieb')")
+    parser.add_argument('--bbox', metavar='MIN_LON,MIN_LAT,MAX_LON,MAX_LAT',
+                        help="Only fountains of both sources inside this box (WGS84 degrees)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild every stage even when its inputs are unchanged since the last run")
+    args = parser.parse_args()
+    try:
+        args.where = parse_where(args.where)
+        args.bbox = parse_bbox(args.bbox) if args.bbox else None
+        args.tile_zooms = tuple(int(z) for z in args.tile_zooms.split('-'))
+        if len(args.tile_zooms) != 2 or not 0 <= args.tile_zooms[0] <= args.tile_zooms[1] <= 22:
+            raise ValueError("--tile-zooms expects MIN-MAX between 0 and 22")
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+def match_sweep(osm_df, bwb_df, radii):
+    """Match statistics for several radii from a single candidate pass"""
+    
+    print(f"\nSweeping match radii: {', '.join(f'{r:g}m' for r in sorted(radii))}...")
+    
+    pair_osm, pair_bwb, pair_dist = candidate_pairs(osm_df, bwb_df, max(radii))
+    accepted = sweep_assign(pair_osm, pair_bwb, pair_dist)
+    return sweep_statistics(accepted, radii, len(osm_df), len(bwb_df))
+
+def generate_sweep_report(sweep_rows, output_file='match_sweep.json'):
+    """Print the radius sweep as a table and save it as JSON"""
+    
+    print("\n" + "="*60)
+    print("MATCH RADIUS SWEEP")
+    print("="*60)
+    print("Pairs are matched shortest distance first, so counts can differ")
+    print("slightly from the OSM-order greedy matcher.\n")
+    
+    def fmt(value):
+        return f"{value:6.1f}" if value is not None else "     -"
+    
+    print(f"{'Radius':>7} {'Matches':>8} {'BWB only':>9} {'OSM only':>9} {'Cover':>7} {'p50':>6} {'p90':>6} {'p95':>6} {'max':>6}")
+    for row in sweep_rows:
+        print(f"{row['radius_m']:6.0f}m {row['matches']:8d} {row['bwb_only']:9d} {row['osm_only']:9d} "
+              f"{row['coverage_pct']:6.1f}% {fmt(row['p50_m'])} {fmt(row['p90_m'])} {fmt(row['p95_m'])} {fmt(row['max_m'])}")
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({'assignment': 'distance-ordered greedy', 'radii': sweep_rows}, f, indent=2)
+    
+    print(f"\nSweep saved as: {output_file}")
+    return output_file
+
+def parse_radii(value):
+    try:
+        radii = [float(r) for r in value.split(',') if r.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid radius list: {value!r}")
+    if not radii or min(radii) <= 0:
+        raise argparse.ArgumentTypeError("radii must be positive numbers, e.g. 10,25,50,100")
+    return radii
+
 def main():
+    args = parse_args()
+    
     print("Comparing OSM and BWB Trinkbrunnen data for Berlin...")
     print("="*60)
     
     try:
+        # Every stage is skipped when its inputs are unchanged since the last
+        # run (see build_cache.py); --force rebuilds them all
+        cache = BuildCache(force=args.force)
+        
         # Load BWB data
-        bwb_df = load_bwb_data()
+        bwb = load_stage(cache, args.where, args.bbox)
         
         # Fetch OSM data
-        osm_df = fetch_osm_drinking_fountains()
-        
-        if len(osm_df) == 0:
-            print("❌ No OSM data found. Cannot perform comparison.")
-            return
+        osm = osm_stage(cache, args.osm_file, args.refresh_osm, args.bbox)
         
         # Find matches
-        matches_df, osm_unmatched, bwb_unmatched = find_matches(osm_df, bwb_df)
+        match = cache.stage('match', lambda: find_matches(
+            osm.value, bwb.value, max_distance_m=args.max_distance, assignment=args.assignment,
+            tile_size_m=args.tile_size, workers=args.workers, incremental=args.incremental
+        ), inputs=[osm, bwb], params=[args.max_distance, args.assignment])
+        
+        def comparison():
+            return (osm.value, bwb.value) + tuple(match.value)
         
         # Create comparison map
-        map_file = create_comparison_map(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched)
+        cache.stage(f'map {COMPARISON_MAP_FILE}',
+                    lambda: create_comparison_map(*comparison(), render=args.render, hexbins=args.hexbins),
+                    inputs=[osm, bwb, match], params=[args.render, args.hexbins],
+                    outputs=map_outputs(COMPARISON_MAP_FILE, args.render))
+        map_file = COMPARISON_MAP_FILE
+        
+        if args.tiles:
+            cache.stage(f'tiles {args.tiles}',
+                        lambda: export_comparison_tiles(*comparison(), args.tiles, *args.tile_zooms),
+                        inputs=[osm, bwb, match], params=[args.tile_zooms],
+                        outputs=[os.path.join(args.tiles, 'tiles.json')])
         
         # Generate analysis report
-        generate_analysis_report(osm_df, bwb_df, matches_df, osm_unmatched, bwb_unmatched)
+        report = cache.stage('report', lambda: captured_output(generate_analysis_report, *comparison()),
+                             inputs=[osm, bwb, match])
+        print(report.value, end='')
+        
+        if args.google:
+            generate_google_report(load_google_data(args.google), bwb.value,
+                                   max_distance_m=args.max_distance, assignment=args.assignment)
+        
+        if args.sweep:
+            generate_sweep_report(match_sweep(osm.value, bwb.value, args.sweep))
         
         print(f"\n✅ Analysis complete! View the interactive map: {map_file}")
         
-    except FileNotFoundError:
-        print("❌ Error: ../data/berlin_trinkbrunnen_wfs.json not found!")
-        print("Please run fetch_trinkbrunnen_wfs.py first to download the BWB data.")
+    except FileNotFoundError as e:
+        print(f"❌ Error: {e.filename} not found!")
+        if e.filename and os.path.abspath(e.filename) == os.path.abspath(BWB_WFS_FILE):
+            print("Please run fetch_trinkbrunnen_wfs.py first to download the BWB data.")
     except Exception as e:
         print(f"❌ Error: {str(e)}")
 
@@ -1,64 +1,38 @@
-import json
-import folium
-from folium import plugins
+import argparse
 import webbrowser
 import os
+from bwb_data import load_bwb_table
+from build_cache import BuildCache
+from compare_osm_vs_bwb_trinkbrunnen import load_stage
+from map_data import BWB_MAP_COLUMNS, collection_from, map_data_path, map_outputs, point_features, write_map_data
 
-def create_trinkbrunnen_map():
-    """Create an interactive Folium map of all Berlin Trinkbrunnen"""
-    
-    # Load the WFS data
-    print("Loading Trinkbrunnen data from WFS...")
-    with open('../data/berlin_trinkbrunnen_wfs.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    features = data['features']
-    print(f"Loaded {len(features)} Trinkbrunnen")
-    
-    # Calculate map center from all coordinates
-    lats = []
-    lons = []
-    for feature in features:
-        coords = feature['geometry']['coordinates']
-        lons.append(coords[0])
-        lats.append(coords[1])
-    
-    center_lat = sum(lats) / len(lats)
-    center_lon = sum(lons) / len(lons)
-    
-    print(f"Map center: {center_lat:.6f}, {center_lon:.6f}")
+MAP_FILE = 'berlin_trinkbrunnen_map.html'
+
+def or_default(value, default='N/A'):
+    """Fall back to default for properties missing from the snapshot"""
+    return default if value is None else value
+
+def add_marker_layers(m, table, type_colors):
+    """One SVG CircleMarker plus one clustered Marker per fountain, each with
+    its own popup"""
     
-    # Create the base map
-    m = folium.Map(
-        location=[center_lat, center_lon],
-        zoom_start=11,
-        tiles='OpenStreetMap'
-    )
+    import folium
+    from folium import plugins
     
-    # Add tile layers
-    folium.TileLayer('cartodbpositron', name='CartoDB Positron').add_to(m)
-    folium.TileLayer('cartodbdark_matter', name='CartoDB Dark').add_to(m)
-    
-    # Define colors for different fountain types
-    type_colors = {
-        'Kaiser Brunnen': 'blue',
-        'Wiener Brunnen': 'green', 
-        'Botsch Brunnen': 'red',
-        'Bituma-Brunnen': 'purple',
-        'Unknown': 'gray'
-    }
-    
-    # Count fountain types
-    type_counts = {}
+    # Decode the columns used in popups once
+    typen = table['typ']
+    nummern = table['nummer']
+    strassen = table['strasse']
+    einbaujahre = table['einbaujahr']
+    zustaende = table['betriebszustand']
+    eigentuemer = table['eigentuemer']
     
     # Add markers for each Trinkbrunnen
-    for i, feature in enumerate(features):
-        coords = feature['geometry']['coordinates']
-        props = feature['properties']
+    for i in range(len(table)):
+        lat, lon = table.lat[i], table.lon[i]
         
-        # Get fountain type and count
-        fountain_type = props.get('typ', 'Unknown')
-        type_counts[fountain_type] = type_counts.get(fountain_type, 0) + 1
+        # Get fountain type
+        fountain_type = or_default(typen[i], 'Unknown')
         
         # Get color for this type
         color = type_colors.get(fountain_type, 'gray')
@@ -68,22 +42,22 @@ def create_trinkbrunnen_map():
         <div style="font-family: Arial, sans-serif; width: 300px;">
             <h4 style="color: {color}; margin-bottom: 10px;">🚰 {fountain_type}</h4>
             <table style="width: 100%; border-collapse: collapse;">
-                <tr><td style="font-weight: bold; padding: 3px;">Nummer:</td><td style="padding: 3px;">{props.get('trinkbrunnennummer', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Straße:</td><td style="padding: 3px;">{props.get('strasse', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Einbaujahr:</td><td style="padding: 3px;">{props.get('einbaujahr', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Betriebszustand:</td><td style="padding: 3px;">{props.get('betriebszustand', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Eigentümer:</td><td style="padding: 3px;">{props.get('eigentuemer', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Koordinaten:</td><td style="padding: 3px;">{coords[1]:.6f}, {coords[0]:.6f}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Nummer:</td><td style="padding: 3px;">{or_default(nummern[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Straße:</td><td style="padding: 3px;">{or_default(strassen[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Einbaujahr:</td><td style="padding: 3px;">{or_default(einbaujahre[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Betriebszustand:</td><td style="padding: 3px;">{or_default(zustaende[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Eigentümer:</td><td style="padding: 3px;">{or_default(eigentuemer[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Koordinaten:</td><td style="padding: 3px;">{lat:.6f}, {lon:.6f}</td></tr>
             </table>
         </div>
         """
         
         # Create marker
         folium.CircleMarker(
-            location=[coords[1], coords[0]],  # folium expects [lat, lon]
+            location=[lat, lon],  # folium expects [lat, lon]
             radius=6,
             popup=folium.Popup(popup_html, max_width=350),
-            tooltip=f"{fountain_type} - {props.get('strasse', 'N/A')}",
+            tooltip=f"{fountain_type} - {or_default(strassen[i])}",
             color='white',
             weight=1,
             fillColor=color,
@@ -94,30 +68,158 @@ def create_trinkbrunnen_map():
     marker_cluster = plugins.MarkerCluster(name="Trinkbrunnen Cluster").add_to(m)
     
     # Add clustered markers
-    for feature in features:
-        coords = feature['geometry']['coordinates']
-        props = feature['properties']
-        fountain_type = props.get('typ', 'Unknown')
+    for i in range(len(table)):
+        lat, lon = table.lat[i], table.lon[i]
+        fountain_type = or_default(typen[i], 'Unknown')
         color = type_colors.get(fountain_type, 'gray')
         
         popup_html = f"""
         <div style="font-family: Arial, sans-serif; width: 300px;">
             <h4 style="color: {color}; margin-bottom: 10px;">🚰 {fountain_type}</h4>
             <table style="width: 100%; border-collapse: collapse;">
-                <tr><td style="font-weight: bold; padding: 3px;">Nummer:</td><td style="padding: 3px;">{props.get('trinkbrunnennummer', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Straße:</td><td style="padding: 3px;">{props.get('strasse', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Einbaujahr:</td><td style="padding: 3px;">{props.get('einbaujahr', 'N/A')}</td></tr>
-                <tr><td style="font-weight: bold; padding: 3px;">Betriebszustand:</td><td style="padding: 3px;">{props.get('betriebszustand', 'N/A')}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Nummer:</td><td style="padding: 3px;">{or_default(nummern[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Straße:</td><td style="padding: 3px;">{or_default(strassen[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Einbaujahr:</td><td style="padding: 3px;">{or_default(einbaujahre[i])}</td></tr>
+                <tr><td style="font-weight: bold; padding: 3px;">Betriebszustand:</td><td style="padding: 3px;">{or_default(zustaende[i])}</td></tr>
             </table>
         </div>
         """
         
         folium.Marker(
-            location=[coords[1], coords[0]],
+            location=[lat, lon],
             popup=folium.Popup(popup_html, max_width=350),
             tooltip=f"{fountain_type}",
             icon=folium.Icon(color=color, icon='tint', prefix='fa')
         ).add_to(marker_cluster)
+
+COMPACT_POPUP_TEMPLATE = """
+<div style="font-family: Arial, sans-serif; width: 300px;">
+    <h4 style="color: {color}; margin-bottom: 10px;">🚰 {typ}</h4>
+    <table style="width: 100%; border-collapse: collapse;">
+        <tr><td style="font-weight: bold; padding: 3px;">Nummer:</td><td style="padding: 3px;">{nummer}</td></tr>
+        <tr><td style="font-weight: bold; padding: 3px;">Straße:</td><td style="padding: 3px;">{strasse}</td></tr>
+        <tr><td style="font-weight: bold; padding: 3px;">Einbaujahr:</td><td style="padding: 3px;">{einbaujahr}</td></tr>
+        <tr><td style="font-weight: bold; padding: 3px;">Betriebszustand:</td><td style="padding: 3px;">{betriebszustand}</td></tr>
+        <tr><td style="font-weight: bold; padding: 3px;">Eigentümer:</td><td style="padding: 3px;">{eigentuemer}</td></tr>
+        <tr><td style="font-weight: bold; padding: 3px;">Koordinaten:</td><td style="padding: 3px;">{lat}, {lon}</td></tr>
+    </table>
+</div>
+"""
+
+POPUP_COLUMNS = ('typ', 'nummer', 'strasse', 'einbaujahr', 'betriebszustand', 'eigentuemer')
+
+def add_compact_layer(m, table, type_colors):
+    """All fountains as one GeoJSON layer styled by typ, with popups filled
+    from COMPACT_POPUP_TEMPLATE in the browser"""
+    
+    from map_layers import PointLayer
+    
+    columns = {name: table[name] for name in POPUP_COLUMNS}
+    columns['typ'] = [or_default(t, 'Unknown') for t in columns['typ']]
+    PointLayer(
+        point_features(table.lat, table.lon, columns),
+        color_by='typ', colors=type_colors,
+        popup_template=COMPACT_POPUP_TEMPLATE.strip(),
+        tooltip_template='{typ} - {strasse}',
+        name='Trinkbrunnen',
+    ).add_to(m)
+
+def add_sidecar_layer(m, table, type_colors, map_file):
+    """Like add_compact_layer, but the fountains are loaded from the data
+    file shared by all maps instead of being embedded in the page"""
+    
+    from map_layers import PointLayer
+    
+    data_file, data_url = map_data_path(map_file)
+    keys = write_map_data(data_file, {'bwb': collection_from(table, BWB_MAP_COLUMNS)})
+    PointLayer(
+        data_url=data_url, collection=keys['bwb'],
+        color_by='typ', colors=type_colors,
+        popup_template=COMPACT_POPUP_TEMPLATE.strip(),
+        tooltip_template='{typ} - {strasse}',
+        name='Trinkbrunnen',
+    ).add_to(m)
+
+def add_canvas_layer(m, table, type_colors):
+    """All fountains as packed arrays, clustered and drawn on a canvas, for
+    maps with tens of thousands of points"""
+    
+    from map_layers import PackedPointLayer
+    
+    columns = {name: table[name] for name in POPUP_COLUMNS}
+    columns['typ'] = [or_default(t, 'Unknown') for t in columns['typ']]
+    PackedPointLayer(
+        table.lat, table.lon, columns,
+        color_by='typ', colors=type_colors,
+        popup_template=COMPACT_POPUP_TEMPLATE.strip(),
+        tooltip_template='{typ} - {strasse}',
+        cluster=True,
+        name='Trinkbrunnen',
+    ).add_to(m)
+
+def create_trinkbrunnen_map(render='markers', map_file=MAP_FILE, table=None):
+    """Create an interactive Folium map of all Berlin Trinkbrunnen.
+    
+    render is 'markers' (a marker object and popup per fountain),
+    'compact' (one data layer with client-side popups, see map_layers.py)
+    'sidecar' (the same layer, loaded from the data file shared with the
+    comparison maps; serve the directory over HTTP to view it) or 'canvas'
+    (packed arrays in a canvas marker cluster, for very large point sets).
+    table is the already loaded BWB data (a FountainTable or DataFrame);
+    by default the snapshot is loaded here.
+    """
+    
+    import folium
+    from folium import plugins
+    
+    # Load the WFS data
+    if table is None:
+        print("Loading Trinkbrunnen data from WFS...")
+        table = load_bwb_table()
+    
+    print(f"Loaded {len(table)} Trinkbrunnen")
+    
+    # Calculate map center from all coordinates
+    center_lat = float(table.lat.mean())
+    center_lon = float(table.lon.mean())
+    
+    print(f"Map center: {center_lat:.6f}, {center_lon:.6f}")
+    
+    # Create the base map
+    m = folium.Map(
+        location=[center_lat, center_lon],
+        zoom_start=11,
+        tiles='OpenStreetMap',
+        prefer_canvas=(render == 'canvas')
+    )
+    
+    # Add tile layers
+    folium.TileLayer('cartodbpositron', name='CartoDB Positron').add_to(m)
+    folium.TileLayer('cartodbdark_matter', name='CartoDB Dark').add_to(m)
+    
+    # Define colors for different fountain types
+    type_colors = {
+        'Kaiser Brunnen': 'blue',
+        'Wiener Brunnen': 'green', 
+        'Botsch Brunnen': 'red',
+        'Bituma-Brunnen': 'purple',
+        'Unknown': 'gray'
+    }
+    
+    # Count fountain types
+    type_counts = {}
+    for fountain_type in table['typ']:
+        fountain_type = or_default(fountain_type, 'Unknown')
+        type_counts[fountain_type] = type_counts.get(fountain_type, 0) + 1
+    
+    if render == 'compact':
+        add_compact_layer(m, table, type_colors)
+    elif render == 'sidecar':
+        add_sidecar_layer(m, table, type_colors, map_file)
+    elif render == 'canvas':
+        add_canvas_layer(m, table, type_colors)
+    else:
+        add_marker_layers(m, table, type_colors)
     
     # Add legend
     legend_html = f"""
@@ -126,7 +228,7 @@ def create_trinkbrunnen_map():
                 background-color: white; border:2px solid grey; z-index:9999; 
                 font-size:14px; padding: 10px">
     <h4 style="margin: 0 0 10px 0;">🚰 Trinkbrunnen Berlin</h4>
-    <p style="margin: 5px 0;"><b>Gesamt: {len(features)} Brunnen</b></p>
+    <p style="margin: 5px 0;"><b>Gesamt: {len(table)} Brunnen</b></p>
     """
     
     for fountain_type, count in sorted(type_counts.items()):
@@ -158,17 +260,16 @@ def create_trinkbrunnen_map():
     # plugins.Search(layer=marker_cluster, search_label='tooltip').add_to(m)
     
     # Save the map
-    map_file = 'berlin_trinkbrunnen_map.html'
     m.save(map_file)
     
     print(f"\nMap saved as: {map_file}")
-    print(f"Map contains {len(features)} Trinkbrunnen")
+    print(f"Map contains {len(table)} Trinkbrunnen")
     
     # Print statistics
     print("\nTrinkbrunnen Statistics:")
     print("-" * 30)
     for fountain_type, count in sorted(type_counts.items(), key=lambda x: x[1], reverse=True):
-        percentage = (count / len(features)) * 100
+        percentage = (count / len(table)) * 100
         print(f"{fountain_type:15}: {count:3d} ({percentage:5.1f}%)")
     
     # Get absolute path for opening
@@ -177,12 +278,31 @@ def create_trinkbrunnen_map():
     
     return map_file
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Interactive map of the BWB Trinkbrunnen")
+    parser.add_argument('--render', choices=('markers', 'compact', 'sidecar', 'canvas'), default='markers',
+                        help="markers: one marker and popup per fountain; compact: one GeoJSON layer "
+                             "styled by type with popups built on click; sidecar: like compact, with the "
+                             "data in a shared, precompressed file next to the maps; canvas: packed "
+                             "coordinate arrays in a canvas marker cluster, for 10k+ points (default: markers)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild the map even when the data and options are unchanged since the last run")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("Creating interactive Folium map of Berlin Trinkbrunnen...")
     print("="*60)
     
     try:
-        map_file = create_trinkbrunnen_map()
+        # Skipped when the snapshot and options are unchanged, see build_cache.py.
+        # The stages are the ones pipeline.py runs, so either entry point
+        # finds the map the other one built.
+        cache = BuildCache(force=args.force)
+        bwb = load_stage(cache)
+        map_file = cache.stage(
+            f'map {MAP_FILE}', lambda: create_trinkbrunnen_map(args.render, table=bwb.value),
+            inputs=[bwb], params=[args.render], outputs=map_outputs(MAP_FILE, args.render)).value
         print(f"\n✅ Success! Interactive map created: {map_file}")
         print("\nMap features:")
         print("- 🗺️  Interactive markers with detailed information")
@@ -1,6 +1,11 @@
+import argparse
 import requests
 import json
 import re
+from fountain_table import GOOGLE_FIELDS, table_from_geojson
+from kml_ingest import kml_feature_collection
+
+GOOGLE_MAPS_FILE = 'berlin_trinkbrunnen_google_maps.json'
 
 def extract_features_from_kml_response(response_text):
     """Extract feature IDs from the KML overlay service response"""
@@ -105,7 +110,52 @@ def fetch_tile_data(kml_id, tile_coords, api_key):
     
     return None
 
+def ingest_kml_export(kml_path, output_file=GOOGLE_MAPS_FILE):
+    """Write a FeatureCollection with real coordinates from a KML/KMZ export
+    of the My Map (Google My Maps: menu > Export to KML/KMZ)"""
+    
+    print(f"Reading placemarks from {kml_path}...")
+    trinkbrunnen_data = kml_feature_collection(
+        kml_path,
+        name="Trinkbrunnen Berlin",
+        source="Google My Maps KML export",
+    )
+    features = trinkbrunnen_data["features"]
+    trinkbrunnen_data["properties"]["feature_count"] = len(features)
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(trinkbrunnen_data, f, indent=2, ensure_ascii=False)
+    
+    located = table_from_geojson(features, GOOGLE_FIELDS)
+    print(f"\nSaved {len(features)} Trinkbrunnen to {output_file}")
+    print(f"Features with coordinates: {len(located)}")
+    
+    folders = located.value_counts('folder')
+    if len(folders) > 1:
+        print("\nLayers:")
+        for folder, count in folders.items():
+            print(f"  {folder:30}: {count:3d}")
+    
+    print(f"Total number of Trinkbrunnen in Berlin (from Google Maps): {len(features)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract the Google My Maps Trinkbrunnen layer")
+    parser.add_argument('--kml', metavar='PATH',
+                        help="KML or KMZ export of the My Map; gives every fountain its coordinates "
+                             "instead of only the feature IDs of the overlay response")
+    parser.add_argument('--output', default=GOOGLE_MAPS_FILE,
+                        help=f"Output GeoJSON file (default: {GOOGLE_MAPS_FILE})")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    
+    if args.kml:
+        print("Extracting Trinkbrunnen data from a Google My Maps KML export...")
+        print("="*60)
+        ingest_kml_export(args.kml, args.output)
+        return
+    
     print("Extracting Trinkbrunnen data from Google Maps KML...")
     print("="*60)
     
@@ -146,16 +196,20 @@ def main():
         trinkbrunnen_data["features"].append(feature)
     
     # Save to JSON file
-    with open('berlin_trinkbrunnen_google_maps.json', 'w', encoding='utf-8') as f:
+    with open(args.output, 'w', encoding='utf-8') as f:
         json.dump(trinkbrunnen_data, f, indent=2, ensure_ascii=False)
     
-    print(f"\nSaved {len(feature_ids)} Trinkbrunnen feature IDs to berlin_trinkbrunnen_google_maps.json")
+    print(f"\nSaved {len(feature_ids)} Trinkbrunnen feature IDs to {args.output}")
     print(f"Total number of Trinkbrunnen in Berlin (from Google Maps): {len(feature_ids)}")
     
+    located = table_from_geojson(trinkbrunnen_data["features"], {'id': 'id'})
+    print(f"Features with coordinates: {len(located)}")
+    
     # Note about limitations
     print("\nNote: This extracts feature IDs from the KML overlay.")
     print("To get exact coordinates and properties for each fountain,")
-    print("additional requests to Google Maps API would be needed.")
+    print("additional requests to Google Maps API would be needed,")
+    print("or export the map as KML/KMZ and run again with --kml.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
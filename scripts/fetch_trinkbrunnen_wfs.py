@@ -1,11 +1,30 @@
+import argparse
+import os
+import sys
 import requests
 import json
+from bwb_data import BWB_WFS_FILE, read_bwb_snapshot
+from fountain_filter import parse_bbox, parse_where, wfs_filter_params
+from fountain_table import bwb_table_from_geojson
+from snapshot_history import HISTORY_DIR, SnapshotHistory
+from wfs_client import (DEFAULT_PAGE_SIZE, DEFAULT_WORKERS, NOT_MODIFIED, WFS_URL, cached_output_format,
+                        conditional_get, download_in_format, download_negotiated, download_paged,
+                        forget_output_format, read_snapshot_meta, remember_output_format, request_identity,
+                        write_collection, write_snapshot_meta)
+from wfs_decoders import FEATURE_DECODERS
 
-def fetch_trinkbrunnen_from_wfs():
-    """Fetch all drinking fountains from Berlin's WFS (Web Feature Service)"""
-    
-    # WFS endpoint URL
-    wfs_url = "http://dservices-eu1.arcgis.com/A6FVvQQnrSyq47GD/arcgis/services/Trinkbrunnen_BWB/WFSServer"
+# Exit status when the snapshot on disk is already current, so a shell
+# pipeline can skip the steps that depend on it
+EXIT_UNCHANGED = 3
+
+def fetch_trinkbrunnen_from_wfs(wfs_url=WFS_URL, meta=None, filter_params=None):
+    """Fetch all drinking fountains from Berlin's WFS (Web Feature Service).
+
+    With meta from a previous download the request is conditional, and
+    filter_params let the server select a subset. Returns
+    (data, validators); data is NOT_MODIFIED when the snapshot is current
+    and None when the request failed.
+    """
     
     # WFS GetFeature request parameters
     params = {
@@ -16,21 +35,28 @@ def fetch_trinkbrunnen_from_wfs():
         'outputFormat': 'GEOJSON',  # Request GeoJSON format
         'maxFeatures': '10000'  # Set high limit to get all features
     }
+    params.update(filter_params or {})
     
     print("Fetching Trinkbrunnen data from WFS...")
     print(f"URL: {wfs_url}")
     print(f"Parameters: {params}")
     
     try:
-        response = requests.get(wfs_url, params=params, timeout=30)
+        request = request_identity(params['outputFormat'], filter_params)
+        response, validators = conditional_get(wfs_url, params, meta or {}, request, timeout=30)
+        
+        if response is None:
+            print("Snapshot is current: nothing to download")
+            return NOT_MODIFIED, validators
         
         if response.status_code == 200:
-            print(f"Success! Response size: {len(response.text)} characters")
+            print(f"Success! Response size: {len(response.content)} bytes "
+                  f"({response.headers.get('Content-Encoding', 'identity')} transfer)")
             
             # Try to parse as JSON
             try:
                 data = response.json()
-                return data
+                return data, validators
             except json.JSONDecodeError:
                 print("Response is not valid JSON. Checking if it's XML...")
                 # Check if response contains XML error
@@ -40,110 +66,193 @@ def fetch_trinkbrunnen_from_wfs():
                 else:
                     print("Response preview:")
                     print(response.text[:500])
-                return None
+                return None, validators
         else:
             print(f"HTTP Error: {response.status_code}")
             print(f"Response: {response.text[:500]}")
-            return None
+            return None, validators
             
     except requests.exceptions.Timeout:
         print("Request timed out after 30 seconds")
-        return None
+        return None, None
     except requests.exceptions.RequestException as e:
         print(f"Request failed: {str(e)}")
-        return None
+        return None, None
 
-def try_alternative_formats():
-    """Try different output formats to see what works"""
+def try_alternative_formats(wfs_url=WFS_URL, output_path=BWB_WFS_FILE, filter_params=None):
+    """Probe all decodable output formats at once and stream the first one
+    that works straight into output_path.
+
+    The winner is remembered for the endpoint so later runs skip the
+    negotiation. Returns (format, feature count, changed).
+    """
     
-    wfs_url = "http://dservices-eu1.arcgis.com/A6FVvQQnrSyq47GD/arcgis/services/Trinkbrunnen_BWB/WFSServer"
+    print(f"Probing output formats concurrently: {', '.join(FEATURE_DECODERS)}")
+    try:
+        working_format, feature_count, changed = download_negotiated(output_path, wfs_url,
+                                                                     filter_params=filter_params)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error: {str(e)}")
+        return None, 0, False
     
-    formats_to_try = [
-        'GEOJSON',
-        'ESRIGEOJSON', 
-        'GML32',
-        'CSV',
-        'KML'
-    ]
+    if working_format:
+        remember_output_format(wfs_url, working_format)
+    return working_format, feature_count, changed
+
+def print_type_summary(table):
+    """Summarize fountain types without keeping per-feature dicts around"""
     
-    for format_name in formats_to_try:
-        print(f"\nTrying format: {format_name}")
-        
-        params = {
-            'service': 'WFS',
-            'version': '2.0.0',
-            'request': 'GetFeature',
-            'typeName': 'Trinkbrunnen_BWB:Trinkbrunnen_BWB',
-            'outputFormat': format_name,
-            'maxFeatures': '5'  # Just get a few to test
-        }
-        
-        try:
-            response = requests.get(wfs_url, params=params, timeout=10)
-            print(f"Status: {response.status_code}")
-            
-            if response.status_code == 200:
-                print(f"Success! Content type: {response.headers.get('content-type', 'unknown')}")
-                print(f"Response preview: {response.text[:200]}...")
-                
-                if format_name in ['GEOJSON', 'ESRIGEOJSON']:
-                    try:
-                        data = response.json()
-                        if 'features' in data:
-                            print(f"Found {len(data['features'])} features")
-                            return format_name, data
-                    except json.JSONDecodeError:
-                        print("Not valid JSON")
-            else:
-                print(f"Error: {response.text[:200]}")
-                
-        except Exception as e:
-            print(f"Error: {str(e)}")
-    
-    return None, None
+    print("\nFountain types:")
+    for typ, count in table.value_counts('typ').items():
+        print(f"  {typ:15}: {count:3d}")
+
+def report_download(output_path, feature_count, changed):
+    """Summarize a download that was streamed to disk; returns the exit status"""
+    
+    if not changed:
+        print(f"\nDownloaded {feature_count} features, identical to {output_path}: left unchanged")
+        return EXIT_UNCHANGED
+    
+    print(f"\nSuccessfully fetched {feature_count} Trinkbrunnen from WFS!")
+    print(f"Data saved to {output_path}")
+    
+    print_type_summary(read_bwb_snapshot(output_path))
+    print(f"\nTotal number of Trinkbrunnen in Berlin (from WFS): {feature_count}")
+    return 0
+
+def fetch_paged(args):
+    """Download the layer page by page straight into the snapshot file"""
+    
+    print(f"Paged download: {args.page_size} features per page, {args.workers} workers")
+    try:
+        feature_count, changed = download_paged(args.output, args.wfs_url, page_size=args.page_size,
+                                                workers=args.workers, filter_params=args.filter_params)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"\nPaged download failed: {str(e)}")
+        return 1
+    
+    return report_download(args.output, feature_count, changed)
+
+def fetch_in_cached_format(args, output_format):
+    """Download in the format a previous negotiation settled on; returns the
+    exit status, or None when that format stopped working"""
+    
+    print(f"Using {output_format}, the output format that worked last time for this endpoint")
+    try:
+        result = download_in_format(args.output, args.wfs_url, output_format, filter_params=args.filter_params)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Download failed: {str(e)}")
+        result = None
+    
+    if result is None:
+        forget_output_format(args.wfs_url)
+        return None
+    return report_download(args.output, *result)
+
+def is_bwb_snapshot(path):
+    """Whether path is the snapshot file the other scripts read"""
+    return os.path.realpath(path) == os.path.realpath(BWB_WFS_FILE)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fetch the BWB Trinkbrunnen layer from the WFS",
+        epilog=f"Exit status: 0 snapshot updated, {EXIT_UNCHANGED} snapshot already current, 1 failure")
+    parser.add_argument('--wfs-url', default=WFS_URL, help="WFS endpoint (default: the BWB ArcGIS service)")
+    parser.add_argument('--output', default=BWB_WFS_FILE, help=f"Snapshot file (default: {BWB_WFS_FILE})")
+    parser.add_argument('--paged', action='store_true',
+                        help="Download in startIndex/count pages on a worker pool, streaming to disk")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"Features per page for --paged (default: {DEFAULT_PAGE_SIZE})")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Concurrent page downloads for --paged (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--history-dir', default=HISTORY_DIR,
+                        help=f"Snapshot history that every changed download of {BWB_WFS_FILE} is appended to "
+                             f"(default: {HISTORY_DIR})")
+    parser.add_argument('--no-history', action='store_true', help="Do not record the download in the history")
+    parser.add_argument('--where', action='append', metavar='COLUMN=VALUE[,VALUE...]',
+                        help="Only download fountains whose column has one of the values, filtered by the "
+                             "server (repeatable; e.g. betriebszustand='in Betrieb')")
+    parser.add_argument('--bbox', metavar='MIN_LON,MIN_LAT,MAX_LON,MAX_LAT',
+                        help="Only download fountains inside this box (WGS84 degrees)")
+    args = parser.parse_args()
+    
+    try:
+        where = parse_where(args.where)
+        bbox = parse_bbox(args.bbox) if args.bbox else None
+        args.filter_params = wfs_filter_params(where, bbox)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.filter_params and is_bwb_snapshot(args.output):
+        parser.error(f"--where/--bbox select a subset; write it somewhere else than {BWB_WFS_FILE} with --output")
+    return args
+
+def record_history(snapshot, history_dir=HISTORY_DIR):
+    """Append a changed snapshot to the versioned history"""
+    
+    try:
+        record = SnapshotHistory(history_dir).record(snapshot)
+    except ValueError as e:
+        print(f"\n❌ Snapshot saved, but not recorded in the history: {e}")
+        return
+    if record is not None and record['version'] == 1:
+        print(f"\nStarted the snapshot history in {history_dir} with {record['features']} features")
+    elif record is not None:
+        print(f"\nRecorded history version {record['version']} at {record['time']}: "
+              f"{len(record['added'])} added, {len(record['removed'])} removed, {len(record['changed'])} changed")
 
 def main():
+    args = parse_args()
+    status = fetch_snapshot(args)
+    # The history tracks the full layer in the snapshot file, not filtered
+    # subsets or copies written elsewhere
+    if status == 0 and not args.no_history and not args.filter_params and is_bwb_snapshot(args.output):
+        record_history(args.output, args.history_dir)
+    return status
+
+def fetch_snapshot(args):
+    """Fetch the layer into args.output; returns the exit status"""
+    
     print("Fetching Trinkbrunnen from WFS (Web Feature Service)...")
     print("="*60)
     
-    # First try to get all data
-    data = fetch_trinkbrunnen_from_wfs()
+    if args.paged:
+        return fetch_paged(args)
+    
+    cached_format = cached_output_format(args.wfs_url)
+    if cached_format not in (None, 'GEOJSON'):
+        status = fetch_in_cached_format(args, cached_format)
+        if status is not None:
+            return status
+    
+    # First try to get all data, revalidating the snapshot we already have
+    meta = read_snapshot_meta(args.output)
+    data, validators = fetch_trinkbrunnen_from_wfs(args.wfs_url, meta, args.filter_params)
+    
+    if data is NOT_MODIFIED:
+        write_snapshot_meta(args.output, validators, changed=False)
+        print(f"{args.output} is up to date")
+        return EXIT_UNCHANGED
     
     if data is None:
         print("\nFirst attempt failed. Trying alternative formats...")
-        working_format, data = try_alternative_formats()
+        forget_output_format(args.wfs_url)
+        working_format, feature_count, changed = try_alternative_formats(args.wfs_url, args.output,
+                                                                         args.filter_params)
         
         if working_format:
             print(f"\nFound working format: {working_format}")
-            print("Fetching all data with working format...")
-            
-            # Now fetch all data with the working format
-            wfs_url = "http://dservices-eu1.arcgis.com/A6FVvQQnrSyq47GD/arcgis/services/Trinkbrunnen_BWB/WFSServer"
-            params = {
-                'service': 'WFS',
-                'version': '2.0.0',
-                'request': 'GetFeature',
-                'typeName': 'Trinkbrunnen_BWB:Trinkbrunnen_BWB',
-                'outputFormat': working_format,
-                'maxFeatures': '10000'
-            }
-            
-            response = requests.get(wfs_url, params=params, timeout=30)
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                except json.JSONDecodeError:
-                    data = None
+            return report_download(args.output, feature_count, changed)
     
     if data and 'features' in data:
-        feature_count = len(data['features'])
-        print(f"\nSuccessfully fetched {feature_count} Trinkbrunnen from WFS!")
-        
-        # Save to JSON file
-        with open('../data/berlin_trinkbrunnen_wfs.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        # Save to JSON file, unless it already holds exactly this
+        feature_count, changed = write_collection(args.output, data, request_identity('GEOJSON', args.filter_params),
+                                                  validators)
+        remember_output_format(args.wfs_url, 'GEOJSON')
+        if not changed:
+            return report_download(args.output, feature_count, changed)
         
-        print(f"Data saved to ../data/berlin_trinkbrunnen_wfs.json")
+        print(f"\nSuccessfully fetched {feature_count} Trinkbrunnen from WFS!")
+        print(f"Data saved to {args.output}")
         
         # Display some sample data
         if feature_count > 0:
@@ -159,12 +268,16 @@ def main():
             if 'geometry' in sample:
                 print(f"Geometry type: {sample['geometry'].get('type', 'Unknown')}")
         
+        print_type_summary(bwb_table_from_geojson(data))
+        
         print(f"\nTotal number of Trinkbrunnen in Berlin (from WFS): {feature_count}")
+        return 0
     else:
         print("\nFailed to fetch data from WFS. The service might be unavailable or require different parameters.")
         if data:
             print("Response structure:")
             print(json.dumps(data, indent=2)[:500])
+        return 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,198 @@
+import numpy as np
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from fountain_table import BWB_FIELDS
+
+FES_NS = 'http://www.opengis.net/fes/2.0'
+GML_NS = 'http://www.opengis.net/gml/3.2'
+
+# WFS 2.0 reads EPSG:4326 in this URN form as latitude/longitude
+BBOX_CRS = 'urn:ogc:def:crs:EPSG::4326'
+
+def normalize_where(where):
+    """{column: tuple of accepted values} from {column: value or list of
+    values}; several columns must all match"""
+
+    normalized = {}
+    for name, value in (where or {}).items():
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else (value,)
+        normalized[name] = tuple(values)
+    return normalized
+
+def parse_where(expressions):
+    """--where COLUMN=VALUE[,VALUE...] arguments as a where mapping"""
+
+    where = {}
+    for expression in expressions or ():
+        name, sep, values = expression.partition('=')
+        if not sep or not name.strip():
+            raise ValueError(f"Expected COLUMN=VALUE, got {expression!r}")
+        where.setdefault(name.strip(), []).extend(v.strip() for v in values.split(','))
+    return where
+
+def parse_bbox(value):
+    """--bbox MIN_LON,MIN_LAT,MAX_LON,MAX_LAT as a tuple of floats"""
+
+    parts = [float(v) for v in value.split(',')]
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise ValueError(f"Expected MIN_LON,MIN_LAT,MAX_LON,MAX_LAT, got {value!r}")
+    return tuple(parts)
+
+def property_where(where, fields=BWB_FIELDS):
+    """Translate table column names to the layer's property names"""
+    return {fields.get(name, name): values for name, values in normalize_where(where).items()}
+
+def _number(value):
+    # repr round-trips, so the server compares against the exact value
+    return repr(float(value))
+
+def _literal(value):
+    return _number(value) if isinstance(value, float) else str(value)
+
+def _equal(name, value):
+    return (f'<fes:PropertyIsEqualTo><fes:ValueReference>{escape(name)}</fes:ValueReference>'
+            f'<fes:Literal>{escape(_literal(value))}</fes:Literal></fes:PropertyIsEqualTo>')
+
+def _combine(operator, clauses):
+    return clauses[0] if len(clauses) == 1 else f'<fes:{operator}>{"".join(clauses)}</fes:{operator}>'
+
+def _bbox_clause(bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (f'<fes:BBOX><gml:Envelope srsName={quoteattr(BBOX_CRS)}>'
+            f'<gml:lowerCorner>{_number(min_lat)} {_number(min_lon)}</gml:lowerCorner>'
+            f'<gml:upperCorner>{_number(max_lat)} {_number(max_lon)}</gml:upperCorner>'
+            f'</gml:Envelope></fes:BBOX>')
+
+def fes_filter(where=None, bbox=None, fields=BWB_FIELDS):
+    """FES 2.0 filter document selecting the features whose properties
+    match where and whose point lies in bbox (lon/lat degrees), or None when
+    there is nothing to filter on"""
+
+    clauses = [_combine('Or', [_equal(name, value) for value in values])
+               for name, values in property_where(where, fields).items() if values]
+    if bbox is not None:
+        clauses.append(_bbox_clause(bbox))
+    if not clauses:
+        return None
+    return (f'<fes:Filter xmlns:fes="{FES_NS}" xmlns:gml="{GML_NS}">'
+            f'{_combine("And", clauses)}</fes:Filter>')
+
+def wfs_filter_params(where=None, bbox=None, fields=BWB_FIELDS):
+    """Extra GetFeature parameters that let the server do the filtering.
+
+    WFS 2.0 does not allow BBOX and FILTER in one request, so a bounding
+    box on its own uses the short BBOX parameter and is folded into the
+    filter document otherwise.
+    """
+
+    if not normalize_where(where):
+        if bbox is None:
+            return {}
+        min_lon, min_lat, max_lon, max_lat = bbox
+        corners = ','.join(_number(v) for v in (min_lat, min_lon, max_lat, max_lon))
+        return {'BBOX': f"{corners},{BBOX_CRS}"}
+    return {'FILTER': fes_filter(where, bbox, fields)}
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _corner(envelope, name):
+    for elem in envelope:
+        if _local(elem.tag) == name:
+            return [float(v) for v in elem.text.split()]
+    raise ValueError(f"Envelope without {name}")
+
+def parse_wfs_filter(filter_text=None, bbox_text=None):
+    """(where, bbox) keyed by property name from FILTER and BBOX parameters
+    as written by wfs_filter_params: equality tests, Or within a property,
+    And across properties and at most one BBOX"""
+
+    where = {}
+    bbox = None
+    if bbox_text:
+        min_lat, min_lon, max_lat, max_lon = [float(v) for v in bbox_text.split(',')[:4]]
+        bbox = (min_lon, min_lat, max_lon, max_lat)
+    if not filter_text:
+        return where, bbox
+
+    for elem in ET.fromstring(filter_text).iter():
+        name = _local(elem.tag)
+        if name == 'PropertyIsEqualTo':
+            children = {_local(child.tag): (child.text or '') for child in elem}
+            where.setdefault(children['ValueReference'], []).append(children['Literal'])
+        elif name == 'Envelope':
+            (min_lat, min_lon), (max_lat, max_lon) = _corner(elem, 'lowerCorner'), _corner(elem, 'upperCorner')
+            bbox = (min_lon, min_lat, max_lon, max_lat)
+        elif name in ('Or', 'And', 'Filter', 'BBOX', 'ValueReference', 'Literal', 'lowerCorner', 'upperCorner'):
+            continue
+        else:
+            raise ValueError(f"Unsupported filter element {name}")
+    return where, bbox
+
+def _in_bbox(lon, lat, bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+
+def _same(value, accepted):
+    """Equality the way the server compares a property with a literal:
+    numbers numerically, everything else as text"""
+
+    if value is None:
+        return False
+    for candidate in accepted:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            try:
+                if float(candidate) == value:
+                    return True
+            except (TypeError, ValueError):
+                pass
+        elif str(value) == str(candidate):
+            return True
+    return False
+
+def feature_matches(feature, where=None, bbox=None):
+    """Whether a GeoJSON feature passes where (keyed by property name) and
+    bbox; used while streaming so rejected features are never kept"""
+
+    properties = feature.get('properties') or {}
+    for name, accepted in normalize_where(where).items():
+        if not _same(properties.get(name), accepted):
+            return False
+    if bbox is not None:
+        coordinates = (feature.get('geometry') or {}).get('coordinates')
+        if not coordinates or not _in_bbox(coordinates[0], coordinates[1], bbox):
+            return False
+    return True
+
+def filter_features(features, where=None, bbox=None):
+    if not normalize_where(where) and bbox is None:
+        return features
+    return (feature for feature in features if feature_matches(feature, where, bbox))
+
+def table_mask(table, where=None, bbox=None):
+    """Boolean row mask of a FountainTable for where (keyed by column name)
+    and bbox. Dictionary-encoded columns are compared on their codes and
+    coordinates on the raw columns, so no strings are decoded."""
+
+    mask = np.ones(len(table), dtype=bool)
+    for name, accepted in normalize_where(where).items():
+        if name in table.categories:
+            codes, categories = table.codes(name)
+            wanted = [code for code, value in enumerate(categories) if _same(value, accepted)]
+            mask &= np.isin(codes, wanted)
+        else:
+            values = table[name]
+            if values.dtype.kind in 'iuf':
+                numbers = []
+                for candidate in accepted:
+                    try:
+                        numbers.append(float(candidate))
+                    except (TypeError, ValueError):
+                        pass
+                mask &= np.isin(values, numbers)
+            else:
+                mask &= np.isin(values.astype(str), [str(v) for v in accepted]) & (values != None)  # noqa: E711
+    if bbox is not None:
+        mask &= _in_bbox(table.lon, table.lat, bbox)
+    return mask
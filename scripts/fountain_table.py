@@ -0,0 +1,298 @@
+import numpy as np
+
+from geodesy import lonlat_to_utm
+
+# Low-cardinality string columns that are stored dictionary-encoded
+CATEGORICAL_COLUMNS = ('typ', 'betriebszustand', 'operator', 'eigentuemer', 'osm_type', 'folder')
+
+# Output column -> WFS property name for the BWB layer
+BWB_FIELDS = {
+    'bwb_id': 'oid',
+    'nummer': 'trinkbrunnennummer',
+    'typ': 'typ',
+    'strasse': 'strasse',
+    'einbaujahr': 'einbaujahr',
+    'betriebszustand': 'betriebszustand',
+    'eigentuemer': 'eigentuemer',
+    'rechtswert': 'rechtswert',
+    'hochwert': 'hochwert',
+}
+
+OSM_FIELDS = ('name', 'operator', 'source', 'description', 'website')
+
+# Output column -> placemark property for a Google My Maps KML export
+GOOGLE_FIELDS = {
+    'google_id': 'id',
+    'index': 'index',
+    'name': 'name',
+    'description': 'description',
+    'folder': 'folder',
+}
+
+# Geometry types fetch_osm_drinking_fountains has always kept
+OSM_POINT_LIKE_TYPES = ('Point', 'Polygon', 'MultiPolygon')
+
+class FountainTable:
+    """Array-backed table of fountain points.
+
+    Coordinates live in float64 NumPy columns, low-cardinality strings are
+    dictionary-encoded (int32 codes plus a list of categories) and shapely
+    geometries are only created when ``geometry`` is first accessed.
+    """
+
+    def __init__(self, lat, lon, columns=None, categories=None):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        # name -> array; categorical columns hold int32 codes (-1 = missing)
+        self.columns = dict(columns or {})
+        # name -> list of category values for dictionary-encoded columns
+        self.categories = dict(categories or {})
+        self._xy = None
+        self._geometry = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __contains__(self, name):
+        return name in ('lat', 'lon') or name in self.columns
+
+    def __getitem__(self, name):
+        """Decoded values of a column as a NumPy array"""
+
+        if name == 'lat':
+            return self.lat
+        if name == 'lon':
+            return self.lon
+        values = self.columns[name]
+        if name in self.categories:
+            lookup = np.array(list(self.categories[name]) + [None], dtype=object)
+            return lookup[values]
+        return values
+
+    @property
+    def column_names(self):
+        return ['lat', 'lon'] + list(self.columns)
+
+    @property
+    def xy(self):
+        """UTM 33N (EPSG:25833) coordinates, from rechtswert/hochwert where
+        published and projected from lat/lon otherwise"""
+
+        if self._xy is None:
+            if 'rechtswert' in self.columns and 'hochwert' in self.columns:
+                import pandas as pd
+                x = pd.to_numeric(pd.Series(self.columns['rechtswert']), errors='coerce').to_numpy(dtype=float)
+                y = pd.to_numeric(pd.Series(self.columns['hochwert']), errors='coerce').to_numpy(dtype=float)
+            else:
+                x = np.full(len(self), np.nan)
+                y = np.full(len(self), np.nan)
+            missing = np.isnan(x) | np.isnan(y)
+            if missing.any():
+                x[missing], y[missing] = lonlat_to_utm(self.lon[missing], self.lat[missing])
+            self._xy = (x, y)
+        return self._xy
+
+    @property
+    def geometry(self):
+        """shapely Points for all rows, built on first access"""
+
+        if self._geometry is None:
+            import shapely
+            self._geometry = shapely.points(self.lon, self.lat)
+        return self._geometry
+
+    def codes(self, name):
+        """Integer codes and categories of a dictionary-encoded column"""
+        return self.columns[name], self.categories[name]
+
+    def value_counts(self, name):
+        """Counts per value of a column, most frequent first, without decoding"""
+
+        import pandas as pd
+
+        if name in self.categories:
+            counts = np.bincount(self.columns[name][self.columns[name] >= 0],
+                                 minlength=len(self.categories[name]))
+            result = pd.Series(counts, index=pd.Index(self.categories[name], dtype=object))
+            result = result[result > 0]
+        else:
+            result = pd.Series(self.columns[name]).value_counts()
+        return result.sort_values(ascending=False, kind='stable')
+
+    def take(self, positions):
+        """New table with the rows at positions (an index array or boolean mask)"""
+
+        table = FountainTable(
+            self.lat[positions], self.lon[positions],
+            {name: values[positions] for name, values in self.columns.items()},
+            self.categories,
+        )
+        if self._xy is not None:
+            table._xy = (self._xy[0][positions], self._xy[1][positions])
+        return table
+
+    def to_frame(self, columns=None, geometry=False):
+        """pandas DataFrame view; dictionary-encoded columns become
+        pd.Categorical so the strings are still stored once"""
+
+        import pandas as pd
+
+        data = {}
+        for name in columns or self.column_names:
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(self.columns[name], categories=self.categories[name])
+            else:
+                data[name] = self[name]
+        if geometry:
+            data['geometry'] = self.geometry
+        return pd.DataFrame(data)
+
+    @classmethod
+    def concat(cls, tables):
+        """Stack tables with the same columns, re-encoding categoricals"""
+
+        tables = [t for t in tables if t is not None]
+        if not tables:
+            return cls([], [])
+        builder = FountainTableBuilder(tables[0].columns.keys())
+        for table in tables:
+            builder.extend_table(table)
+        return builder.build()
+
+class FountainTableBuilder:
+    """Row-wise builder that appends straight into per-column lists and
+    dictionary-encodes categorical values as they arrive"""
+
+    def __init__(self, names, categorical=CATEGORICAL_COLUMNS):
+        self.names = list(names)
+        self.lat = []
+        self.lon = []
+        self.values = {name: [] for name in self.names}
+        self.lookup = {name: {} for name in self.names if name in categorical}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def append(self, lat, lon, values):
+        """Add one row; values is a mapping or a sequence in column order"""
+
+        self.lat.append(lat)
+        self.lon.append(lon)
+        if not isinstance(values, (list, tuple)):
+            values = [values.get(name) for name in self.names]
+        for name, value in zip(self.names, values):
+            lookup = self.lookup.get(name)
+            if lookup is not None:
+                if value is None or value != value:
+                    value = -1
+                else:
+                    value = lookup.setdefault(value, len(lookup))
+            self.values[name].append(value)
+
+    def extend_table(self, table):
+        for name in self.names:
+            decoded = table[name]
+            lookup = self.lookup.get(name)
+            if lookup is None:
+                self.values[name].extend(decoded.tolist())
+            else:
+                self.values[name].extend(-1 if v is None else lookup.setdefault(v, len(lookup))
+                                         for v in decoded.tolist())
+        self.lat.extend(table.lat.tolist())
+        self.lon.extend(table.lon.tolist())
+
+    def build(self):
+        columns = {}
+        categories = {}
+        for name in self.names:
+            if name in self.lookup:
+                columns[name] = np.array(self.values[name], dtype=np.int32)
+                categories[name] = list(self.lookup[name])
+            else:
+                columns[name] = column_array(self.values[name])
+        return FountainTable(np.array(self.lat, dtype=float), np.array(self.lon, dtype=float),
+                             columns, categories)
+
+def column_array(values):
+    """NumPy array for a list of plain values: numeric when every value is a
+    number, object otherwise"""
+
+    if values and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return np.array(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+def table_from_geojson(features, fields):
+    """FountainTable from GeoJSON point features.
+
+    fields maps output column names to property names. Features without
+    point coordinates are skipped.
+    """
+
+    builder = FountainTableBuilder(fields)
+    property_names = list(fields.values())
+    for feature in features:
+        geometry = feature.get('geometry') or {}
+        coords = geometry.get('coordinates')
+        if not coords:
+            continue
+        props = feature.get('properties') or {}
+        builder.append(coords[1], coords[0], [props.get(p) for p in property_names])
+    return builder.build()
+
+def bwb_table_from_geojson(data):
+    """FountainTable with the BWB columns from a WFS FeatureCollection"""
+    return table_from_geojson(data['features'], BWB_FIELDS)
+
+def osm_table_from_features(features, geom_types=OSM_POINT_LIKE_TYPES):
+    """FountainTable from an osmnx features GeoDataFrame.
+
+    Point geometries are used as they are and everything else is reduced to
+    its centroid in one vectorized call. Only geom_types are kept (all when
+    None).
+    """
+
+    import pandas as pd
+    import shapely
+
+    geoms = features.geometry.values
+    kinds = np.asarray(shapely.get_type_id(geoms))
+    keep = np.ones(len(features), dtype=bool)
+    if geom_types is not None:
+        type_ids = {'Point': 0, 'LineString': 1, 'LinearRing': 2, 'Polygon': 3, 'MultiPoint': 4,
+                    'MultiLineString': 5, 'MultiPolygon': 6, 'GeometryCollection': 7}
+        keep = np.isin(kinds, [type_ids[t] for t in geom_types])
+
+    geoms = geoms[keep]
+    points = np.where(kinds[keep] == 0, geoms, shapely.centroid(geoms))
+    lon = shapely.get_x(points)
+    lat = shapely.get_y(points)
+
+    index = features.index[keep]
+    if isinstance(index, pd.MultiIndex):
+        osm_type = index.get_level_values(0).astype(str).to_numpy(dtype=object)
+        osm_id = index.get_level_values(1).to_numpy()
+    else:
+        osm_type = np.full(len(index), 'unknown', dtype=object)
+        osm_id = index.to_numpy()
+
+    raw = {'osm_id': osm_id, 'osm_type': osm_type}
+    for name in OSM_FIELDS:
+        if name in features.columns:
+            values = features[name].to_numpy(dtype=object)[keep]
+            raw[name] = np.where(pd.isna(values), '', values)
+        else:
+            raw[name] = np.full(len(index), '', dtype=object)
+
+    columns = {}
+    categories = {}
+    for name, values in raw.items():
+        if name in CATEGORICAL_COLUMNS:
+            codes, uniques = pd.factorize(values)
+            columns[name] = codes.astype(np.int32)
+            categories[name] = list(uniques)
+        else:
+            columns[name] = values
+
+    return FountainTable(lat, lon, columns, categories)
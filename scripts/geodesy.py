@@ -0,0 +1,152 @@
+import numpy as np
+
+# GRS80 ellipsoid (ETRS89). WGS84 differs only in the 9th digit of the
+# flattening, which is far below the precision we match fountains with.
+GRS80_A = 6378137.0
+GRS80_F = 1 / 298.257222101
+
+# EPSG:25833 - ETRS89 / UTM zone 33N, the CRS of the BWB rechtswert/hochwert
+UTM33_ZONE = 33
+UTM_SCALE = 0.9996
+UTM_FALSE_EASTING = 500000.0
+
+def _krueger_coefficients(f):
+    """Series coefficients for the Krüger transverse Mercator projection"""
+
+    n = f / (2 - f)
+    n2, n3, n4 = n * n, n ** 3, n ** 4
+    rectifying_radius = GRS80_A / (1 + n) * (1 + n2 / 4 + n4 / 64)
+    alpha = (
+        n / 2 - 2 * n2 / 3 + 5 * n3 / 16 + 41 * n4 / 180,
+        13 * n2 / 48 - 3 * n3 / 5 + 557 * n4 / 1440,
+        61 * n3 / 240 - 103 * n4 / 140,
+        49561 * n4 / 161280,
+    )
+    beta = (
+        n / 2 - 2 * n2 / 3 + 37 * n3 / 96 - n4 / 360,
+        n2 / 48 + n3 / 15 - 437 * n4 / 1440,
+        17 * n3 / 480 - 37 * n4 / 840,
+        4397 * n4 / 161280,
+    )
+    return n, rectifying_radius, alpha, beta
+
+_N, _RECTIFYING_RADIUS, _ALPHA, _BETA = _krueger_coefficients(GRS80_F)
+
+def utm_central_meridian(zone):
+    """Central meridian of a UTM zone in degrees"""
+    return zone * 6.0 - 183.0
+
+def lonlat_to_utm(lon, lat, zone=UTM33_ZONE):
+    """Project arrays of lon/lat degrees to UTM easting/northing in metres"""
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    phi = np.radians(lat)
+    dlam = np.radians(lon - utm_central_meridian(zone))
+
+    e = 2 * np.sqrt(_N) / (1 + _N)
+    t = np.sinh(np.arctanh(np.sin(phi)) - e * np.arctanh(e * np.sin(phi)))
+    xi_prime = np.arctan2(t, np.cos(dlam))
+    eta_prime = np.arctanh(np.sin(dlam) / np.sqrt(1 + t * t))
+
+    xi = xi_prime.copy()
+    eta = eta_prime.copy()
+    for j, a in enumerate(_ALPHA, start=1):
+        xi += a * np.sin(2 * j * xi_prime) * np.cosh(2 * j * eta_prime)
+        eta += a * np.cos(2 * j * xi_prime) * np.sinh(2 * j * eta_prime)
+
+    easting = UTM_FALSE_EASTING + UTM_SCALE * _RECTIFYING_RADIUS * eta
+    northing = UTM_SCALE * _RECTIFYING_RADIUS * xi
+    return easting, northing
+
+def utm_to_lonlat(easting, northing, zone=UTM33_ZONE):
+    """Inverse of lonlat_to_utm: arrays of UTM metres to lon/lat degrees"""
+
+    xi = np.asarray(northing, dtype=float) / (UTM_SCALE * _RECTIFYING_RADIUS)
+    eta = (np.asarray(easting, dtype=float) - UTM_FALSE_EASTING) / (UTM_SCALE * _RECTIFYING_RADIUS)
+
+    xi_prime = xi.copy()
+    eta_prime = eta.copy()
+    for j, b in enumerate(_BETA, start=1):
+        xi_prime -= b * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        eta_prime -= b * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+    chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))
+
+    # Conformal latitude back to geodetic latitude by fixed-point iteration
+    e = 2 * np.sqrt(_N) / (1 + _N)
+    phi = chi.copy()
+    for _ in range(6):
+        phi = 2 * np.arctan(
+            np.tan(np.pi / 4 + chi / 2)
+            * ((1 + e * np.sin(phi)) / (1 - e * np.sin(phi))) ** (e / 2)
+        ) - np.pi / 2
+
+    dlam = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+    return utm_central_meridian(zone) + np.degrees(dlam), np.degrees(phi)
+
+def planar_distance(x1, y1, x2, y2):
+    """Euclidean distance between arrays of projected coordinates"""
+    return np.hypot(np.asarray(x2, dtype=float) - x1, np.asarray(y2, dtype=float) - y1)
+
+def ellipsoidal_distance(lat1, lon1, lat2, lon2, max_iterations=50, tolerance=1e-12):
+    """Vectorized Vincenty inverse: geodesic distance in metres between
+    arrays of lat/lon degrees on the GRS80 ellipsoid"""
+
+    a = GRS80_A
+    f = GRS80_F
+    b = a * (1 - f)
+
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        np.asarray(lat1, dtype=float), np.asarray(lon1, dtype=float),
+        np.asarray(lat2, dtype=float), np.asarray(lon2, dtype=float),
+    )
+
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    big_l = np.radians(lon2 - lon1)
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    def sigma_terms(lam):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+        return sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m
+
+    lam = big_l.copy()
+    active = np.ones(lam.shape, dtype=bool)
+    for _ in range(max_iterations):
+        sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m = sigma_terms(lam)
+        c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        lam_next = big_l + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+        )
+
+        # Freeze converged elements so every result depends only on its own
+        # inputs, not on the other elements of the batch
+        converged = np.abs(lam_next - lam) <= tolerance
+        lam = np.where(active, lam_next, lam)
+        active &= ~converged
+        if not active.any():
+            break
+
+    sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m = sigma_terms(lam)
+    u_sq = cos2_alpha * (a * a - b * b) / (b * b)
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = big_b * sin_sigma * (
+        cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        )
+    )
+    return b * big_a * (sigma - delta_sigma)
@@ -0,0 +1,110 @@
+import json
+import re
+
+WHITESPACE = re.compile(r'\s*')
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+class _StreamParser:
+    """Minimal pull parser over a text stream: decodes one JSON value at a
+    time with json's raw_decode and keeps only a small window in memory"""
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Read the next chunk, dropping the already consumed prefix"""
+
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character without consuming it ('' at EOF)"""
+
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Invalid GeoJSON stream: expected one of {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete JSON value"""
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues past the buffer
+                if self._fill():
+                    continue
+                raise
+            # A number at the very end of the window may still continue
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+def _project(feature, properties):
+    props = feature.get('properties') or {}
+    feature['properties'] = {name: props.get(name) for name in properties}
+    return feature
+
+def iter_features(path, properties=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the features of a GeoJSON FeatureCollection file one by one.
+
+    The file is parsed as a stream, so memory use does not depend on the file
+    size and the first features are available before the whole file is read.
+    With properties, each feature keeps only those property names.
+    """
+
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_stream_features(f, properties, chunk_size)
+
+def iter_stream_features(stream, properties=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """iter_features over an already open text stream, e.g. an HTTP body"""
+
+    parser = _StreamParser(stream, chunk_size)
+    parser.expect('{')
+    if parser.peek() == '}':
+        return
+
+    while True:
+        key = parser.value()
+        parser.expect(':')
+        if key == 'features':
+            parser.expect('[')
+            if parser.peek() != ']':
+                while True:
+                    feature = parser.value()
+                    yield _project(feature, properties) if properties is not None else feature
+                    if parser.expect(',]') == ']':
+                        break
+            else:
+                parser.expect(']')
+        else:
+            # Small top-level members such as "type" and "crs"
+            parser.value()
+
+        if parser.expect(',}') == '}':
+            return
@@ -0,0 +1,118 @@
+import math
+
+import numpy as np
+
+from tile_pyramid import MAX_LATITUDE
+
+# Hexagons are laid out in Web Mercator metres (EPSG:3857), so every cell of
+# a zoom level has the same size on screen: HEX_RADIUS_PX is the distance
+# from centre to corner in pixels at the zoom it is built for
+HEX_RADIUS_PX = 20
+EARTH_RADIUS_M = 6378137.0
+TILE_SIZE_PX = 256
+
+# Zoom levels that get their own grid; closer in, the points themselves
+# are shown
+DEFAULT_MIN_ZOOM = 8
+DEFAULT_MAX_ZOOM = 13
+
+# Fill colours by coverage, from none to full (red to green), and for
+# cells without any fountain of the reference set
+COVERAGE_BINS = (0.2, 0.4, 0.6, 0.8, 1.0)
+COVERAGE_COLORS = ('#d73027', '#fc8d59', '#fee08b', '#d9ef8b', '#91cf60', '#1a9850')
+NO_REFERENCE_COLOR = '#4575b4'
+
+# Offset that keeps axial coordinates positive when packed into one int64
+_AXIAL_OFFSET = 1 << 30
+
+def mercator(lat, lon):
+    """Web Mercator x/y in metres"""
+
+    lat = np.clip(np.asarray(lat, dtype=float), -MAX_LATITUDE, MAX_LATITUDE)
+    x = EARTH_RADIUS_M * np.radians(np.asarray(lon, dtype=float))
+    y = EARTH_RADIUS_M * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+def hex_radius_m(zoom):
+    """Centre-to-corner size in Mercator metres of the cells for zoom"""
+    return HEX_RADIUS_PX * 2 * math.pi * EARTH_RADIUS_M / (TILE_SIZE_PX * 2 ** zoom)
+
+def hex_cells(x, y, radius):
+    """Axial coordinates (q, r) of the pointy-top hexagons containing the
+    points, by rounding fractional cube coordinates"""
+
+    q = (math.sqrt(3) / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    # The coordinate with the largest rounding error is the one to fix
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+def hex_centers(q, r, radius):
+    """Mercator x/y of the centres of the hexagons (q, r)"""
+    return radius * math.sqrt(3) * (q + r / 2), radius * 1.5 * r
+
+def aggregate(layers, zooms):
+    """Count the points of every layer (name -> (lat, lon)) per hexagon.
+
+    All points are projected once; per zoom one sort of the packed cell
+    keys and one bincount give the counts of all layers together. Returns
+    zoom -> (q, r, counts) with counts of shape (cells, layers), in the
+    order of layers.
+    """
+
+    names = list(layers)
+    lat = np.concatenate([np.asarray(layers[name][0], dtype=float) for name in names])
+    lon = np.concatenate([np.asarray(layers[name][1], dtype=float) for name in names])
+    layer_ids = np.repeat(np.arange(len(names)), [len(layers[name][0]) for name in names])
+    x, y = mercator(lat, lon)
+
+    grids = {}
+    for zoom in zooms:
+        q, r = hex_cells(x, y, hex_radius_m(zoom))
+        keys = (q + _AXIAL_OFFSET) << 31 | (r + _AXIAL_OFFSET)
+        cells, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse * len(names) + layer_ids, minlength=len(cells) * len(names))
+        grids[zoom] = ((cells >> 31) - _AXIAL_OFFSET, (cells & ((1 << 31) - 1)) - _AXIAL_OFFSET,
+                       counts.reshape(len(cells), len(names)))
+    return grids
+
+def coverage_colors(ratio, totals):
+    """Fill colour per cell from its coverage ratio (NaN without reference
+    fountains), and a fill opacity growing with the number of points"""
+
+    colors = np.array(COVERAGE_COLORS, dtype=object)[np.digitize(np.nan_to_num(ratio), COVERAGE_BINS)]
+    colors[np.isnan(ratio)] = NO_REFERENCE_COLOR
+    opacity = 0.25 + 0.5 * np.log1p(totals) / np.log1p(max(int(totals.max(initial=0)), 1))
+    return colors, np.round(opacity, 2)
+
+def density_grids(layers, coverage, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM):
+    """JSON-ready hexagon grids for zooms min_zoom..max_zoom.
+
+    coverage = (numerator, denominator) names two of the layers; a cell's
+    coverage is their count ratio, e.g. matched / bwb. Each grid holds the
+    axial q and r of its cells, the counts per layer, coverage in percent
+    (None without denominator points), colour and opacity.
+    """
+
+    names = list(layers)
+    numerator, denominator = names.index(coverage[0]), names.index(coverage[1])
+    grids = {}
+    for zoom, (q, r, counts) in aggregate(layers, range(min_zoom, max_zoom + 1)).items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(counts[:, denominator] > 0, counts[:, numerator] / counts[:, denominator], np.nan)
+        colors, opacity = coverage_colors(ratio, counts.sum(axis=1))
+        grids[zoom] = {
+            'q': q.tolist(),
+            'r': r.tolist(),
+            'counts': {name: counts[:, k].tolist() for k, name in enumerate(names)},
+            'coverage': [None if np.isnan(v) else int(round(v * 100)) for v in ratio.tolist()],
+            'color': colors.tolist(),
+            'opacity': opacity.tolist(),
+        }
+    return grids
@@ -0,0 +1,200 @@
+import json
+import os
+
+import numpy as np
+
+from assignment import assign
+from matching import candidate_pairs_arrays, filter_pairs, search_radius
+from snapshot_cache import CACHE_DIR
+from spatial_index import GridIndex
+
+MATCH_STATE_DIR = os.path.join(CACHE_DIR, 'matches')
+
+# Bump when the state layout changes so old state triggers a full run
+MATCH_STATE_VERSION = 1
+
+COORDINATE_COLUMNS = ('x', 'y', 'lat', 'lon')
+
+def match_state_path(name='osm_bwb', directory=MATCH_STATE_DIR):
+    return os.path.join(directory, f"{name}.npz")
+
+def osm_feature_keys(osm_df):
+    """Stable OSM keys: node and way ids can collide, so include the type"""
+
+    keys = osm_df['osm_id'].astype(str)
+    if 'osm_type' in osm_df.columns:
+        keys = osm_df['osm_type'].astype(str) + '/' + keys
+    return keys.to_numpy().astype(str)
+
+def bwb_feature_keys(bwb_df):
+    return bwb_df['bwb_id'].astype(str).to_numpy().astype(str)
+
+def load_match_state(path):
+    """Inputs and matches of the previous run, or None"""
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            state = {name: data[name] for name in data.files}
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    state['params'] = json.loads(str(state['params']))
+    return state
+
+def save_match_state(path, osm_keys, osm, bwb_keys, bwb, matches, params):
+    """Persist both inputs (keys and coordinates) and the match table,
+    which holds keys rather than positions so it survives reordering"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    match_osm = np.array([osm_keys[i] for i, _, _ in matches], dtype=osm_keys.dtype if len(osm_keys) else str)
+    match_bwb = np.array([bwb_keys[j] for _, j, _ in matches], dtype=bwb_keys.dtype if len(bwb_keys) else str)
+    arrays = {
+        'osm_keys': osm_keys, 'bwb_keys': bwb_keys,
+        'match_osm': match_osm, 'match_bwb': match_bwb,
+        'match_dist': np.array([d for _, _, d in matches], dtype=float),
+        'params': np.array(json.dumps(dict(params, version=MATCH_STATE_VERSION))),
+    }
+    for name in COORDINATE_COLUMNS:
+        arrays[f"osm_{name}"] = np.asarray(osm[name], dtype=float)
+        arrays[f"bwb_{name}"] = np.asarray(bwb[name], dtype=float)
+
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+def diff_points(old_keys, old, new_keys, new):
+    """Compare two point sets by key and coordinates.
+
+    Returns (changed_new, changed_old, unchanged_new, unchanged_old):
+    positions of added or moved points in the new set, of removed or moved
+    points in the old set, and the aligned positions of everything else.
+    """
+
+    old_position = {key: i for i, key in enumerate(old_keys.tolist())}
+    new_pos = np.arange(len(new_keys))
+    old_pos = np.array([old_position.get(key, -1) for key in new_keys.tolist()], dtype=np.int64)
+
+    same = old_pos >= 0
+    for name in COORDINATE_COLUMNS:
+        values = np.asarray(new[name], dtype=float)
+        previous = np.asarray(old[name], dtype=float)[np.where(same, old_pos, 0)]
+        same &= (values == previous) | (np.isnan(values) & np.isnan(previous))
+
+    unchanged_new, unchanged_old = new_pos[same], old_pos[same]
+    kept_old = np.zeros(len(old_keys), dtype=bool)
+    kept_old[unchanged_old] = True
+    return new_pos[~same], np.flatnonzero(~kept_old), unchanged_new, unchanged_old
+
+def _take(points, positions):
+    return {name: np.asarray(points[name])[positions] for name in COORDINATE_COLUMNS}
+
+def _neighbours(index, points, query, query_pos, max_distance_m, refine, query_is_osm):
+    """Positions in points within max_distance_m of query[query_pos], using
+    exactly the distance test of the full matcher"""
+
+    if len(query_pos) == 0:
+        return np.empty(0, dtype=np.int64)
+    subset = _take(query, query_pos)
+    q, p = index.candidate_pairs(subset['x'], subset['y'])
+    if query_is_osm:
+        q, p, _ = filter_pairs(subset, points, q, p, max_distance_m, refine)
+    else:
+        p, q, _ = filter_pairs(points, subset, p, q, max_distance_m, refine)
+    return np.unique(p)
+
+def affected_neighbourhoods(osm, bwb, seed_osm, seed_bwb, max_distance_m, refine=True,
+                            osm_index=None, bwb_index=None):
+    """Close the seed points over the candidate graph: every point connected
+    to a seed through a chain of candidate pairs. The work grows with the
+    size of the affected components, not with the size of the inputs."""
+
+    radius = search_radius(max_distance_m)
+    osm_index = osm_index or GridIndex(osm['x'], osm['y'], radius)
+    bwb_index = bwb_index or GridIndex(bwb['x'], bwb['y'], radius)
+
+    in_osm = np.zeros(len(osm['x']), dtype=bool)
+    in_bwb = np.zeros(len(bwb['x']), dtype=bool)
+    frontier_osm = np.unique(np.asarray(seed_osm, dtype=np.int64))
+    frontier_bwb = np.unique(np.asarray(seed_bwb, dtype=np.int64))
+    in_osm[frontier_osm] = True
+    in_bwb[frontier_bwb] = True
+
+    while len(frontier_osm) or len(frontier_bwb):
+        reached_bwb = _neighbours(bwb_index, bwb, osm, frontier_osm, max_distance_m, refine, True)
+        reached_osm = _neighbours(osm_index, osm, bwb, frontier_bwb, max_distance_m, refine, False)
+        frontier_bwb = reached_bwb[~in_bwb[reached_bwb]]
+        frontier_osm = reached_osm[~in_osm[reached_osm]]
+        in_bwb[frontier_bwb] = True
+        in_osm[frontier_osm] = True
+
+    return np.flatnonzero(in_osm), np.flatnonzero(in_bwb)
+
+def _order_preserved(unchanged_new, unchanged_old):
+    """Whether unchanged points kept their relative order (greedy matching
+    depends on the input order)"""
+    return bool(np.all(np.diff(unchanged_old[np.argsort(unchanged_new)]) > 0))
+
+def incremental_assign(osm_keys, osm, bwb_keys, bwb, state, max_distance_m, refine=True, mode='greedy'):
+    """Patch the previous match table for new inputs.
+
+    Points that were added, removed or moved seed the affected
+    neighbourhoods: the seeds plus everything connected to them in the new
+    candidate graph, and the new neighbours of where removed or moved points
+    used to be. Matching decomposes over connected components, so only
+    those components are matched again and every other match is carried
+    over by key. Returns (assignments, stats), or (None, reason) when the
+    previous state cannot be reused.
+    """
+
+    params = {'max_distance_m': max_distance_m, 'refine': refine, 'mode': mode}
+    if state is None:
+        return None, "no previous run"
+    if state['params'] != dict(params, version=MATCH_STATE_VERSION):
+        return None, "matching parameters changed"
+
+    old_osm = {name: state[f"osm_{name}"] for name in COORDINATE_COLUMNS}
+    old_bwb = {name: state[f"bwb_{name}"] for name in COORDINATE_COLUMNS}
+    osm_new, osm_old, osm_same_new, osm_same_old = diff_points(state['osm_keys'], old_osm, osm_keys, osm)
+    bwb_new, bwb_old, bwb_same_new, bwb_same_old = diff_points(state['bwb_keys'], old_bwb, bwb_keys, bwb)
+
+    if mode == 'greedy' and not (_order_preserved(osm_same_new, osm_same_old)
+                                 and _order_preserved(bwb_same_new, bwb_same_old)):
+        return None, "input order changed"
+
+    radius = search_radius(max_distance_m)
+    osm_index = GridIndex(osm['x'], osm['y'], radius)
+    bwb_index = GridIndex(bwb['x'], bwb['y'], radius)
+
+    # Unchanged points that lost a neighbour where a point used to be
+    lost_bwb = _neighbours(bwb_index, bwb, old_osm, osm_old, max_distance_m, refine, True)
+    lost_osm = _neighbours(osm_index, osm, old_bwb, bwb_old, max_distance_m, refine, False)
+
+    area_osm, area_bwb = affected_neighbourhoods(
+        osm, bwb, np.concatenate([osm_new, lost_osm]), np.concatenate([bwb_new, lost_bwb]),
+        max_distance_m, refine, osm_index, bwb_index)
+
+    # Carry over matches outside the affected components
+    osm_position = dict(zip(osm_keys.tolist(), range(len(osm_keys))))
+    bwb_position = dict(zip(bwb_keys.tolist(), range(len(bwb_keys))))
+    affected_osm = np.zeros(len(osm_keys), dtype=bool)
+    affected_osm[area_osm] = True
+    kept = []
+    for osm_key, bwb_key, distance in zip(state['match_osm'].tolist(), state['match_bwb'].tolist(),
+                                          state['match_dist'].tolist()):
+        i = osm_position.get(osm_key)
+        if i is not None and not affected_osm[i]:
+            kept.append((i, bwb_position[bwb_key], distance))
+
+    # Match the affected components on their own, preserving input order
+    pair_osm, pair_bwb, pair_dist = candidate_pairs_arrays(_take(osm, area_osm), _take(bwb, area_bwb),
+                                                           max_distance_m, refine=refine)
+    rematched = [(int(area_osm[i]), int(area_bwb[j]), d)
+                 for i, j, d in assign(len(area_osm), pair_osm, pair_bwb, pair_dist, mode=mode)]
+
+    stats = {
+        'osm_changed': len(osm_new) + len(osm_old) - len(np.intersect1d(osm_keys[osm_new], state['osm_keys'][osm_old])),
+        'bwb_changed': len(bwb_new) + len(bwb_old) - len(np.intersect1d(bwb_keys[bwb_new], state['bwb_keys'][bwb_old])),
+        'osm_rematched': len(area_osm),
+        'bwb_rematched': len(area_bwb),
+        'kept': len(kept),
+    }
+    return sorted(kept + rematched), stats
@@ -0,0 +1,129 @@
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+from fountain_table import GOOGLE_FIELDS, table_from_geojson
+from geojson_stream import iter_features
+
+@contextmanager
+def open_kml(path):
+    """Binary stream of the KML document in path. For a KMZ the main .kml
+    member (doc.kml by convention) is decompressed as it is read."""
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [name for name in archive.namelist() if name.lower().endswith('.kml')]
+            if not names:
+                raise ValueError(f"{path} contains no .kml document")
+            name = 'doc.kml' if 'doc.kml' in names else names[0]
+            with archive.open(name) as f:
+                yield f
+    else:
+        with open(path, 'rb') as f:
+            yield f
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _text(elem, name):
+    for child in elem:
+        if _local(child.tag) == name:
+            return (child.text or '').strip() or None
+    return None
+
+def _point(placemark):
+    """lon/lat of the first Point in a placemark (also inside MultiGeometry)"""
+
+    for elem in placemark.iter():
+        if _local(elem.tag) == 'Point':
+            coordinates = _text(elem, 'coordinates')
+            if coordinates:
+                lon, lat = coordinates.split()[0].split(',')[:2]
+                return float(lon), float(lat)
+    return None
+
+def _extended_data(placemark):
+    data = {}
+    for elem in placemark.iter():
+        if _local(elem.tag) == 'Data' and elem.get('name'):
+            data[elem.get('name')] = _text(elem, 'value')
+        elif _local(elem.tag) == 'SimpleData' and elem.get('name'):
+            data[elem.get('name')] = (elem.text or '').strip() or None
+    return data
+
+def iter_kml_features(path):
+    """Yield the placemarks of a KML/KMZ export (e.g. a Google My Maps
+    download) as GeoJSON point features, parsing the document as a stream.
+
+    Properties are the placemark id, a running index, name, description,
+    the enclosing folder (layer) name, the style and any ExtendedData
+    fields. Placemarks without a point are skipped.
+    """
+
+    with open_kml(path) as f:
+        yield from iter_kml_stream_features(f)
+
+def iter_kml_stream_features(stream, placemark_fields=True):
+    """iter_kml_features over an open binary KML stream. Without
+    placemark_fields only the ExtendedData fields become properties."""
+
+    parents = []
+    folders = []
+    index = 0
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        name = _local(elem.tag)
+        if event == 'start':
+            parents.append(elem)
+            if name == 'Folder':
+                folders.append(None)
+            continue
+
+        parents.pop()
+        if name == 'Folder':
+            folders.pop()
+        elif name == 'name' and folders and parents and _local(parents[-1].tag) == 'Folder':
+            folders[-1] = (elem.text or '').strip() or None
+        elif name == 'Placemark':
+            lon_lat = _point(elem)
+            if lon_lat is not None:
+                index += 1
+                properties = {}
+                if placemark_fields:
+                    properties = {
+                        'id': elem.get('id'),
+                        'index': index,
+                        'name': _text(elem, 'name'),
+                        'description': _text(elem, 'description'),
+                        'folder': folders[-1] if folders else None,
+                        'style': _text(elem, 'styleUrl'),
+                    }
+                for key, value in _extended_data(elem).items():
+                    properties.setdefault(key, value)
+                yield {
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': list(lon_lat)},
+                    'properties': properties,
+                }
+            # Drop the placemark from its parent so memory stays flat
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+
+def kml_feature_collection(path, **collection_properties):
+    """GeoJSON FeatureCollection with every located placemark of path"""
+
+    return {
+        'type': 'FeatureCollection',
+        'properties': dict(collection_properties),
+        'features': list(iter_kml_features(path)),
+    }
+
+def read_google_source(path):
+    """FountainTable with the Google My Maps columns from a KML/KMZ export
+    or from a GeoJSON file written by fetch_trinkbrunnen_google_maps.py"""
+
+    if path.lower().endswith(('.kml', '.kmz')) or zipfile.is_zipfile(path):
+        features = iter_kml_features(path)
+    else:
+        features = iter_features(path)
+    return table_from_geojson(features, GOOGLE_FIELDS)
@@ -0,0 +1,146 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Decimal places kept for coordinates in embedded data (~0.1 m)
+COORDINATE_DECIMALS = 6
+
+# Shared data file the maps load their points from in sidecar mode, written
+# next to the HTML pages
+MAP_DATA_FILE = 'trinkbrunnen_data.json'
+
+# Columns the shared data file keeps per source
+BWB_MAP_COLUMNS = ('bwb_id', 'nummer', 'typ', 'strasse', 'einbaujahr', 'betriebszustand', 'eigentuemer')
+OSM_MAP_COLUMNS = ('osm_id', 'osm_type', 'name', 'operator', 'source')
+
+def json_value(value):
+    """JSON-friendly scalar from a NumPy/pandas cell"""
+
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def point_features(lat, lon, columns=None):
+    """Minimal GeoJSON features for points: rounded coordinates and only the
+    given columns (name -> array) as properties"""
+
+    columns = columns or {}
+    lat = np.round(np.asarray(lat, dtype=float), COORDINATE_DECIMALS).tolist()
+    lon = np.round(np.asarray(lon, dtype=float), COORDINATE_DECIMALS).tolist()
+    values = {name: [json_value(v) for v in np.asarray(column, dtype=object).tolist()]
+              for name, column in columns.items()}
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon[i], lat[i]]},
+            'properties': {name: column[i] for name, column in values.items()},
+        }
+        for i in range(len(lat))
+    ]
+
+def feature_collection(lat, lon, columns=None):
+    return {'type': 'FeatureCollection', 'features': point_features(lat, lon, columns)}
+
+def collection_from(source, columns):
+    """FeatureCollection of a FountainTable or DataFrame with lat/lon and
+    those of columns it has"""
+    return feature_collection(source['lat'], source['lon'], {name: source[name] for name in columns if name in source})
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def collection_key(name, collection):
+    """Key of a collection in the shared data file: its name plus a digest
+    of its content. Pages address points by row position, so a different
+    selection of the same source must never take the place of the one a
+    page was built against."""
+
+    body = json.dumps(collection, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return f"{name}-{hashlib.sha256(body.encode('utf-8')).hexdigest()[:12]}"
+
+def _referenced(keys, directory):
+    """Those of keys that a page in directory still mentions"""
+
+    referenced = set()
+    for page in glob.glob(os.path.join(directory, '*.html')):
+        with open(page, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        referenced.update(key for key in keys if key in text)
+    return referenced
+
+def write_map_data(path, collections):
+    """Add named FeatureCollections to the shared map data file at path and
+    write gzip (and, with the brotli package, brotli) copies next to it for
+    servers that hand out precompressed files.
+
+    Every collection is stored under collection_key, so maps built from
+    different selections share the file without disturbing each other.
+    Collections no page next to the file refers to any more are dropped
+    whenever new ones are added. When nothing changed the files are left
+    alone so browsers and proxies keep their cached copy. Returns the key
+    of each collection (name -> key) for the layers to load.
+    """
+
+    keys = {name: collection_key(name, collection) for name, collection in collections.items()}
+    data = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    if set(keys.values()) <= set(data) and os.path.exists(path + '.gz'):
+        return keys
+
+    kept = _referenced(set(data) - set(keys.values()), os.path.dirname(path) or '.')
+    merged = {key: collection for key, collection in data.items() if key in kept}
+    merged.update((keys[name], collection) for name, collection in collections.items())
+
+    body = json.dumps(merged, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    outputs = {path: body, path + '.gz': gzip.compress(body, compresslevel=9, mtime=0)}
+    brotli = _brotli()
+    if brotli is not None:
+        outputs[path + '.br'] = brotli.compress(body, quality=11)
+    for output, content in outputs.items():
+        with open(output + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(output + '.tmp', output)
+
+    sizes = ', '.join(f"{os.path.splitext(o)[1] if o != path else 'json'} {len(c) / 1024:.0f} KB"
+                      for o, c in outputs.items())
+    print(f"Map data written to {path} ({sizes})")
+    return keys
+
+def map_data_path(map_file):
+    """The shared data file next to map_file, and the URL a page uses for it"""
+    return os.path.join(os.path.dirname(map_file) or '.', MAP_DATA_FILE), MAP_DATA_FILE
+
+def map_outputs(map_file, render):
+    """Files a map script writes for a render mode"""
+    return [map_file, map_data_path(map_file)[0]] if render == 'sidecar' else [map_file]
+
+def pack_coordinates(lat, lon):
+    """Points as one flat integer array in units of 10**-COORDINATE_DECIMALS
+    degrees, delta-encoded: lat0, lon0, lat1 - lat0, lon1 - lon0, ..."""
+
+    scale = 10 ** COORDINATE_DECIMALS
+    points = np.column_stack([np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)])
+    points = np.round(points * scale).astype(np.int64)
+    return np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel().tolist()
+
+def encode_column(values):
+    """Dictionary-encode a column as [distinct values, codes]; missing
+    values get code -1"""
+
+    import pandas as pd
+
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return [[json_value(v) for v in uniques], codes.tolist()]
@@ -0,0 +1,363 @@
+import numpy as np
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from folium.plugins import MarkerCluster
+from folium.template import Template
+
+from hex_grid import hex_radius_m
+from map_data import COORDINATE_DECIMALS, encode_column, json_value, pack_coordinates
+
+# Page-wide loader: every layer of a page that reads the same file shares
+# one request (and the browser cache shares it between pages)
+LOAD_DATA_JS = """
+function(url) {
+    window.trinkbrunnenData = window.trinkbrunnenData || {};
+    if (!window.trinkbrunnenData[url]) {
+        window.trinkbrunnenData[url] = fetch(url).then(function(response) {
+            if (!response.ok) { throw new Error(url + ': HTTP ' + response.status); }
+            return response.json();
+        });
+    }
+    return window.trinkbrunnenData[url];
+}"""
+
+# Client-side fill of a popup/tooltip template: {field} is replaced by the
+# HTML-escaped property, missing values by the template's fallback
+FILL_TEMPLATE_JS = """
+function(text, properties, missing) {
+    return text.replace(/\\{(\\w+)\\}/g, function(_, key) {
+        var value = properties[key];
+        if (value === null || value === undefined || value === '') { return missing; }
+        return String(value).replace(/[&<>"']/g, function(c) {
+            return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+        });
+    });
+}"""
+
+class PointLayer(Layer):
+    """A whole point set as one GeoJSON layer.
+
+    Points are drawn as circle markers coloured by the color_by property
+    (colors maps values to CSS colours). Popups and tooltips are filled on
+    the client from one shared template the first time they open, so the
+    page carries the data once instead of one inline-styled popup per
+    marker. Templates use {property} placeholders; {lat}, {lon} and {color}
+    are the point's coordinates and fill colour.
+
+    The features are either embedded (features) or loaded after first paint
+    from the shared data file (data_url plus the collection name). With
+    subset only those positions of the collection are drawn; extra holds
+    per-point properties aligned with subset, and joins (prefix ->
+    (collection, positions)) merge the properties of a partner point as
+    prefix_name, with prefix_lat/prefix_lon. link = (prefix, property,
+    threshold) draws a line to the joined point where property exceeds
+    threshold.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var fill = {{ this.fill_js }};
+                var colors = {{ this.colors|tojson }};
+                var style = {{ this.style|tojson }};
+                var popupTemplate = {{ this.popup_template|tojson }};
+                var tooltipTemplate = {{ this.tooltip_template|tojson }};
+                var missing = {{ this.missing|tojson }};
+                var link = {{ this.link|tojson }};
+                var colorOf = function(properties) {
+                    return colors[properties[{{ this.color_by|tojson }}]] || {{ this.default_color|tojson }};
+                };
+                var context = function(layer) {
+                    var latlng = layer.getLatLng();
+                    return Object.assign({lat: latlng.lat.toFixed(6), lon: latlng.lng.toFixed(6),
+                                          color: colorOf(layer.feature.properties)},
+                                         layer.feature.properties);
+                };
+                var layer = L.featureGroup();
+                var points = L.geoJSON(null, {
+                    pointToLayer: function(feature, latlng) {
+                        return L.circleMarker(latlng, Object.assign({fillColor: colorOf(feature.properties)}, style));
+                    },
+                    onEachFeature: function(feature, marker) {
+                        if (popupTemplate) {
+                            marker.bindPopup(function(l) { return fill(popupTemplate, context(l), missing); },
+                                             {maxWidth: {{ this.max_width }}});
+                        }
+                        if (tooltipTemplate) {
+                            marker.bindTooltip(function(l) { return fill(tooltipTemplate, context(l), missing); });
+                        }
+                        var p = feature.properties;
+                        if (link && p[link[1]] > link[2] && p[link[0] + '_lat'] !== undefined) {
+                            var c = feature.geometry.coordinates;
+                            L.polyline([[c[1], c[0]], [p[link[0] + '_lat'], p[link[0] + '_lon']]],
+                                       {color: colorOf(p), weight: 2, opacity: 0.6}).addTo(layer);
+                        }
+                    }
+                }).addTo(layer);
+            {%- if this.data_url %}
+                var subset = {{ this.subset|tojson }};
+                var extra = {{ this.extra|tojson }};
+                var joins = {{ this.joins|tojson }};
+                ({{ this.load_js }})({{ this.data_url|tojson }}).then(function(data) {
+                    var source = data[{{ this.collection|tojson }}].features;
+                    var positions = subset || source.map(function(_, i) { return i; });
+                    points.addData({type: 'FeatureCollection', features: positions.map(function(position, k) {
+                        var feature = source[position];
+                        var properties = Object.assign({}, feature.properties);
+                        Object.keys(extra).forEach(function(name) { properties[name] = extra[name][k]; });
+                        Object.keys(joins).forEach(function(prefix) {
+                            var partner = data[joins[prefix][0]].features[joins[prefix][1][k]];
+                            Object.keys(partner.properties).forEach(function(name) {
+                                properties[prefix + '_' + name] = partner.properties[name];
+                            });
+                            properties[prefix + '_lat'] = partner.geometry.coordinates[1];
+                            properties[prefix + '_lon'] = partner.geometry.coordinates[0];
+                        });
+                        return {type: 'Feature', geometry: feature.geometry, properties: properties};
+                    })});
+                });
+            {%- else %}
+                points.addData({{ this.data|tojson }});
+            {%- endif %}
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, features=None, color_by=None, colors=None, default_color='gray', popup_template=None,
+                 tooltip_template=None, missing='N/A', radius=6, max_width=350, name=None, overlay=True,
+                 control=True, show=True, data_url=None, collection=None, subset=None, extra=None,
+                 joins=None, link=None, weight=1):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'PointLayer'
+        self.data = {'type': 'FeatureCollection', 'features': features or []}
+        self.data_url = data_url
+        self.collection = collection
+        self.subset = None if subset is None else [int(i) for i in subset]
+        self.extra = {name: [json_value(v) for v in values] for name, values in (extra or {}).items()}
+        self.joins = {prefix: [name, [int(i) for i in positions]]
+                      for prefix, (name, positions) in (joins or {}).items()}
+        self.link = list(link) if link else None
+        self.color_by = color_by
+        self.colors = colors or {}
+        self.default_color = default_color
+        self.popup_template = popup_template
+        self.tooltip_template = tooltip_template
+        self.missing = missing
+        self.max_width = int(max_width)
+        self.style = {'radius': radius, 'color': 'white', 'weight': weight, 'fillOpacity': 0.8}
+        self.fill_js = FILL_TEMPLATE_JS.strip()
+        self.load_js = LOAD_DATA_JS.strip()
+
+class PackedPointLayer(JSCSSMixin, Layer):
+    """A large point set as packed arrays, drawn on a canvas.
+
+    Instead of one object per point the page carries the coordinates as
+    one delta-encoded integer array (see pack_coordinates) and every column
+    (name -> values) dictionary-encoded. The browser builds the circle
+    markers in a single loop through one callback, as FastMarkerCluster
+    does, onto a shared canvas renderer, so neither the Python build nor
+    the DOM grows with per-marker objects. Use it on a
+    folium.Map(prefer_canvas=True).
+
+    With cluster the markers go into a chunk-loading marker cluster group.
+    Popups and tooltips are bound once for the whole layer and filled from
+    the templates like PointLayer's. segments = (lat1, lon1, lat2, lon2)
+    are drawn as one multi-line in line_color.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var fill = {{ this.fill_js }};
+                var style = {{ this.style|tojson }};
+                var popupTemplate = {{ this.popup_template|tojson }};
+                var tooltipTemplate = {{ this.tooltip_template|tojson }};
+                var missing = {{ this.missing|tojson }};
+                var columns = {{ this.columns|tojson }};
+                var renderer = L.canvas({padding: 0.5});
+                var decode = function(packed) {
+                    var points = new Array(packed.length / 2), lat = 0, lon = 0;
+                    for (var k = 0; k < points.length; k++) {
+                        lat += packed[2 * k];
+                        lon += packed[2 * k + 1];
+                        points[k] = [lat / {{ this.scale }}, lon / {{ this.scale }}];
+                    }
+                    return points;
+                };
+                var colorColumn = columns[{{ this.color_by|tojson }}];
+                var colors = {{ this.colors|tojson }};
+                var defaultColor = {{ this.default_color|tojson }};
+                var codeColors = colorColumn ? colorColumn[0].map(function(v) { return colors[v] || defaultColor; }) : [];
+                var colorOf = function(i) {
+                    return colorColumn ? codeColors[colorColumn[1][i]] || defaultColor : defaultColor;
+                };
+                var context = function(marker) {
+                    var i = marker.index, latlng = marker.getLatLng();
+                    var properties = {lat: latlng.lat.toFixed(6), lon: latlng.lng.toFixed(6), color: colorOf(i)};
+                    Object.keys(columns).forEach(function(name) {
+                        properties[name] = columns[name][0][columns[name][1][i]];
+                    });
+                    return properties;
+                };
+                var callback = function(latlng, i) {
+                    var marker = L.circleMarker(latlng, Object.assign({renderer: renderer, fillColor: colorOf(i)}, style));
+                    marker.index = i;
+                    return marker;
+                };
+                var layer = L.featureGroup();
+                var markers = decode({{ this.coords|tojson }}).map(callback);
+            {%- if this.cluster %}
+                var points = L.markerClusterGroup({chunkedLoading: true}).addTo(layer);
+                points.addLayers(markers);
+            {%- else %}
+                var points = L.featureGroup(markers).addTo(layer);
+            {%- endif %}
+                if (popupTemplate) {
+                    points.bindPopup(function(marker) { return fill(popupTemplate, context(marker), missing); },
+                                     {maxWidth: {{ this.max_width }}});
+                }
+                if (tooltipTemplate) {
+                    points.bindTooltip(function(marker) { return fill(tooltipTemplate, context(marker), missing); });
+                }
+                var ends = decode({{ this.segments|tojson }});
+                if (ends.length) {
+                    var lines = [];
+                    for (var k = 0; k < ends.length; k += 2) { lines.push([ends[k], ends[k + 1]]); }
+                    L.polyline(lines, {renderer: renderer, color: {{ this.line_color|tojson }}, weight: 2, opacity: 0.6})
+                        .addTo(layer);
+                }
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    default_js = MarkerCluster.default_js
+    default_css = MarkerCluster.default_css
+
+    def __init__(self, lat, lon, columns=None, color_by=None, colors=None, default_color='gray',
+                 popup_template=None, tooltip_template=None, missing='N/A', radius=6, max_width=350,
+                 cluster=False, segments=None, line_color='gray', name=None, overlay=True, control=True,
+                 show=True, weight=1):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'PackedPointLayer'
+        if not cluster:
+            # Only clustered layers need the plugin on the page
+            self.default_js = []
+            self.default_css = []
+        self.scale = 10 ** COORDINATE_DECIMALS
+        self.coords = pack_coordinates(lat, lon)
+        self.columns = {name: encode_column(values) for name, values in (columns or {}).items()}
+        if segments is not None:
+            lat1, lon1, lat2, lon2 = (np.asarray(a, dtype=float) for a in segments)
+            self.segments = pack_coordinates(np.column_stack([lat1, lat2]).ravel(),
+                                             np.column_stack([lon1, lon2]).ravel())
+        else:
+            self.segments = []
+        self.cluster = cluster
+        self.color_by = color_by
+        self.colors = colors or {}
+        self.default_color = default_color
+        self.line_color = line_color
+        self.popup_template = popup_template
+        self.tooltip_template = tooltip_template
+        self.missing = missing
+        self.max_width = int(max_width)
+        self.style = {'radius': radius, 'color': 'white', 'weight': weight, 'fillOpacity': 0.8}
+        self.fill_js = FILL_TEMPLATE_JS.strip()
+
+class HexDensityLayer(Layer):
+    """Hexagon choropleth that stands in for the points at low zoom.
+
+    grids holds one aggregated grid per zoom level (see
+    hex_grid.density_grids); the page carries only the cells' axial
+    coordinates, counts and colours, and the browser builds the hexagons of
+    the current zoom when it is first shown. Below the first grid's zoom the
+    coarsest grid is used; above the last one the layer is empty and the
+    layers in hide (e.g. the point layers) are shown again, which it removes
+    from the map while hexagons are drawn. Tooltips are filled from
+    tooltip_template like PointLayer's, with the layer counts and
+    {coverage} in percent.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var fill = {{ this.fill_js }};
+                var grids = {{ this.grids|tojson }};
+                var tooltipTemplate = {{ this.tooltip_template|tojson }};
+                var missing = {{ this.missing|tojson }};
+                var minZoom = {{ this.min_zoom }}, maxZoom = {{ this.max_zoom }};
+                var hide = [{% for other in this.hide %}{{ other.get_name() }}{{ ", " if not loop.last }}{% endfor %}];
+                var angles = [30, 90, 150, 210, 270, 330].map(function(a) { return a * Math.PI / 180; });
+                var layer = L.featureGroup(), built = {}, current = null, hidden = [];
+                var build = function(zoom) {
+                    var grid = grids[zoom], group = L.featureGroup();
+                    var radius = {{ this.radius }} / Math.pow(2, zoom);
+                    for (var i = 0; i < grid.q.length; i++) {
+                        var x = radius * Math.sqrt(3) * (grid.q[i] + grid.r[i] / 2), y = radius * 1.5 * grid.r[i];
+                        var ring = angles.map(function(a) {
+                            return L.Projection.SphericalMercator.unproject(
+                                L.point(x + radius * Math.cos(a), y + radius * Math.sin(a)));
+                        });
+                        var properties = {coverage: grid.coverage[i]};
+                        Object.keys(grid.counts).forEach(function(name) { properties[name] = grid.counts[name][i]; });
+                        var cell = L.polygon(ring, {color: grid.color[i], weight: 1, opacity: 0.6,
+                                                    fillColor: grid.color[i], fillOpacity: grid.opacity[i]});
+                        if (tooltipTemplate) { cell.bindTooltip(fill(tooltipTemplate, properties, missing)); }
+                        cell.addTo(group);
+                    }
+                    return group;
+                };
+                var restore = function(map) {
+                    hidden.forEach(function(other) { map.addLayer(other); });
+                    hidden = [];
+                };
+                var update = function() {
+                    var map = layer._map;
+                    if (!map) { return; }
+                    var zoom = Math.max(Math.round(map.getZoom()), minZoom);
+                    var wanted = zoom <= maxZoom ? zoom : null;
+                    if (wanted === current) { return; }
+                    if (current !== null) { layer.removeLayer(built[current]); }
+                    current = wanted;
+                    if (current === null) {
+                        restore(map);
+                        return;
+                    }
+                    built[current] = built[current] || build(current);
+                    layer.addLayer(built[current]);
+                    hide.forEach(function(other) {
+                        if (map.hasLayer(other)) {
+                            map.removeLayer(other);
+                            hidden.push(other);
+                        }
+                    });
+                };
+                layer.on('add', function() {
+                    layer._map.on('zoomend', update);
+                    update();
+                });
+                layer.on('remove', function() {
+                    layer._map.off('zoomend', update);
+                    if (current !== null) { layer.removeLayer(built[current]); }
+                    current = null;
+                    restore(layer._map);
+                });
+                return layer;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, grids, tooltip_template=None, missing='N/A', hide=None, name=None, overlay=True,
+                 control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'HexDensityLayer'
+        self.grids = {str(zoom): grid for zoom, grid in grids.items()}
+        self.min_zoom = min(grids)
+        self.max_zoom = max(grids)
+        self.radius = hex_radius_m(0)
+        self.tooltip_template = tooltip_template
+        self.missing = missing
+        self.hide = list(hide or [])
+        self.fill_js = FILL_TEMPLATE_JS.strip()
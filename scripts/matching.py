@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from geodesy import ellipsoidal_distance, planar_distance
+from spatial_index import GridIndex
+
+# Planar UTM distances differ from geodesic ones by the projection scale
+# (0.9996 on the central meridian, about 1.0055 at the western border of
+# Germany) and the published BWB rechtswert/hochwert are up to ~0.2 m off
+# the projected lat/lon, so candidates are collected with some slack
+PLANAR_SCALE_SLACK = 1.01
+PLANAR_OFFSET_SLACK_M = 1.0
+
+DEFAULT_TILE_SIZE_M = 20000
+
+def search_radius(max_distance_m):
+    """Planar radius that is guaranteed to contain every geodesic match"""
+    return max_distance_m * PLANAR_SCALE_SLACK + PLANAR_OFFSET_SLACK_M
+
+def candidate_pairs_arrays(osm, bwb, max_distance_m, refine=True):
+    """Return (osm_pos, bwb_pos, distance_m) arrays for all pairs closer than
+    max_distance_m.
+
+    osm and bwb are dicts of equal-length arrays with 'x'/'y' (UTM metres) and
+    'lat'/'lon' (degrees). Candidates are found on the projected coordinates
+    through a grid index; with refine the final distances are ellipsoidal.
+    """
+
+    radius = search_radius(max_distance_m)
+    index = GridIndex(bwb['x'], bwb['y'], radius)
+    pair_osm, pair_bwb = index.candidate_pairs(osm['x'], osm['y'])
+    return filter_pairs(osm, bwb, pair_osm, pair_bwb, max_distance_m, refine)
+
+def filter_pairs(osm, bwb, pair_osm, pair_bwb, max_distance_m, refine=True):
+    """Keep the grid-index candidates that are really closer than
+    max_distance_m and return them with their distances"""
+
+    radius = search_radius(max_distance_m)
+    planar = planar_distance(osm['x'][pair_osm], osm['y'][pair_osm], bwb['x'][pair_bwb], bwb['y'][pair_bwb])
+    near = planar < radius
+    pair_osm, pair_bwb = pair_osm[near], pair_bwb[near]
+
+    if refine:
+        pair_dist = ellipsoidal_distance(
+            osm['lat'][pair_osm], osm['lon'][pair_osm],
+            bwb['lat'][pair_bwb], bwb['lon'][pair_bwb],
+        )
+    else:
+        pair_dist = planar[near]
+
+    within = pair_dist < max_distance_m
+    return pair_osm[within], pair_bwb[within], pair_dist[within]
+
+def _take(columns, positions):
+    return {name: values[positions] for name, values in columns.items()}
+
+def _match_tile(task):
+    """Worker: candidate pairs between the OSM points owned by one tile and
+    the BWB points inside that tile plus its halo, in global positions"""
+
+    osm_pos, osm, bwb_pos, bwb, max_distance_m, refine = task
+    pair_osm, pair_bwb, pair_dist = candidate_pairs_arrays(osm, bwb, max_distance_m, refine=refine)
+    return osm_pos[pair_osm], bwb_pos[pair_bwb], pair_dist
+
+def _tile_groups(tile_x, tile_y, positions):
+    """Yield ((tile_x, tile_y), positions) for every non-empty tile"""
+
+    if len(positions) == 0:
+        return
+    order = np.lexsort((tile_y, tile_x))
+    keys = np.stack([tile_x[order], tile_y[order]], axis=1)
+    boundaries = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    for run in np.split(order, boundaries):
+        yield (int(tile_x[run[0]]), int(tile_y[run[0]])), positions[run]
+
+def _bwb_tile_members(bwb_x, bwb_y, tile_size_m, halo_m):
+    """Map each tile to the BWB positions inside it or inside its halo"""
+
+    positions = np.arange(len(bwb_x))
+    lo_x = np.floor((bwb_x - halo_m) / tile_size_m).astype(np.int64)
+    hi_x = np.floor((bwb_x + halo_m) / tile_size_m).astype(np.int64)
+    lo_y = np.floor((bwb_y - halo_m) / tile_size_m).astype(np.int64)
+    hi_y = np.floor((bwb_y + halo_m) / tile_size_m).astype(np.int64)
+
+    # With halo < tile size a point touches at most 2x2 tiles
+    parts_x, parts_y, parts_pos = [], [], []
+    for tx, ty, extra in ((lo_x, lo_y, None), (hi_x, lo_y, hi_x != lo_x),
+                          (lo_x, hi_y, hi_y != lo_y), (hi_x, hi_y, (hi_x != lo_x) & (hi_y != lo_y))):
+        keep = slice(None) if extra is None else extra
+        parts_x.append(tx[keep])
+        parts_y.append(ty[keep])
+        parts_pos.append(positions[keep])
+
+    members = {}
+    for key, tile_positions in _tile_groups(np.concatenate(parts_x), np.concatenate(parts_y),
+                                            np.concatenate(parts_pos)):
+        members[key] = tile_positions
+    return members
+
+def tiled_candidate_pairs(osm, bwb, max_distance_m, refine=True,
+                          tile_size_m=DEFAULT_TILE_SIZE_M, workers=None):
+    """Candidate pairs computed tile by tile in a process pool.
+
+    Every OSM point belongs to exactly one tile, and each tile sees the BWB
+    points within a halo of one search radius around it, so every pair is
+    found exactly once and the merged result equals candidate_pairs_arrays.
+
+    Tiling spreads the CPU work and bounds each worker's memory to one
+    tile's points. It does not bound the caller's: the parent still holds
+    both full inputs and every merged pair, so peak memory grows with the
+    dataset, not with tile_size_m.
+    """
+
+    halo_m = search_radius(max_distance_m)
+    if halo_m >= tile_size_m:
+        raise ValueError(f"Tile size ({tile_size_m} m) must be larger than the match radius ({halo_m:.0f} m)")
+
+    osm_tile_x = np.floor(osm['x'] / tile_size_m).astype(np.int64)
+    osm_tile_y = np.floor(osm['y'] / tile_size_m).astype(np.int64)
+    bwb_members = _bwb_tile_members(bwb['x'], bwb['y'], tile_size_m, halo_m)
+
+    def tasks():
+        for key, osm_pos in _tile_groups(osm_tile_x, osm_tile_y, np.arange(len(osm['x']))):
+            bwb_pos = bwb_members.get(key)
+            if bwb_pos is None:
+                continue
+            yield osm_pos, _take(osm, osm_pos), bwb_pos, _take(bwb, bwb_pos), max_distance_m, refine
+
+    workers = workers or os.cpu_count() or 1
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for task in tasks():
+            pending.add(executor.submit(_match_tile, task))
+            # Keep only a bounded number of tiles in flight
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+        results.extend(future.result() for future in pending)
+
+    if not results:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), np.empty(0, dtype=float)
+
+    pair_osm = np.concatenate([r[0] for r in results])
+    pair_bwb = np.concatenate([r[1] for r in results])
+    pair_dist = np.concatenate([r[2] for r in results])
+    order = np.lexsort((pair_bwb, pair_osm))
+    return pair_osm[order], pair_bwb[order], pair_dist[order]
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+OSM_CACHE_DIR = '../data/cache/osm'
+
+DEFAULT_TTL_S = 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+BERLIN_PLACE = "Berlin, Germany"
+DRINKING_WATER_TAGS = {'amenity': 'drinking_water'}
+
+class ResultCache:
+    """Persistent keyed cache on disk with a TTL and size-based eviction.
+
+    Each entry is a pickle plus a small JSON metadata file. Entries older than
+    the TTL are treated as missing, and once the directory grows beyond
+    max_bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, directory=OSM_CACHE_DIR, ttl_s=DEFAULT_TTL_S, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts):
+        """Stable key for a query described by JSON-serializable parts"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.pkl', base + '.json'
+
+    def _read_meta(self, key):
+        try:
+            with open(self._paths(key)[1], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, key, meta):
+        path = self._paths(key)[1]
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        """Cached value for key, or None when missing or expired"""
+
+        meta = self._read_meta(key)
+        if meta is None or time.time() - meta['created'] > self.ttl_s:
+            return None
+        try:
+            with open(self._paths(key)[0], 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return None
+
+        meta['last_used'] = time.time()
+        self._write_meta(key, meta)
+        return value
+
+    def created(self, key):
+        """Creation time of the entry for key, or None when missing or expired"""
+
+        meta = self._read_meta(key)
+        if meta is None or time.time() - meta['created'] > self.ttl_s:
+            return None
+        return meta['created']
+
+    def put(self, key, value, description=''):
+        """Store value under key and evict old entries if over budget"""
+
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, _ = self._paths(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, data_path)
+
+        now = time.time()
+        self._write_meta(key, {
+            'created': now,
+            'last_used': now,
+            'size': os.path.getsize(data_path),
+            'description': description,
+        })
+        self.evict()
+
+    def get_or_compute(self, key, compute, description='', refresh=False):
+        """Return the cached value for key, computing and storing it on a miss"""
+
+        if not refresh:
+            value = self.get(key)
+            if value is not None:
+                return value, True
+        value = compute()
+        self.put(key, value, description)
+        return value, False
+
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                key = name[:-len('.json')]
+                meta = self._read_meta(key)
+                if meta is not None:
+                    entries.append((key, meta))
+        return entries
+
+    def remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over max_bytes"""
+
+        now = time.time()
+        live = []
+        for key, meta in self.entries():
+            if now - meta['created'] > self.ttl_s:
+                self.remove(key)
+            else:
+                live.append((meta['last_used'], key, meta['size']))
+
+        total = sum(size for _, _, size in live)
+        for _, key, size in sorted(live):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+def cached_features_from_place(place=BERLIN_PLACE, tags=DRINKING_WATER_TAGS, cache=None, refresh=False):
+    """osmnx features_from_place through the shared on-disk cache"""
+
+    cache = cache or ResultCache()
+    key = cache.key('features_from_place', place, tags)
+
+    def query():
+        import osmnx as ox
+        return ox.features_from_place(place, tags=tags)
+
+    features, hit = cache.get_or_compute(key, query, f"features_from_place {place} {tags}", refresh)
+    print(f"OSM features for {place}: {'cache hit' if hit else 'fetched from Overpass'}")
+    return features
+
+def cached_features_created(place=BERLIN_PLACE, tags=DRINKING_WATER_TAGS, cache=None):
+    """When the cached features_from_place result was fetched, or None when
+    the next call would query Overpass"""
+
+    cache = cache or ResultCache()
+    return cache.created(cache.key('features_from_place', place, tags))
+
+def osm_source(osm_file=None, place=BERLIN_PLACE, tags=DRINKING_WATER_TAGS):
+    """Input files and parameters that identify the OSM data a run reads
+    (the extract, or the cached Overpass result), and whether it has to be
+    fetched again regardless"""
+
+    if osm_file:
+        return [osm_file], [], False
+    created = cached_features_created(place, tags)
+    return [], ['overpass', place, tags, created], created is None
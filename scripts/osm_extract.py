@@ -0,0 +1,191 @@
+import bz2
+import gzip
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from fountain_table import OSM_FIELDS, FountainTableBuilder
+from osm_cache import DRINKING_WATER_TAGS
+
+OSM_COLUMNS = ('osm_id', 'osm_type') + OSM_FIELDS
+
+def _open_xml(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+def _iter_elements(path):
+    """Yield top-level node/way/relation elements of an OSM XML file,
+    discarding each one once the caller is done with it"""
+
+    with _open_xml(path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in ('node', 'way', 'relation'):
+                yield elem
+                root.clear()
+
+def _matches(tags, wanted):
+    return all(tags.get(key) == value for key, value in wanted.items())
+
+def way_centroids(coords, offsets, closed):
+    """Centroids for many ways at once.
+
+    coords is an (n, 2) lon/lat array of all way nodes back to back and
+    offsets the start of every way in it. Closed ways get the area centroid
+    of their ring (what shapely returns for the polygon osmnx builds), open
+    ways the length-weighted centroid of their line.
+    """
+
+    coords = np.asarray(coords, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_ways = len(offsets)
+    if n_ways == 0:
+        return np.empty(0), np.empty(0)
+
+    counts = np.diff(np.append(offsets, len(coords)))
+    # Segment k runs from node k to node k + 1 within the same way
+    way_of_node = np.repeat(np.arange(n_ways), counts)
+    last_node = np.zeros(len(coords), dtype=bool)
+    last_node[offsets + counts - 1] = True
+    seg_start = np.flatnonzero(~last_node)
+    seg_way = way_of_node[seg_start]
+    x0, y0 = coords[seg_start, 0], coords[seg_start, 1]
+    x1, y1 = coords[seg_start + 1, 0], coords[seg_start + 1, 1]
+
+    def per_way(values):
+        return np.bincount(seg_way, weights=values, minlength=n_ways)
+
+    # Shoelace area centroid for rings
+    cross = x0 * y1 - x1 * y0
+    area2 = per_way(cross)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ring_x = per_way((x0 + x1) * cross) / (3 * area2)
+        ring_y = per_way((y0 + y1) * cross) / (3 * area2)
+
+    # Length-weighted midpoints for lines (and degenerate rings)
+    length = np.hypot(x1 - x0, y1 - y0)
+    total_length = per_way(length)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        line_x = per_way((x0 + x1) / 2 * length) / total_length
+        line_y = per_way((y0 + y1) / 2 * length) / total_length
+
+    # Fall back to the first node for single-node or zero-length ways
+    first_x, first_y = coords[offsets, 0], coords[offsets, 1]
+    line_x = np.where(total_length > 0, line_x, first_x)
+    line_y = np.where(total_length > 0, line_y, first_y)
+
+    use_ring = np.asarray(closed, dtype=bool) & (area2 != 0)
+    return np.where(use_ring, ring_x, line_x), np.where(use_ring, ring_y, line_y)
+
+def _append_row(builder, lat, lon, osm_type, osm_id, tags):
+    builder.append(lat, lon, [osm_id, osm_type] + [tags.get(name, '') for name in OSM_FIELDS])
+
+def _build_with_ways(builder, ways, node_coords):
+    """Add matching ways to builder, computing all centroids in one batch"""
+
+    coords = []
+    offsets = []
+    closed = []
+    kept = []
+    for way_id, refs, tags in ways:
+        points = [node_coords[ref] for ref in refs if ref in node_coords]
+        if not points:
+            continue
+        offsets.append(len(coords))
+        coords.extend(points)
+        closed.append(len(refs) > 3 and refs[0] == refs[-1])
+        kept.append((way_id, tags))
+
+    lon, lat = way_centroids(np.array(coords).reshape(-1, 2), offsets, closed)
+    for (way_id, tags), way_lat, way_lon, is_closed in zip(kept, lat, lon, closed):
+        yield way_id, tags, way_lat, way_lon, is_closed
+
+def read_osm_xml(path, tags=DRINKING_WATER_TAGS, include_open_ways=False):
+    """Drinking water nodes and ways from a .osm XML extract (optionally .gz
+    or .bz2) as a FountainTable.
+
+    The file is parsed incrementally. A second pass, only needed when ways
+    match, collects the coordinates of just the nodes those ways reference.
+    """
+
+    builder = FountainTableBuilder(OSM_COLUMNS)
+    ways = []
+
+    for elem in _iter_elements(path):
+        element_tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+        if not _matches(element_tags, tags):
+            continue
+        if elem.tag == 'node':
+            _append_row(builder, float(elem.get('lat')), float(elem.get('lon')),
+                        'node', int(elem.get('id')), element_tags)
+        elif elem.tag == 'way':
+            refs = [int(nd.get('ref')) for nd in elem.iter('nd')]
+            ways.append((int(elem.get('id')), refs, element_tags))
+
+    if ways:
+        needed = {ref for _, refs, _ in ways for ref in refs}
+        node_coords = {}
+        for elem in _iter_elements(path):
+            if elem.tag != 'node':
+                # Nodes come first in OSM files
+                break
+            node_id = int(elem.get('id'))
+            if node_id in needed:
+                node_coords[node_id] = (float(elem.get('lon')), float(elem.get('lat')))
+
+        for way_id, way_tags, lat, lon, closed in _build_with_ways(builder, ways, node_coords):
+            if closed or include_open_ways:
+                _append_row(builder, lat, lon, 'way', way_id, way_tags)
+
+    return builder.build()
+
+def read_osm_pbf(path, tags=DRINKING_WATER_TAGS, include_open_ways=False):
+    """Drinking water nodes and ways from a .osm.pbf extract as a
+    FountainTable. Needs the optional osmium (pyosmium) package."""
+
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading .osm.pbf extracts requires pyosmium: pip install osmium")
+
+    builder = FountainTableBuilder(OSM_COLUMNS)
+    ways = []
+    node_coords = {}
+
+    class DrinkingWaterHandler(osmium.SimpleHandler):
+        def node(self, n):
+            if _matches(n.tags, tags):
+                _append_row(builder, n.location.lat, n.location.lon, 'node', n.id, dict(n.tags))
+
+        def way(self, w):
+            if _matches(w.tags, tags):
+                refs = []
+                for nd in w.nodes:
+                    if nd.location.valid():
+                        node_coords[nd.ref] = (nd.location.lon, nd.location.lat)
+                    refs.append(nd.ref)
+                ways.append((w.id, refs, dict(w.tags)))
+
+    DrinkingWaterHandler().apply_file(path, locations=True)
+
+    for way_id, way_tags, lat, lon, closed in _build_with_ways(builder, ways, node_coords):
+        if closed or include_open_ways:
+            _append_row(builder, lat, lon, 'way', way_id, way_tags)
+
+    return builder.build()
+
+def read_osm_extract(path, tags=DRINKING_WATER_TAGS, include_open_ways=False):
+    """Drinking water features from a local OSM extract (.osm.pbf, .osm,
+    .osm.gz or .osm.bz2) with the same columns as osm_table_from_features.
+
+    Closed ways are reduced to their area centroid, like the polygons osmnx
+    returns; open ways are only kept with include_open_ways.
+    """
+
+    if path.endswith('.pbf'):
+        return read_osm_pbf(path, tags, include_open_ways)
+    return read_osm_xml(path, tags, include_open_ways)
@@ -0,0 +1,200 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from assignment import ASSIGNMENT_MODES
+from bwb_data import BWB_WFS_FILE
+from build_cache import BuildCache, captured_output
+from compare_osm_vs_bwb_trinkbrunnen import (COMPARISON_MAP_FILE, create_comparison_map, find_matches,
+                                             generate_analysis_report, load_bwb_data, osm_data, stage_params)
+from create_trinkbrunnen_map import MAP_FILE as FOUNTAIN_MAP_FILE, create_trinkbrunnen_map
+from fountain_filter import parse_bbox, parse_where
+from map_data import BWB_MAP_COLUMNS, OSM_MAP_COLUMNS, collection_from, map_data_path, map_outputs, write_map_data
+from osm_cache import osm_source
+from simple_comparison_map import MAP_FILE as SIMPLE_MAP_FILE, create_simple_comparison_map
+
+class Stage:
+    """One node of the pipeline: function is called with the values of the
+    stages in deps, in that order, followed by args. Stages in after only
+    have to finish first and are not part of the cache key, so a stage
+    keys the same as when a map script runs it alone. files and params are
+    the further inputs of its cache key, outputs the files it writes."""
+
+    def __init__(self, function, deps=(), args=(), files=(), params=(), outputs=(), force=False, after=()):
+        self.function = function
+        self.deps = tuple(deps)
+        self.after = tuple(after)
+        self.args = tuple(args)
+        self.files = list(files)
+        self.params = list(params)
+        self.outputs = list(outputs)
+        self.force = force
+
+def run_stage(function, args):
+    """Run a stage in a worker; returns (value, printed output, seconds) so
+    the output of concurrent stages is not interleaved"""
+
+    start = time.perf_counter()
+    result = {}
+
+    def call():
+        result['value'] = function(*args)
+
+    log = captured_output(call)
+    return result['value'], log, time.perf_counter() - start
+
+def run_pipeline(stages, cache, workers=None):
+    """Run the stages (name -> Stage) in dependency order.
+
+    Every stage whose dependencies are available is looked up in the
+    build cache and, when it has to run, submitted to a process pool, so
+    independent stages (the maps and the report) run concurrently.
+    Returns (artifacts, timings): name -> Artifact, and name -> seconds
+    (None for stages that were up to date).
+    """
+
+    artifacts, timings = {}, {}
+    pending = dict(stages)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [name for name, stage in pending.items()
+                     if all(dep in artifacts for dep in stage.deps + stage.after)]
+            for name in ready:
+                stage = pending.pop(name)
+                inputs = stage.files + [artifacts[dep] for dep in stage.deps]
+                artifact, key = cache.lookup(name, inputs, stage.params, stage.outputs, stage.force)
+                if artifact is not None:
+                    artifacts[name], timings[name] = artifact, None
+                    continue
+                args = [artifacts[dep].value for dep in stage.deps] + list(stage.args)
+                running[executor.submit(run_stage, stage.function, args)] = (name, key, stage)
+            if ready:
+                # Cached stages may have unblocked others
+                continue
+            if not running:
+                raise ValueError(f"stages with unknown or circular dependencies: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key, stage = running.pop(future)
+                value, log, seconds = future.result()
+                print(log, end='')
+                artifacts[name] = cache.store(name, key, value, stage.outputs, seconds)
+                timings[name] = seconds
+    return artifacts, timings
+
+def write_all_map_data(bwb_df, osm_df, map_file):
+    """Write every collection the maps read in sidecar mode up front, so the
+    concurrently rendered maps find the shared data file current instead of
+    all merging into it at once"""
+
+    data_file, _ = map_data_path(map_file)
+    write_map_data(data_file, {
+        'bwb': collection_from(bwb_df, BWB_MAP_COLUMNS),
+        'osm': collection_from(osm_df, OSM_MAP_COLUMNS),
+    })
+    return data_file
+
+def comparison_report(osm_df, bwb_df, matches):
+    return captured_output(generate_analysis_report, osm_df, bwb_df, *matches)
+
+def comparison_map(osm_df, bwb_df, matches, render, hexbins):
+    return create_comparison_map(osm_df, bwb_df, *matches, render=render, hexbins=hexbins)
+
+def simple_map(bwb_df, osm_df, render):
+    return create_simple_comparison_map(render=render, bwb_table=bwb_df, osm_table=osm_df)
+
+def fountain_map(bwb_df, render):
+    return create_trinkbrunnen_map(render, table=bwb_df)
+
+def pipeline_stages(args):
+    """The stage graph for the parsed command line"""
+
+    osm_files, osm_params, stale = osm_source(args.osm_file)
+    stages = {
+        'load': Stage(load_bwb_data, args=(args.where, args.bbox), files=[BWB_WFS_FILE],
+                      params=stage_params(args.where, args.bbox)),
+        'osm': Stage(osm_data, args=(args.osm_file, args.refresh_osm, args.bbox), files=osm_files,
+                     params=osm_params + stage_params(bbox=args.bbox)[1:], force=args.refresh_osm or stale),
+        'match': Stage(find_matches, deps=('osm', 'load'), args=(args.max_distance, True, args.assignment),
+                       params=[args.max_distance, args.assignment]),
+        'report': Stage(comparison_report, deps=('osm', 'load', 'match')),
+        f'map {FOUNTAIN_MAP_FILE}': Stage(fountain_map, deps=('load',), args=(args.render,), params=[args.render],
+                                          outputs=map_outputs(FOUNTAIN_MAP_FILE, args.render)),
+        f'map {SIMPLE_MAP_FILE}': Stage(simple_map, deps=('load', 'osm'), args=(args.render,), params=[args.render],
+                                        outputs=map_outputs(SIMPLE_MAP_FILE, args.render)),
+        f'map {COMPARISON_MAP_FILE}': Stage(comparison_map, deps=('osm', 'load', 'match'),
+                                            args=(args.render, args.hexbins), params=[args.render, args.hexbins],
+                                            outputs=map_outputs(COMPARISON_MAP_FILE, args.render)),
+    }
+    if args.render == 'sidecar':
+        stages['map data'] = Stage(write_all_map_data, deps=('load', 'osm'), args=(COMPARISON_MAP_FILE,),
+                                   outputs=[map_data_path(COMPARISON_MAP_FILE)[0]])
+        for map_file in (FOUNTAIN_MAP_FILE, SIMPLE_MAP_FILE, COMPARISON_MAP_FILE):
+            stages[f'map {map_file}'].after = ('map data',)
+    return stages
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load the BWB and OSM data once, match them once, then render the three maps and "
+                    "the report concurrently")
+    parser.add_argument('--osm-file', metavar='PATH',
+                        help="Read OSM data from a local .osm.pbf/.osm extract instead of Overpass")
+    parser.add_argument('--refresh-osm', action='store_true',
+                        help="Ignore the cached Overpass result and query again")
+    parser.add_argument('--max-distance', type=float, default=50,
+                        help="Maximum distance in metres for a match (default: 50)")
+    parser.add_argument('--assignment', choices=ASSIGNMENT_MODES, default='greedy',
+                        help="Assignment of matches, see compare_osm_vs_bwb_trinkbrunnen.py (default: greedy)")
+    parser.add_argument('--render', choices=('markers', 'sidecar', 'canvas'), default='markers',
+                        help="Render mode of all three maps (default: markers)")
+    parser.add_argument('--hexbins', action='store_true',
+                        help="Add the hexagon coverage layer to the comparison map")
+    parser.add_argument('--where', action='append', metavar='COLUMN=VALUE[,VALUE...]',
+                        help="Only BWB fountains whose column has one of the values (repeatable)")
+    parser.add_argument('--bbox', metavar='MIN_LON,MIN_LAT,MAX_LON,MAX_LAT',
+                        help="Only fountains of both sources inside this box (WGS84 degrees)")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild every stage even when its inputs are unchanged since the last run")
+    args = parser.parse_args()
+    try:
+        args.where = parse_where(args.where)
+        args.bbox = parse_bbox(args.bbox) if args.bbox else None
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+def print_timings(stages, timings, wall_s):
+    print("\n" + "="*60)
+    print("PIPELINE STAGES")
+    print("="*60)
+    for name in stages:
+        seconds = timings.get(name)
+        print(f"  {name:45} {'cached' if seconds is None else f'{seconds:.2f}s':>7}")
+    print(f"  {'total (wall clock)':45} {f'{wall_s:.2f}s':>7}")
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    stages = pipeline_stages(args)
+
+    try:
+        artifacts, timings = run_pipeline(stages, BuildCache(force=args.force), args.workers)
+    except FileNotFoundError as e:
+        print(f"❌ Error: {e}")
+        print("Please run fetch_trinkbrunnen_wfs.py first to download the BWB data.")
+        return 1
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    print(artifacts['report'].value, end='')
+    print_timings(stages, timings, time.perf_counter() - start)
+    print("\nMaps: " + ', '.join(os.path.abspath(f) for f in (FOUNTAIN_MAP_FILE, SIMPLE_MAP_FILE, COMPARISON_MAP_FILE)))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,47 +1,20 @@
-import json
-import folium
-from folium import plugins
-import osmnx as ox
-import pandas as pd
-from shapely.geometry import Point
+import argparse
+import os
+import numpy as np
+from bwb_data import BWB_WFS_FILE, load_bwb_table
+from build_cache import BuildCache
+from compare_osm_vs_bwb_trinkbrunnen import load_stage, osm_stage
+from fountain_table import osm_table_from_features
+from map_data import BWB_MAP_COLUMNS, OSM_MAP_COLUMNS, collection_from, map_data_path, map_outputs, write_map_data
+from osm_cache import BERLIN_PLACE, DRINKING_WATER_TAGS, cached_features_from_place
+from osm_extract import read_osm_extract
 
-def create_simple_comparison_map():
-    """Create a simple comparison map with BWB and OSM fountains in different colors"""
-    
-    print("Creating simple comparison map...")
-    
-    # Load BWB data
-    with open('../data/berlin_trinkbrunnen_wfs.json', 'r', encoding='utf-8') as f:
-        bwb_data = json.load(f)
-    
-    # Get OSM data
-    print("Fetching OSM drinking fountains...")
-    tags = {'amenity': 'drinking_water'}
-    osm_gdf = ox.features_from_place("Berlin, Germany", tags=tags)
-    
-    # Convert OSM to points
-    osm_points = []
-    for idx, row in osm_gdf.iterrows():
-        geom = row.geometry
-        if geom.geom_type == 'Point':
-            osm_points.append([geom.y, geom.x])
-        else:
-            centroid = geom.centroid
-            osm_points.append([centroid.y, centroid.x])
-    
-    # Extract BWB points
-    bwb_points = []
-    for feature in bwb_data['features']:
-        coords = feature['geometry']['coordinates']
-        bwb_points.append([coords[1], coords[0]])  # [lat, lon]
-    
-    # Calculate center
-    all_lats = [p[0] for p in osm_points + bwb_points]
-    all_lons = [p[1] for p in osm_points + bwb_points]
-    center = [sum(all_lats)/len(all_lats), sum(all_lons)/len(all_lons)]
+MAP_FILE = 'bwb_vs_osm_simple.html'
+
+def add_marker_layers(m, bwb_points, osm_points):
+    """One CircleMarker per fountain"""
     
-    # Create map
-    m = folium.Map(location=center, zoom_start=11, tiles='OpenStreetMap')
+    import folium
     
     # Add BWB fountains (red)
     for point in bwb_points:
@@ -68,6 +41,79 @@ def create_simple_comparison_map():
             fillColor='blue',
             fillOpacity=0.8
         ).add_to(m)
+
+def add_sidecar_layers(m, bwb_table, osm_table, map_file):
+    """Both point sets as layers loaded from the data file shared by all
+    maps; collections the other maps wrote from the same data are reused"""
+    
+    from map_layers import PointLayer
+    
+    data_file, data_url = map_data_path(map_file)
+    keys = write_map_data(data_file, {
+        'bwb': collection_from(bwb_table, BWB_MAP_COLUMNS),
+        'osm': collection_from(osm_table, OSM_MAP_COLUMNS),
+    })
+    PointLayer(data_url=data_url, collection=keys['bwb'], default_color='red', radius=5,
+               popup_template="BWB Official", tooltip_template="BWB Fountain").add_to(m)
+    PointLayer(data_url=data_url, collection=keys['osm'], default_color='blue', radius=5,
+               popup_template="OSM Community", tooltip_template="OSM Fountain").add_to(m)
+
+def add_canvas_layers(m, bwb_table, osm_table):
+    """Both point sets as packed coordinate arrays drawn on a canvas"""
+    
+    from map_layers import PackedPointLayer
+    
+    PackedPointLayer(bwb_table.lat, bwb_table.lon, default_color='red', radius=5,
+                     popup_template="BWB Official", tooltip_template="BWB Fountain").add_to(m)
+    PackedPointLayer(osm_table.lat, osm_table.lon, default_color='blue', radius=5,
+                     popup_template="OSM Community", tooltip_template="OSM Fountain").add_to(m)
+
+def create_simple_comparison_map(osm_file=None, refresh_osm=False, render='markers', map_file=MAP_FILE,
+                                 bwb_table=None, osm_table=None):
+    """Create a simple comparison map with BWB and OSM fountains in different colors.
+    
+    render 'sidecar' loads the points from the shared data file instead of
+    creating one marker per fountain; 'canvas' embeds them as packed arrays
+    drawn on a canvas. bwb_table and osm_table are already loaded point
+    sets (FountainTables or DataFrames) to use instead of loading them.
+    """
+    
+    import folium
+    from folium import plugins
+    
+    print("Creating simple comparison map...")
+    
+    # Load BWB data
+    if bwb_table is None:
+        bwb_table = load_bwb_table()
+    
+    # Get OSM data
+    if osm_table is None and osm_file:
+        print(f"Reading OSM drinking fountains from {osm_file}...")
+        osm_table = read_osm_extract(osm_file, include_open_ways=True)
+    elif osm_table is None:
+        print("Fetching OSM drinking fountains...")
+        osm_gdf = cached_features_from_place(BERLIN_PLACE, DRINKING_WATER_TAGS, refresh=refresh_osm)
+        
+        # Convert OSM to points (centroids for non-point geometries)
+        osm_table = osm_table_from_features(osm_gdf, geom_types=None)
+    
+    # Calculate center
+    all_lats = np.concatenate([osm_table.lat, bwb_table.lat])
+    all_lons = np.concatenate([osm_table.lon, bwb_table.lon])
+    center = [float(all_lats.mean()), float(all_lons.mean())]
+    
+    # Create map
+    m = folium.Map(location=center, zoom_start=11, tiles='OpenStreetMap', prefer_canvas=(render == 'canvas'))
+    
+    if render == 'sidecar':
+        add_sidecar_layers(m, bwb_table, osm_table, map_file)
+    elif render == 'canvas':
+        add_canvas_layers(m, bwb_table, osm_table)
+    else:
+        osm_points = np.column_stack([osm_table.lat, osm_table.lon]).tolist()
+        bwb_points = np.column_stack([bwb_table.lat, bwb_table.lon]).tolist()  # [lat, lon]
+        add_marker_layers(m, bwb_points, osm_points)
     
     # Add legend
     legend_html = f"""
@@ -76,8 +122,8 @@ def create_simple_comparison_map():
                 background-color: white; border:2px solid grey; z-index:9999; 
                 font-size:14px; padding: 15px">
     <h4 style="margin: 0 0 10px 0;">🚰 Trinkbrunnen</h4>
-    <p style="margin: 5px 0;"><span style="color: red;">●</span> BWB Official: {len(bwb_points)}</p>
-    <p style="margin: 5px 0;"><span style="color: blue;">●</span> OSM Community: {len(osm_points)}</p>
+    <p style="margin: 5px 0;"><span style="color: red;">●</span> BWB Official: {len(bwb_table)}</p>
+    <p style="margin: 5px 0;"><span style="color: blue;">●</span> OSM Community: {len(osm_table)}</p>
     <hr style="margin: 10px 0;">
     <p style="margin: 3px 0; font-size: 12px;">Red = Official Data</p>
     <p style="margin: 3px 0; font-size: 12px;">Blue = Community Data</p>
@@ -90,14 +136,42 @@ def create_simple_comparison_map():
     plugins.LocateControl().add_to(m)
     
     # Save
-    map_file = 'bwb_vs_osm_simple.html'
     m.save(map_file)
     
     print(f"Simple comparison map saved: {map_file}")
-    print(f"BWB (red): {len(bwb_points)} fountains")
-    print(f"OSM (blue): {len(osm_points)} fountains")
+    print(f"BWB (red): {len(bwb_table)} fountains")
+    print(f"OSM (blue): {len(osm_table)} fountains")
     
     return map_file
 
 if __name__ == "__main__":
-    create_simple_comparison_map()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Simple BWB vs OSM Trinkbrunnen map")
+    parser.add_argument('--osm-file', metavar='PATH',
+                        help="Read OSM data from a local .osm.pbf/.osm extract instead of Overpass")
+    parser.add_argument('--refresh-osm', action='store_true',
+                        help="Ignore the cached Overpass result and query again")
+    parser.add_argument('--render', choices=('markers', 'sidecar', 'canvas'), default='markers',
+                        help="markers: one marker per fountain; sidecar: load the points from the data file "
+                             "shared with the other maps; canvas: packed coordinate arrays drawn on a canvas, "
+                             "for 10k+ points (default: markers)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild the map even when the data and options are unchanged since the last run")
+    args = parser.parse_args()
+    
+    # Skipped when both sources and the options are unchanged, see build_cache.py.
+    # The stages are the ones pipeline.py runs, so either entry point finds
+    # the map the other one built.
+    try:
+        cache = BuildCache(force=args.force)
+        bwb = load_stage(cache)
+        osm = osm_stage(cache, args.osm_file, args.refresh_osm)
+        cache.stage(
+            f'map {MAP_FILE}',
+            lambda: create_simple_comparison_map(render=args.render, bwb_table=bwb.value, osm_table=osm.value),
+            inputs=[bwb, osm], params=[args.render], outputs=map_outputs(MAP_FILE, args.render))
+    except FileNotFoundError as e:
+        print(f"❌ Error: {e.filename} not found!")
+        if e.filename and os.path.abspath(e.filename) == os.path.abspath(BWB_WFS_FILE):
+            print("Please run fetch_trinkbrunnen_wfs.py first to download the BWB data.")
+    except ValueError as e:
+        print(f"❌ Error: {e}")
\ No newline at end of file
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from fountain_table import FountainTable
+
+CACHE_DIR = '../data/cache'
+
+# Bump when the on-disk layout changes so old caches are rebuilt
+CACHE_FORMAT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1 << 20
+
+def file_sha256(path):
+    """SHA-256 of a file, read in chunks"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path(source, name, cache_dir=CACHE_DIR):
+    """Directory holding the cached columns of source"""
+    return os.path.join(cache_dir, f"{os.path.basename(source)}.{name}")
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _write_manifest(directory, manifest):
+    tmp = os.path.join(directory, 'manifest.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(directory, 'manifest.json'))
+
+def source_hash(source, manifest=None):
+    """Content hash of source, reusing the manifest's hash while the file's
+    size and modification time are unchanged"""
+
+    stat = os.stat(source)
+    if (manifest and manifest.get('source_size') == stat.st_size
+            and manifest.get('source_mtime_ns') == stat.st_mtime_ns):
+        return manifest['source_sha256'], stat
+    return file_sha256(source), stat
+
+def _is_numeric_column(values):
+    return all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values.tolist())
+
+def save_table(table, directory, manifest):
+    """Write a FountainTable as .npy columns plus a dictionary file"""
+
+    np.save(os.path.join(directory, 'lat.npy'), table.lat)
+    np.save(os.path.join(directory, 'lon.npy'), table.lon)
+
+    columns = {}
+    for name, values in table.columns.items():
+        path = os.path.join(directory, f"col_{name}.npy")
+        if name in table.categories:
+            np.save(path, np.asarray(values, dtype=np.int32))
+            columns[name] = 'categorical'
+        elif values.dtype != object:
+            np.save(path, values)
+            columns[name] = 'numeric'
+        elif _is_numeric_column(values):
+            np.save(path, np.array([np.nan if v is None else v for v in values.tolist()], dtype=float))
+            columns[name] = 'numeric'
+        else:
+            # Fixed-width unicode keeps the column memory-mappable; None is
+            # tracked in a separate mask
+            missing = np.array([v is None for v in values.tolist()], dtype=bool)
+            np.save(path, np.array(['' if v is None else str(v) for v in values.tolist()], dtype=str))
+            if missing.any():
+                np.save(os.path.join(directory, f"null_{name}.npy"), missing)
+            columns[name] = 'string'
+
+    with open(os.path.join(directory, 'dictionary.json'), 'w', encoding='utf-8') as f:
+        json.dump(table.categories, f, ensure_ascii=False)
+
+    manifest = dict(manifest, columns=columns, rows=len(table), format_version=CACHE_FORMAT_VERSION)
+    _write_manifest(directory, manifest)
+
+def open_table(directory, manifest):
+    """Open cached columns as read-only memory maps"""
+
+    def load(name):
+        return np.load(os.path.join(directory, name), mmap_mode='r')
+
+    with open(os.path.join(directory, 'dictionary.json'), 'r', encoding='utf-8') as f:
+        categories = json.load(f)
+
+    columns = {}
+    for name, kind in manifest['columns'].items():
+        values = load(f"col_{name}.npy")
+        null_path = os.path.join(directory, f"null_{name}.npy")
+        if kind == 'string' and os.path.exists(null_path):
+            values = np.where(np.load(null_path), None, values.astype(object))
+        columns[name] = values
+
+    return FountainTable(load('lat.npy'), load('lon.npy'), columns, categories)
+
+def load_cached_table(source, build, name, cache_dir=CACHE_DIR):
+    """Return the FountainTable for source from the binary cache, calling
+    build(source) and caching its result when the source content changed"""
+
+    directory = cache_path(source, name, cache_dir)
+    manifest = _read_manifest(directory)
+    sha256, stat = source_hash(source, manifest)
+
+    valid = (manifest is not None
+             and manifest.get('format_version') == CACHE_FORMAT_VERSION
+             and manifest.get('source_sha256') == sha256)
+    if valid:
+        if manifest.get('source_mtime_ns') != stat.st_mtime_ns or manifest.get('source_size') != stat.st_size:
+            # Same content, touched file: remember the new stat for next time
+            manifest.update(source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+            _write_manifest(directory, manifest)
+        return open_table(directory, manifest)
+
+    table = build(source)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=cache_dir)
+    try:
+        save_table(table, staging, {
+            'source': os.path.abspath(source),
+            'source_sha256': sha256,
+            'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns,
+        })
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    return open_table(directory, _read_manifest(directory))
@@ -0,0 +1,405 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+
+from bwb_data import BWB_WFS_FILE
+from snapshot_cache import file_sha256
+
+HISTORY_DIR = '../data/history'
+
+# A full copy every this many versions bounds how many deltas a
+# materialization has to replay
+CHECKPOINT_INTERVAL = 10
+
+# Also checkpoint when a delta touches more than this share of the features
+CHECKPOINT_CHANGE_SHARE = 0.5
+
+FEATURE_KEY = 'oid'
+
+def parse_time(value):
+    """UTC datetime from an ISO date or timestamp (naive values are UTC)"""
+
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+def format_time(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def feature_key(feature):
+    return str((feature.get('properties') or {}).get(FEATURE_KEY))
+
+def diff_features(old, new):
+    """Delta between two {key: feature} mappings.
+
+    A changed feature records only what differs: 'before' and 'after' hold
+    the old and new values of the changed properties (a property missing
+    from one side was added or dropped) and 'geometry' an [old, new] pair.
+    Deltas can therefore be combined and read without the snapshots they
+    were made from.
+    """
+
+    delta = {'added': {}, 'removed': {}, 'changed': {}}
+    for key, feature in new.items():
+        previous = old.get(key)
+        if previous is None:
+            delta['added'][key] = feature
+            continue
+        old_props = previous.get('properties') or {}
+        new_props = feature.get('properties') or {}
+        names = [name for name in old_props.keys() | new_props.keys()
+                 if (name in old_props, old_props.get(name)) != (name in new_props, new_props.get(name))]
+        change = {}
+        if names:
+            change['before'] = {name: old_props[name] for name in names if name in old_props}
+            change['after'] = {name: new_props[name] for name in names if name in new_props}
+        if previous.get('geometry') != feature.get('geometry'):
+            change['geometry'] = [previous.get('geometry'), feature.get('geometry')]
+        if change:
+            delta['changed'][key] = change
+    for key, feature in old.items():
+        if key not in new:
+            delta['removed'][key] = feature
+    return delta
+
+def changed_names(change):
+    return sorted(change.get('before', {}).keys() | change.get('after', {}).keys())
+
+def apply_delta(features, delta):
+    """Apply a delta to a {key: feature} mapping in place"""
+
+    for key in delta['removed']:
+        features.pop(key, None)
+    for key, change in delta['changed'].items():
+        feature = features[key]
+        properties = dict(feature.get('properties') or {})
+        for name in changed_names(change):
+            if name in change.get('after', {}):
+                properties[name] = change['after'][name]
+            else:
+                properties.pop(name, None)
+        feature = dict(feature, properties=properties)
+        if 'geometry' in change:
+            feature['geometry'] = change['geometry'][1]
+        features[key] = feature
+    features.update(delta['added'])
+    return features
+
+_UNSET = object()
+
+def _state(present):
+    # properties: name -> (present, value); complete: names not listed are absent
+    return {'present': present, 'properties': {}, 'geometry': _UNSET, 'full': None, 'complete': False}
+
+def _fill(state, feature):
+    """Record a whole feature in state without overriding earlier values"""
+
+    if state['full'] is None:
+        state['full'] = feature
+    for name, value in (feature.get('properties') or {}).items():
+        state['properties'].setdefault(name, (True, value))
+    if state['geometry'] is _UNSET:
+        state['geometry'] = feature.get('geometry')
+    state['complete'] = True
+
+def _properties(state):
+    return {name: value for name, (present, value) in state['properties'].items() if present}
+
+def compose_deltas(deltas):
+    """Net delta of a sequence of consecutive deltas, computed from the
+    deltas alone (same result as diffing the two end snapshots)"""
+
+    first = {}
+    last = {}
+    for delta in deltas:
+        for key, feature in delta['removed'].items():
+            _fill(first.setdefault(key, _state(True)), feature)
+            last[key] = _state(False)
+        for key, change in delta['changed'].items():
+            start = first.setdefault(key, _state(True))
+            end = last.setdefault(key, _state(True))
+            before, after = change.get('before', {}), change.get('after', {})
+            for name in changed_names(change):
+                start['properties'].setdefault(name, (name in before, before.get(name)))
+                end['properties'][name] = (name in after, after.get(name))
+            if 'geometry' in change:
+                if start['geometry'] is _UNSET:
+                    start['geometry'] = change['geometry'][0]
+                end['geometry'] = change['geometry'][1]
+        for key, feature in delta['added'].items():
+            first.setdefault(key, _state(False))
+            last[key] = _state(True)
+            _fill(last[key], feature)
+
+    net = {'added': {}, 'removed': {}, 'changed': {}}
+    for key, start in first.items():
+        end = last[key]
+        if not start['present'] and end['present']:
+            net['added'][key] = dict(end['full'], properties=_properties(end), geometry=end['geometry'])
+        elif start['present'] and not end['present']:
+            net['removed'][key] = dict(start['full'], properties=_properties(start), geometry=start['geometry'])
+        elif start['present'] and end['present']:
+            names = set(end['properties'])
+            if end['complete']:
+                names |= set(start['properties'])
+            change = {'before': {}, 'after': {}}
+            for name in sorted(names):
+                old = start['properties'].get(name, (False, None))
+                new = end['properties'].get(name, (False, None))
+                if old != new:
+                    if old[0]:
+                        change['before'][name] = old[1]
+                    if new[0]:
+                        change['after'][name] = new[1]
+            if not change['before'] and not change['after']:
+                change = {}
+            if end['geometry'] is not _UNSET and end['geometry'] != start['geometry']:
+                change['geometry'] = [start['geometry'], end['geometry']]
+            if change:
+                net['changed'][key] = change
+    return net
+
+class SnapshotHistory:
+    """Append-only store of WFS snapshot versions keyed by fetch time.
+
+    Every version after the first is a gzip JSON delta against the previous
+    one, keyed by oid; every CHECKPOINT_INTERVAL versions (and after large
+    changes) a full checkpoint is written as well. log.jsonl lists the
+    versions with their time and the keys each one touched, so history and
+    change queries only open the deltas they need.
+    """
+
+    def __init__(self, directory=HISTORY_DIR, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.directory = directory
+        self.checkpoint_interval = checkpoint_interval
+
+    @property
+    def log_path(self):
+        return os.path.join(self.directory, 'log.jsonl')
+
+    def _path(self, version, kind):
+        return os.path.join(self.directory, f"v{version:06d}.{kind}.json.gz")
+
+    def _write(self, path, payload):
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    def _read(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def versions(self):
+        """Log records in version order"""
+
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def version_at(self, moment, versions=None):
+        """Latest version recorded at or before moment, or None"""
+
+        moment = format_time(parse_time(moment) if isinstance(moment, str) else moment)
+        found = None
+        for record in versions if versions is not None else self.versions():
+            if record['time'] > moment:
+                break
+            found = record
+        return found
+
+    def _materialize(self, version, versions):
+        """(header, {key: feature}) for a version: nearest checkpoint plus
+        the deltas after it"""
+
+        start = max(record['version'] for record in versions
+                    if record['checkpoint'] and record['version'] <= version)
+        checkpoint = self._read(self._path(start, 'checkpoint'))
+        features = {feature_key(feature): feature for feature in checkpoint['features']}
+        for record in versions:
+            if start < record['version'] <= version:
+                apply_delta(features, self._read(self._path(record['version'], 'delta')))
+        return checkpoint['header'], features
+
+    def materialize(self, moment=None):
+        """FeatureCollection as it was at moment (latest when None)"""
+
+        versions = self.versions()
+        record = versions[-1] if moment is None and versions else self.version_at(moment, versions)
+        if record is None:
+            return None
+        header, features = self._materialize(record['version'], versions)
+        return dict(header, features=list(features.values()))
+
+    def record(self, snapshot=BWB_WFS_FILE, moment=None):
+        """Append snapshot as a new version. Returns its log record, or None
+        when the snapshot has the same features as the latest version (also
+        when only its layout differs)."""
+
+        versions = self.versions()
+        sha256 = file_sha256(snapshot)
+        if versions and versions[-1]['sha256'] == sha256:
+            return None
+
+        with open(snapshot, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        features = {feature_key(feature): feature for feature in header.pop('features', [])}
+
+        delta = None
+        if versions:
+            _, previous = self._materialize(versions[-1]['version'], versions)
+            delta = diff_features(previous, features)
+            if not (delta['added'] or delta['removed'] or delta['changed']):
+                return None
+
+        moment = format_time(moment or datetime.now(timezone.utc))
+        if versions and moment <= versions[-1]['time']:
+            raise ValueError(f"History is append-only: {moment} is not after {versions[-1]['time']}")
+
+        os.makedirs(self.directory, exist_ok=True)
+        version = versions[-1]['version'] + 1 if versions else 1
+        record = {'version': version, 'time': moment, 'sha256': sha256, 'features': len(features),
+                  'checkpoint': False, 'added': [], 'removed': [], 'changed': []}
+
+        if delta is not None:
+            self._write(self._path(version, 'delta'), delta)
+            for kind in ('added', 'removed', 'changed'):
+                record[kind] = sorted(delta[kind])
+            touched = len(delta['added']) + len(delta['removed']) + len(delta['changed'])
+            since_checkpoint = version - max(r['version'] for r in versions if r['checkpoint'])
+            record['checkpoint'] = (since_checkpoint >= self.checkpoint_interval
+                                    or touched > CHECKPOINT_CHANGE_SHARE * max(len(features), 1))
+        else:
+            record['checkpoint'] = True
+
+        if record['checkpoint']:
+            self._write(self._path(version, 'checkpoint'), {'header': header, 'features': list(features.values())})
+
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        return record
+
+    def changes(self, since, until=None):
+        """Net delta between the versions current at since and until, built
+        from the deltas in between only"""
+
+        versions = self.versions()
+        first = self.version_at(since, versions)
+        last = versions[-1] if until is None else self.version_at(until, versions)
+        first_version = first['version'] if first else 0
+        last_version = last['version'] if last else 0
+        deltas = []
+        for record in versions:
+            if first_version < record['version'] <= last_version:
+                if record['version'] == 1:
+                    # The first version has no delta: everything was added
+                    _, features = self._materialize(1, versions)
+                    deltas.append({'added': features, 'removed': {}, 'changed': {}})
+                else:
+                    deltas.append(self._read(self._path(record['version'], 'delta')))
+        return compose_deltas(deltas)
+
+    def history(self, key):
+        """Every recorded event for one feature as (time, kind, detail)"""
+
+        key = str(key)
+        versions = self.versions()
+        events = []
+        for record in versions:
+            if record['version'] == 1:
+                first = self._read(self._path(1, 'checkpoint'))
+                feature = next((f for f in first['features'] if feature_key(f) == key), None)
+                if feature is not None:
+                    events.append((record['time'], 'added', feature))
+                continue
+            for kind in ('added', 'removed', 'changed'):
+                if key in record[kind]:
+                    delta = self._read(self._path(record['version'], 'delta'))
+                    events.append((record['time'], kind, delta[kind][key]))
+        return events
+
+def describe_change(change):
+    """'name: old -> new, ...' for a changed feature"""
+
+    before, after = change.get('before', {}), change.get('after', {})
+    fields = [f"{name}: {before.get(name)!r} -> {after.get(name)!r}" for name in changed_names(change)]
+    if 'geometry' in change:
+        fields.append('moved')
+    return ', '.join(fields)
+
+def summarize_delta(delta):
+    print(f"Added: {len(delta['added'])}, removed: {len(delta['removed'])}, changed: {len(delta['changed'])}")
+    for key, change in sorted(delta['changed'].items()):
+        print(f"  {FEATURE_KEY} {key}: {describe_change(change)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Versioned history of the BWB WFS snapshot")
+    parser.add_argument('--dir', default=HISTORY_DIR, help=f"History directory (default: {HISTORY_DIR})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help="Append the current snapshot as a new version")
+    record.add_argument('--snapshot', default=BWB_WFS_FILE)
+    record.add_argument('--time', type=parse_time, help="Fetch time (default: now)")
+
+    commands.add_parser('log', help="List the recorded versions")
+
+    materialize = commands.add_parser('materialize', help="Write the snapshot as it was at a time")
+    materialize.add_argument('--at', help="ISO date or time (default: latest)")
+    materialize.add_argument('--output', required=True)
+
+    changes = commands.add_parser('changes', help="Net changes between two times")
+    changes.add_argument('since')
+    changes.add_argument('until', nargs='?')
+
+    history = commands.add_parser('history', help="All changes to one fountain")
+    which = history.add_mutually_exclusive_group(required=True)
+    which.add_argument('--oid')
+    which.add_argument('--nummer', help="Trinkbrunnennummer, resolved through the latest version")
+
+    args = parser.parse_args()
+    store = SnapshotHistory(args.dir)
+
+    if args.command == 'record':
+        result = store.record(args.snapshot, args.time)
+        if result is None:
+            print("Snapshot equals the latest version; nothing recorded")
+        else:
+            kind = 'checkpoint + delta' if result['checkpoint'] and result['version'] > 1 else (
+                'checkpoint' if result['checkpoint'] else 'delta')
+            print(f"Recorded version {result['version']} at {result['time']} ({kind}): "
+                  f"{len(result['added'])} added, {len(result['removed'])} removed, {len(result['changed'])} changed")
+    elif args.command == 'log':
+        for record in store.versions():
+            print(f"v{record['version']:<5} {record['time']}  {record['features']:6d} features  "
+                  f"+{len(record['added'])} -{len(record['removed'])} ~{len(record['changed'])}"
+                  f"{'  [checkpoint]' if record['checkpoint'] else ''}")
+    elif args.command == 'materialize':
+        data = store.materialize(args.at)
+        if data is None:
+            print(f"No version recorded at or before {args.at}")
+            return
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"Wrote {len(data['features'])} features to {args.output}")
+    elif args.command == 'changes':
+        summarize_delta(store.changes(args.since, args.until))
+    elif args.command == 'history':
+        key = args.oid
+        if args.nummer:
+            latest = store.materialize() or {'features': []}
+            key = next((feature_key(f) for f in latest['features']
+                        if (f.get('properties') or {}).get('trinkbrunnennummer') == args.nummer), None)
+            if key is None:
+                print(f"No fountain with Trinkbrunnennummer {args.nummer} in the latest version")
+                return
+        for moment, kind, detail in store.history(key):
+            if kind == 'changed':
+                print(f"{moment}  changed  {describe_change(detail)}")
+            else:
+                print(f"{moment}  {kind}")
+
+if __name__ == "__main__":
+    main()
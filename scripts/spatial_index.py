@@ -0,0 +1,71 @@
+import numpy as np
+
+# Stride used to fold (cell_x, cell_y) into one sortable int64 key
+KEY_STRIDE = 2 ** 32
+
+NEIGHBOUR_OFFSETS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+class GridIndex:
+    """Uniform grid hash over 2D points for fixed-radius neighbour queries.
+
+    Points are bucketed into cells of size ``cell_x`` x ``cell_y``. As long as
+    the cell size is at least the search radius (in the same units as the
+    coordinates), every point within the radius of a query lies in the 3x3
+    block of cells around it, so only those buckets need to be scanned.
+    """
+
+    def __init__(self, x, y, cell_x, cell_y=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.cell_x = float(cell_x)
+        self.cell_y = float(cell_y if cell_y is not None else cell_x)
+
+        keys = self._keys(*self._cells(self.x, self.y))
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cells(self, x, y):
+        ix = np.floor(np.asarray(x, dtype=float) / self.cell_x).astype(np.int64)
+        iy = np.floor(np.asarray(y, dtype=float) / self.cell_y).astype(np.int64)
+        return ix, iy
+
+    @staticmethod
+    def _keys(ix, iy):
+        return ix * KEY_STRIDE + iy
+
+    def candidate_pairs(self, qx, qy):
+        """Return (query_idx, point_idx) arrays for every point in the 3x3 cell
+        block around each query point, sorted by query then point index"""
+
+        qix, qiy = self._cells(qx, qy)
+        query_ids = np.arange(len(qix))
+
+        query_parts = []
+        point_parts = []
+        for dx, dy in NEIGHBOUR_OFFSETS:
+            keys = self._keys(qix + dx, qiy + dy)
+            start = np.searchsorted(self.sorted_keys, keys, side='left')
+            end = np.searchsorted(self.sorted_keys, keys, side='right')
+            counts = end - start
+            total = int(counts.sum())
+            if total == 0:
+                continue
+
+            # Expand each [start, end) bucket range into individual positions
+            run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+            positions = np.repeat(start, counts) + (np.arange(total) - run_starts)
+
+            query_parts.append(np.repeat(query_ids, counts))
+            point_parts.append(self.order[positions])
+
+        if not query_parts:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty.copy()
+
+        query_idx = np.concatenate(query_parts)
+        point_idx = np.concatenate(point_parts)
+        order = np.lexsort((point_idx, query_idx))
+        return query_idx[order], point_idx[order]
@@ -0,0 +1,67 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# Cold-start import budget in seconds per entry point, and the paths they
+# stand for: fetching the snapshot, and a comparison run whose stages are
+# all cached so it only prints the report
+IMPORT_BUDGETS = {
+    'fetch_trinkbrunnen_wfs': 0.35,
+    'compare_osm_vs_bwb_trinkbrunnen': 0.35,
+}
+
+# Libraries that only the stages rendering maps or querying Overpass need
+HEAVY_MODULES = ('pandas', 'folium', 'branca', 'geopandas', 'osmnx', 'shapely', 'geopy')
+
+DEFAULT_REPEAT = 5
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(m for m in {heavy!r} if m in sys.modules)]))
+"""
+
+def measure_import(module, repeat=DEFAULT_REPEAT):
+    """Best import time of module over repeat fresh interpreters, and the
+    heavy libraries the import pulled in"""
+
+    best, loaded = None, []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the fetch and report entry points start within their import budget "
+                    "and do not load the map and GIS libraries",
+        epilog="Exit status: 0 within budget, 1 over budget or a heavy library was imported")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f"Fresh interpreters per entry point; the best time counts (default: {DEFAULT_REPEAT})")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Multiply every budget, e.g. 2 on a slow machine (default: 1)")
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'Entry point':35} {'Import':>8} {'Budget':>8}  Heavy modules")
+    for module, budget in IMPORT_BUDGETS.items():
+        budget *= args.scale
+        elapsed, loaded = measure_import(module, args.repeat)
+        ok = elapsed <= budget and not loaded
+        failures += not ok
+        print(f"{module:35} {elapsed:7.3f}s {budget:7.3f}s  {', '.join(loaded) or '-'}"
+              f"{'' if ok else '  FAILED'}")
+
+    if failures:
+        print(f"\n{failures} entry point(s) over budget; import heavy libraries inside the functions that use them")
+        return 1
+    print("\nAll entry points within budget")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from map_data import COORDINATE_DECIMALS, json_value
+
+DEFAULT_MIN_ZOOM = 8
+DEFAULT_MAX_ZOOM = 16
+
+# A tile with more points than this is aggregated into CELLS_PER_TILE x
+# CELLS_PER_TILE cells (one feature per cell and layer) unless it is at
+# the maximum zoom, so every tile stays small whatever the dataset size
+MAX_TILE_POINTS = 1000
+CELLS_PER_TILE = 32
+
+# Web Mercator stops at about +-85.05 degrees latitude
+MAX_LATITUDE = 85.0511287798
+
+LAYER_COLORS = {'matched': 'green', 'bwb_only': 'red', 'osm_only': 'blue'}
+
+def tile_coordinates(lat, lon, zoom):
+    """Fractional Web Mercator tile coordinates (x, y) at zoom"""
+
+    lat = np.clip(np.asarray(lat, dtype=float), -MAX_LATITUDE, MAX_LATITUDE)
+    lon = np.asarray(lon, dtype=float)
+    n = 2.0 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    lat_rad = np.radians(lat)
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * n
+    return np.clip(x, 0, n - 1e-9), np.clip(y, 0, n - 1e-9)
+
+def _point_feature(layer, lat, lon, properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point',
+                     'coordinates': [round(lon, COORDINATE_DECIMALS), round(lat, COORDINATE_DECIMALS)]},
+        'properties': dict(properties, layer=layer),
+    }
+
+def _cell_features(layer, lat, lon, cell):
+    """One feature per occupied cell: point count at the cell's centroid"""
+
+    cells, inverse, counts = np.unique(cell, return_inverse=True, return_counts=True)
+    mean_lat = np.bincount(inverse, weights=lat) / counts
+    mean_lon = np.bincount(inverse, weights=lon) / counts
+    return [_point_feature(layer, float(mean_lat[k]), float(mean_lon[k]), {'count': int(counts[k])})
+            for k in range(len(cells))]
+
+def _tile_features(layers, members, fx, fy, aggregate):
+    """GeoJSON features of one tile; members maps layer -> positions"""
+
+    features = []
+    for name, positions in members.items():
+        data = layers[name]
+        lat, lon = data['lat'][positions], data['lon'][positions]
+        if aggregate:
+            cx = np.floor((fx[name][positions] % 1.0) * CELLS_PER_TILE).astype(np.int64)
+            cy = np.floor((fy[name][positions] % 1.0) * CELLS_PER_TILE).astype(np.int64)
+            features.extend(_cell_features(name, lat, lon, cy * CELLS_PER_TILE + cx))
+        else:
+            columns = data.get('properties', {})
+            for k, position in enumerate(positions.tolist()):
+                properties = {column: json_value(values[position]) for column, values in columns.items()}
+                features.append(_point_feature(name, float(lat[k]), float(lon[k]), properties))
+    return features
+
+def _group_by_tile(tx, ty):
+    """Yield ((x, y), positions) for every occupied tile"""
+
+    if len(tx) == 0:
+        return
+    order = np.lexsort((ty, tx))
+    keys = np.stack([tx[order], ty[order]], axis=1)
+    boundaries = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    for run in np.split(order, boundaries):
+        yield (int(tx[run[0]]), int(ty[run[0]])), run
+
+def build_pyramid(layers, directory, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM,
+                  max_tile_points=MAX_TILE_POINTS, colors=None):
+    """Write a {z}/{x}/{y}.json GeoJSON tile pyramid of point layers.
+
+    layers maps a layer name to {'lat': array, 'lon': array, 'properties':
+    {column: array}}. Tiles hold individual points when they have at most
+    max_tile_points (counting all layers) or are at max_zoom, and per-cell
+    counts otherwise. Only occupied tiles are written. The pyramid is built
+    next to directory and replaces an earlier pyramid there when complete,
+    together with tiles.json (zoom range, bounds, layer colours) and the
+    viewer page.
+    Returns the number of tiles per zoom.
+    """
+
+    layers = {name: dict(data, lat=np.asarray(data['lat'], dtype=float), lon=np.asarray(data['lon'], dtype=float))
+              for name, data in layers.items()}
+    names = list(layers)
+    layer_of = np.concatenate([np.full(len(layers[n]['lat']), i, dtype=np.int64) for i, n in enumerate(names)])
+    position_of = np.concatenate([np.arange(len(layers[n]['lat'])) for n in names])
+    all_lat = np.concatenate([layers[n]['lat'] for n in names])
+    all_lon = np.concatenate([layers[n]['lon'] for n in names])
+
+    if os.path.isdir(directory) and os.listdir(directory) and not os.path.exists(os.path.join(directory, 'tiles.json')):
+        raise ValueError(f"{directory} exists and is not a tile pyramid; not replacing it")
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.tiles-', dir=parent)
+    tiles_per_zoom = {}
+    try:
+        for zoom in range(min_zoom, max_zoom + 1):
+            fx_all, fy_all = tile_coordinates(all_lat, all_lon, zoom)
+            fx = {n: fx_all[layer_of == i] for i, n in enumerate(names)}
+            fy = {n: fy_all[layer_of == i] for i, n in enumerate(names)}
+            tx, ty = fx_all.astype(np.int64), fy_all.astype(np.int64)
+
+            count = 0
+            for (x, y), rows in _group_by_tile(tx, ty):
+                members = {}
+                for i, name in enumerate(names):
+                    selected = position_of[rows[layer_of[rows] == i]]
+                    if len(selected):
+                        members[name] = np.sort(selected)
+                aggregate = len(rows) > max_tile_points and zoom < max_zoom
+                features = _tile_features(layers, members, fx, fy, aggregate)
+
+                tile_dir = os.path.join(staging, str(zoom), str(x))
+                os.makedirs(tile_dir, exist_ok=True)
+                with open(os.path.join(tile_dir, f"{y}.json"), 'w', encoding='utf-8') as f:
+                    json.dump({'type': 'FeatureCollection', 'aggregated': aggregate, 'features': features}, f,
+                              ensure_ascii=False, separators=(',', ':'))
+                count += 1
+            tiles_per_zoom[zoom] = count
+
+        bounds = None
+        if len(all_lat):
+            bounds = [[float(all_lat.min()), float(all_lon.min())], [float(all_lat.max()), float(all_lon.max())]]
+        metadata = {
+            'minzoom': min_zoom,
+            'maxzoom': max_zoom,
+            'bounds': bounds,
+            'layers': {name: {'color': (colors or LAYER_COLORS).get(name, 'gray'), 'count': len(layers[name]['lat'])}
+                       for name in names},
+        }
+        with open(os.path.join(staging, 'tiles.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2)
+        with open(os.path.join(staging, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(VIEWER_HTML)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return tiles_per_zoom
+
+# Viewer: fetches only the tiles that intersect the view (at the deepest
+# pyramid zoom when zoomed in further), keeps a bounded cache of loaded
+# tiles and draws on one canvas
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Trinkbrunnen tiles</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css">
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+<style>html, body, #map { height: 100%; margin: 0; }
+#legend { position: absolute; bottom: 30px; left: 10px; z-index: 1000; background: white;
+          padding: 8px 12px; border: 2px solid grey; font: 14px Arial, sans-serif; }</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="legend"></div>
+<script>
+var MAX_CACHED_TILES = 256;
+var map = L.map('map', {preferCanvas: true});
+L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    maxZoom: 19, attribution: '&copy; OpenStreetMap contributors'
+}).addTo(map);
+var renderer = L.canvas();
+var cache = {};
+var order = [];
+var shown = {};
+
+function escapeHtml(value) {
+    return String(value).replace(/[&<>"']/g, function(c) {
+        return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+    });
+}
+
+function describe(properties) {
+    return Object.keys(properties).filter(function(k) { return properties[k] !== null; }).map(function(k) {
+        return '<b>' + escapeHtml(k) + ':</b> ' + escapeHtml(properties[k]);
+    }).join('<br>');
+}
+
+fetch('tiles.json').then(function(r) { return r.json(); }).then(function(meta) {
+    var legend = '<b>Trinkbrunnen</b>';
+    Object.keys(meta.layers).forEach(function(name) {
+        var layer = meta.layers[name];
+        legend += '<br><span style="color:' + layer.color + '">&#9679;</span> ' + escapeHtml(name) + ': ' + layer.count;
+    });
+    document.getElementById('legend').innerHTML = legend;
+    // Zooming out past the pyramid would request every minzoom tile of the view
+    map.setMinZoom(meta.minzoom);
+    if (meta.bounds) { map.fitBounds(meta.bounds); } else { map.setView([52.52, 13.405], 11); }
+
+    function tileLayer(z, x, y, collection) {
+        var group = L.layerGroup();
+        collection.features.forEach(function(feature) {
+            var p = feature.properties;
+            var c = feature.geometry.coordinates;
+            var color = (meta.layers[p.layer] || {}).color || 'gray';
+            var marker;
+            if (p.count !== undefined) {
+                marker = L.circleMarker([c[1], c[0]], {renderer: renderer, radius: 4 + 3 * Math.log10(p.count + 1),
+                    color: 'white', weight: 1, fillColor: color, fillOpacity: 0.6});
+                marker.bindTooltip(p.layer + ': ' + p.count);
+            } else {
+                marker = L.circleMarker([c[1], c[0]], {renderer: renderer, radius: 6,
+                    color: 'white', weight: 1, fillColor: color, fillOpacity: 0.8});
+                marker.bindPopup(function() { return describe(p); });
+            }
+            group.addLayer(marker);
+        });
+        return group;
+    }
+
+    function load(key, z, x, y) {
+        if (cache[key]) { return cache[key]; }
+        cache[key] = fetch(z + '/' + x + '/' + y + '.json').then(function(r) {
+            return r.ok ? r.json() : {features: []};
+        }).then(function(collection) { return tileLayer(z, x, y, collection); });
+        order.push(key);
+        // Evict the oldest tiles that are not on the map; shown ones stay
+        var kept = [];
+        while (order.length + kept.length > MAX_CACHED_TILES && order.length > 1) {
+            var old = order.shift();
+            if (shown[old]) { kept.push(old); } else { delete cache[old]; }
+        }
+        order = kept.concat(order);
+        return cache[key];
+    }
+
+    function update() {
+        var z = Math.max(meta.minzoom, Math.min(meta.maxzoom, map.getZoom()));
+        var bounds = map.getBounds();
+        var n = Math.pow(2, z);
+        var tile = function(lat, lon) {
+            lat = Math.max(-85.0511, Math.min(85.0511, lat));
+            var r = lat * Math.PI / 180;
+            return [Math.floor((lon + 180) / 360 * n),
+                    Math.floor((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2 * n)];
+        };
+        var north = bounds.getNorth(), south = bounds.getSouth(), west = bounds.getWest(), east = bounds.getEast();
+        if (meta.bounds) {
+            // There are no tiles outside the data
+            south = Math.max(south, meta.bounds[0][0]);
+            west = Math.max(west, meta.bounds[0][1]);
+            north = Math.min(north, meta.bounds[1][0]);
+            east = Math.min(east, meta.bounds[1][1]);
+        }
+        var wanted = {};
+        if (south <= north && west <= east) {
+            var nw = tile(north, west);
+            var se = tile(south, east);
+            for (var x = Math.max(0, nw[0]); x <= Math.min(n - 1, se[0]); x++) {
+                for (var y = Math.max(0, nw[1]); y <= Math.min(n - 1, se[1]); y++) {
+                    wanted[z + '/' + x + '/' + y] = [z, x, y];
+                }
+            }
+        }
+        Object.keys(shown).forEach(function(key) {
+            if (!wanted[key]) { map.removeLayer(shown[key]); delete shown[key]; }
+        });
+        Object.keys(wanted).forEach(function(key) {
+            if (shown[key]) { return; }
+            var t = wanted[key];
+            load(key, t[0], t[1], t[2]).then(function(group) {
+                var zoom = Math.max(meta.minzoom, Math.min(meta.maxzoom, map.getZoom()));
+                if (t[0] === zoom && map.getBounds().intersects(tileBounds(t[0], t[1], t[2])) && !shown[key]) {
+                    shown[key] = group.addTo(map);
+                }
+            });
+        });
+    }
+
+    function tileBounds(z, x, y) {
+        var n = Math.pow(2, z);
+        var lat = function(t) { return Math.atan(Math.sinh(Math.PI * (1 - 2 * t / n))) * 180 / Math.PI; };
+        return L.latLngBounds([lat(y + 1), x / n * 360 - 180], [lat(y), (x + 1) / n * 360 - 180]);
+    }
+
+    map.on('moveend', update);
+    update();
+});
+</script>
+</body>
+</html>
+"""
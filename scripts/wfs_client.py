@@ -0,0 +1,463 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from osm_cache import ResultCache
+from snapshot_cache import CACHE_DIR, file_sha256
+from wfs_decoders import FEATURE_DECODERS, decode_features, looks_like
+
+WFS_URL = "http://dservices-eu1.arcgis.com/A6FVvQQnrSyq47GD/arcgis/services/Trinkbrunnen_BWB/WFSServer"
+TYPE_NAME = 'Trinkbrunnen_BWB:Trinkbrunnen_BWB'
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+PAGE_TIMEOUT_S = 60
+
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF_S = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+PROBE_TIMEOUT_S = 10
+PROBE_CHUNK_SIZE = 1 << 16
+FULL_LAYER_FEATURES = 10000
+
+# Which output format an endpoint speaks rarely changes; remember the
+# winner of a negotiation for a week
+FORMAT_CACHE_DIR = os.path.join(CACHE_DIR, 'wfs')
+FORMAT_TTL_S = 7 * 24 * 3600
+
+# Typed properties in the service's GeoJSON output; text formats (GML, CSV)
+# are converted to match
+BWB_PROPERTY_TYPES = {'oid': int, 'rechtswert': float, 'hochwert': float}
+
+GEOJSON_CRS = {'type': 'name', 'properties': {'name': 'EPSG:4326'}}
+
+# Returned instead of data when the server says the snapshot on disk is
+# still current
+NOT_MODIFIED = 'not-modified'
+
+# Members of a GeoJSON response that describe that one request rather than
+# the layer; a snapshot written from several pages (or fetched again
+# unchanged) must not carry them
+PER_REQUEST_MEMBERS = ('totalFeatures', 'numberMatched', 'numberReturned', 'timeStamp', 'links')
+
+NUMBER_MATCHED = re.compile(r'numberMatched="(\d+)"')
+NUMBER_OF_FEATURES = re.compile(r'numberOfFeatures="(\d+)"')
+
+def getfeature_params(output_format='GEOJSON', **extra):
+    """Base WFS 2.0 GetFeature parameters for the Trinkbrunnen layer"""
+
+    params = {
+        'service': 'WFS',
+        'version': '2.0.0',
+        'request': 'GetFeature',
+        'typeName': TYPE_NAME,
+        'outputFormat': output_format,
+    }
+    params.update({key: str(value) for key, value in extra.items()})
+    return params
+
+_session = None
+
+def make_session(pool_size=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff_s=RETRY_BACKOFF_S):
+    """requests Session with a keep-alive connection pool sized for the page
+    workers, retries with exponential backoff on transient failures, and
+    compressed transfer"""
+
+    retry = Retry(total=retries, backoff_factor=backoff_s, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=('GET', 'HEAD'), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+def get_session():
+    """Session shared by every request of this process"""
+
+    global _session
+    if _session is None:
+        _session = make_session()
+    return _session
+
+def meta_path(snapshot):
+    """Sidecar file holding the validators of a downloaded snapshot"""
+    return snapshot + '.meta.json'
+
+def read_snapshot_meta(snapshot):
+    """Validators (etag, last_modified), the request they belong to and the
+    content hash (sha256) from the last download of snapshot, or an empty
+    dict when there are none or the snapshot is gone"""
+
+    if not os.path.exists(snapshot):
+        return {}
+    try:
+        with open(meta_path(snapshot), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_snapshot_meta(snapshot, meta, changed):
+    """Record validators and whether the last check changed the snapshot.
+
+    changed_at only moves when the content did, so later steps can compare it
+    against their own outputs; checked_at moves on every run.
+    """
+
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    meta = dict(meta, checked_at=now, changed=changed)
+    if changed or 'changed_at' not in meta:
+        meta['changed_at'] = now
+    path = meta_path(snapshot)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return meta
+
+def request_identity(output_format='GEOJSON', filter_params=None):
+    """What decides the content of a download: its output format and the
+    server-side filter. Validators are only valid for the same request."""
+    return {'outputFormat': output_format, 'filter': dict(filter_params or {})}
+
+def conditional_headers(meta, request):
+    """If-None-Match / If-Modified-Since headers for the stored validators,
+    or none when they were recorded for a different request"""
+
+    headers = {}
+    if meta.get('request') != request:
+        return headers
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+def response_validators(response):
+    """ETag and Last-Modified the server sent with response"""
+
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+def conditional_get(wfs_url, params, meta, request, timeout=30, session=None):
+    """GET params from wfs_url, revalidating against the stored validators
+    when meta was recorded for the same request (see request_identity).
+
+    Returns (response, validators). The response is None when the server
+    answered 304 and the snapshot is still current. Servers that ignore
+    validators send the body again; write_collection then leaves an
+    identical snapshot untouched.
+    """
+
+    session = session or get_session()
+    response = session.get(wfs_url, params=params, headers=conditional_headers(meta, request), timeout=timeout)
+    if response.status_code == 304:
+        return None, dict(meta)
+    return response, response_validators(response)
+
+def fetch_hit_count(wfs_url=WFS_URL, timeout=30, session=None, filter_params=None):
+    """Number of features in the layer (or matching filter_params) from a
+    resultType=hits request, or None when the service does not report it"""
+
+    session = session or get_session()
+    params = getfeature_params(resultType='hits', **(filter_params or {}))
+    params.pop('outputFormat')
+    response = session.get(wfs_url, params=params, timeout=timeout)
+    response.raise_for_status()
+
+    match = NUMBER_MATCHED.search(response.text) or NUMBER_OF_FEATURES.search(response.text)
+    return int(match.group(1)) if match else None
+
+def fetch_page(wfs_url, start_index, count, output_format='GEOJSON', timeout=PAGE_TIMEOUT_S, session=None,
+               filter_params=None):
+    """One GeoJSON page of the layer starting at start_index"""
+
+    session = session or get_session()
+    params = getfeature_params(output_format, startIndex=start_index, count=count, **(filter_params or {}))
+    response = session.get(wfs_url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+class SnapshotWriter:
+    """Writes a FeatureCollection incrementally: header once, then features
+    as their pages arrive, into a temporary file that replaces the target
+    only when complete and different from it. changed tells which happened."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.part'
+        self.file = None
+        self.count = 0
+        self.changed = None
+        self.sha256 = None
+
+    def __enter__(self):
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        return self
+
+    def write_header(self, collection):
+        header = {'type': 'FeatureCollection'}
+        header.update((key, value) for key, value in collection.items()
+                      if key != 'features' and key not in PER_REQUEST_MEMBERS)
+        # Leave the object open so the features array can follow
+        self.file.write(json.dumps(header, ensure_ascii=False)[:-1])
+        self.file.write(', "features": [\n')
+
+    def write_features(self, features):
+        for feature in features:
+            if self.count:
+                self.file.write(',\n')
+            self.file.write(json.dumps(feature, ensure_ascii=False))
+            self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.file.write('\n]}\n')
+            self.file.close()
+            self.sha256 = file_sha256(self.tmp_path)
+            self.changed = not (os.path.exists(self.path) and file_sha256(self.path) == self.sha256)
+            if self.changed:
+                os.replace(self.tmp_path, self.path)
+            else:
+                # Leave the old file and its mtime alone so caches stay warm
+                os.remove(self.tmp_path)
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
+        return False
+
+def download_paged(output_path, wfs_url=WFS_URL, page_size=DEFAULT_PAGE_SIZE, workers=DEFAULT_WORKERS, session=None,
+                   filter_params=None):
+    """Download the whole layer in startIndex/count pages on a bounded
+    thread pool and stream every page to output_path in order.
+
+    The layer is sized with a resultType=hits request first and every page
+    of that range is fetched; a ValueError is raised (and the existing file
+    kept) when the pages hold a different number of features, e.g. because
+    the layer changed in between. When the service does not report a count,
+    pages are requested in rounds until a short page marks the end. Pages
+    share one pooled session. Returns the
+    number of features written and whether output_path changed; an identical
+    download leaves the existing file untouched. filter_params (see
+    fountain_filter.wfs_filter_params) restrict every request to the
+    matching features.
+    """
+
+    session = session or make_session(pool_size=workers)
+    total = fetch_hit_count(wfs_url, session=session, filter_params=filter_params)
+    if total is not None:
+        print(f"Layer reports {total} features: {-(-total // page_size)} pages of {page_size}")
+        starts = iter(range(0, total, page_size))
+    else:
+        print("Layer did not report its size; paging until a short page")
+        starts = iter(range(0, 2 ** 62, page_size))
+
+    with SnapshotWriter(output_path) as writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        completed = {}
+        next_to_write = 0
+        finished = False
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                pending[executor.submit(fetch_page, wfs_url, start, page_size, session=session,
+                                        filter_params=filter_params)] = start
+
+        for _ in range(workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                completed[pending.pop(future)] = future.result()
+
+            # Write every page that is next in order; pages that arrive early
+            # wait in memory and count against the worker budget
+            while next_to_write in completed and not finished:
+                page = completed.pop(next_to_write)
+                features = page.get('features', [])
+                if next_to_write == 0:
+                    writer.write_header(page)
+                writer.write_features(features)
+                if features:
+                    print(f"  wrote features {next_to_write}-{next_to_write + len(features) - 1}")
+                if total is None and len(features) < page_size:
+                    finished = True
+                next_to_write += page_size
+
+            if finished:
+                for future in pending:
+                    future.cancel()
+                break
+            while len(pending) + len(completed) < workers:
+                before = len(pending)
+                submit_next()
+                if len(pending) == before:
+                    break
+
+        if next_to_write == 0:
+            writer.write_header({'type': 'FeatureCollection'})
+        if total is not None and writer.count != total:
+            raise ValueError(f"Layer reported {total} features but its pages held {writer.count}")
+
+    _record_download(output_path, writer, request_identity('GEOJSON', filter_params))
+    return writer.count, writer.changed
+
+def _record_download(output_path, writer, request, validators=None):
+    """Store the content hash of the written snapshot and the request it was
+    downloaded with, plus the validators of the response it came from.
+    Stored validators are dropped when the content or the request changed,
+    and kept otherwise unless the server sent new ones."""
+
+    meta = read_snapshot_meta(output_path)
+    if writer.changed or meta.get('request') != request:
+        meta.pop('etag', None)
+        meta.pop('last_modified', None)
+    meta.update((key, value) for key, value in (validators or {}).items() if value)
+    write_snapshot_meta(output_path, dict(meta, sha256=writer.sha256, request=request), changed=writer.changed)
+
+def write_collection(output_path, collection, request, validators=None):
+    """Write a FeatureCollection downloaded with request to output_path in
+    the same layout as the streamed downloads, so every path hashes alike;
+    an identical snapshot is left untouched. Returns (feature count,
+    changed)."""
+
+    with SnapshotWriter(output_path) as writer:
+        writer.write_header(collection)
+        writer.write_features(collection.get('features', []))
+    _record_download(output_path, writer, request, validators)
+    return writer.count, writer.changed
+
+def _format_cache():
+    return ResultCache(FORMAT_CACHE_DIR, ttl_s=FORMAT_TTL_S)
+
+def _format_key(wfs_url):
+    return ResultCache.key('output_format', wfs_url, TYPE_NAME)
+
+def cached_output_format(wfs_url=WFS_URL):
+    """Output format that last worked for wfs_url, or None when unknown or
+    expired"""
+    return _format_cache().get(_format_key(wfs_url))
+
+def remember_output_format(wfs_url, output_format):
+    _format_cache().put(_format_key(wfs_url), output_format, f"output format of {wfs_url}")
+
+def forget_output_format(wfs_url):
+    _format_cache().remove(_format_key(wfs_url))
+
+def _open_stream(wfs_url, output_format, session, timeout, stop=None, filter_params=None):
+    """Start a full-layer GetFeature in output_format and read its first
+    chunk. Returns the body as a chunk iterator, or None when the service
+    did not answer in that format."""
+
+    if stop is not None and stop.is_set():
+        return None
+    params = getfeature_params(output_format, maxFeatures=FULL_LAYER_FEATURES, **(filter_params or {}))
+    response = session.get(wfs_url, params=params, stream=True, timeout=timeout)
+    if response.status_code != 200:
+        print(f"  {output_format}: HTTP {response.status_code}")
+        response.close()
+        return None
+
+    chunks = response.iter_content(chunk_size=PROBE_CHUNK_SIZE)
+    head = next(chunks, b'')
+    if not looks_like(output_format, head):
+        print(f"  {output_format}: unexpected response {head[:80]!r}")
+        response.close()
+        return None
+    print(f"  {output_format}: ok ({response.headers.get('content-type', 'unknown')})")
+    return response, chain([head], chunks)
+
+def negotiate_format(wfs_url=WFS_URL, formats=None, timeout=PROBE_TIMEOUT_S, session=None, filter_params=None):
+    """Request the whole layer in every decodable format at once and keep
+    the first response that is really in the requested format.
+
+    Probes run on daemon threads so slow losers never hold up the caller;
+    once a winner is chosen, probes that still succeed close their
+    connection straight away. Returns (format, response, chunks) with the
+    winner's body still unread past its first chunk, or (None, None, None)
+    when no format works.
+    """
+
+    formats = list(formats or FEATURE_DECODERS)
+    session = session or get_session()
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = queue.Queue()
+
+    def probe(output_format):
+        try:
+            opened = _open_stream(wfs_url, output_format, session, timeout, stop, filter_params)
+        except requests.exceptions.RequestException as e:
+            print(f"  {output_format}: {str(e)}")
+            opened = None
+        with lock:
+            if opened is not None and stop.is_set():
+                opened[0].close()
+                opened = None
+            results.put((output_format, opened))
+
+    for output_format in formats:
+        threading.Thread(target=probe, args=(output_format,), daemon=True).start()
+
+    for _ in formats:
+        output_format, opened = results.get()
+        if opened is None:
+            continue
+        with lock:
+            stop.set()
+        # Close runners-up that finished before the stop flag was set
+        while not results.empty():
+            _, other = results.get_nowait()
+            if other is not None:
+                other[0].close()
+        return (output_format,) + opened
+    return None, None, None
+
+def _write_decoded(output_path, output_format, response, chunks, filter_params=None):
+    """Stream a decoded response body into output_path as GeoJSON"""
+
+    try:
+        with SnapshotWriter(output_path) as writer:
+            writer.write_header({'type': 'FeatureCollection', 'crs': GEOJSON_CRS})
+            writer.write_features(decode_features(output_format, chunks, BWB_PROPERTY_TYPES))
+    finally:
+        response.close()
+    _record_download(output_path, writer, request_identity(output_format, filter_params),
+                     response_validators(response))
+    return writer.count, writer.changed
+
+def download_in_format(output_path, wfs_url=WFS_URL, output_format='GEOJSON', timeout=PAGE_TIMEOUT_S, session=None,
+                       filter_params=None):
+    """Download the layer in a known output format, decoding the body while
+    it arrives. Returns (feature count, changed), or None when the service
+    no longer answers in that format."""
+
+    opened = _open_stream(wfs_url, output_format, session or get_session(), timeout, filter_params=filter_params)
+    if opened is None:
+        return None
+    return _write_decoded(output_path, output_format, *opened, filter_params=filter_params)
+
+def download_negotiated(output_path, wfs_url=WFS_URL, formats=None, timeout=PROBE_TIMEOUT_S, session=None,
+                        filter_params=None):
+    """negotiate_format, then stream the winning response into output_path
+    without downloading the layer again. Returns (format, count, changed);
+    format is None when nothing worked."""
+
+    output_format, response, chunks = negotiate_format(wfs_url, formats, timeout, session, filter_params)
+    if output_format is None:
+        return None, 0, False
+    count, changed = _write_decoded(output_path, output_format, response, chunks, filter_params)
+    return output_format, count, changed
@@ -0,0 +1,237 @@
+import csv
+import io
+import re
+import xml.etree.ElementTree as ET
+
+from geodesy import utm_to_lonlat
+from geojson_stream import iter_stream_features
+from kml_ingest import iter_kml_stream_features
+
+# Projected coordinates of this layer are ETRS89 / UTM zone 33N
+NATIVE_UTM_ZONE = 33
+
+EPSG_CODE = re.compile(r'EPSG(?::|::|/0/|\.xml#)(\d+)', re.IGNORECASE)
+
+X_COLUMNS = ('x', 'lon', 'longitude', 'lng')
+Y_COLUMNS = ('y', 'lat', 'latitude')
+
+class ChunkStream(io.RawIOBase):
+    """Binary file object over an iterator of byte chunks, so an HTTP body
+    that was already partly read can be handed to a streaming parser"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b''
+                return 0
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+def binary_stream(chunks):
+    return io.BufferedReader(ChunkStream(chunks))
+
+def text_stream(chunks, newline=None):
+    return io.TextIOWrapper(binary_stream(chunks), encoding='utf-8', newline=newline)
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _typed(properties, property_types):
+    """Apply property_types (name -> callable) to text values; empty text
+    becomes None"""
+
+    for name, value in properties.items():
+        if value is None or value == '':
+            properties[name] = None
+        elif name in property_types:
+            try:
+                properties[name] = property_types[name](value)
+            except ValueError:
+                pass
+    return properties
+
+def _point_lonlat(x, y, epsg=None):
+    """lon/lat for a coordinate pair in x/y axis order: geographic as is,
+    UTM (258xx, or values out of degree range) converted"""
+
+    if epsg is not None and 25801 <= epsg <= 25860:
+        lon, lat = utm_to_lonlat(x, y, epsg - 25800)
+        return float(lon), float(lat)
+    if epsg is None and (abs(x) > 180 or abs(y) > 90):
+        lon, lat = utm_to_lonlat(x, y, NATIVE_UTM_ZONE)
+        return float(lon), float(lat)
+    return x, y
+
+def _feature(lon_lat, properties):
+    feature = {'type': 'Feature', 'geometry': None, 'properties': properties}
+    if lon_lat is not None:
+        feature['geometry'] = {'type': 'Point', 'coordinates': list(lon_lat)}
+    return feature
+
+def iter_geojson_features(chunks, property_types=None):
+    """GeoJSON FeatureCollection body"""
+    return iter_stream_features(text_stream(chunks))
+
+def iter_esri_features(chunks, property_types=None):
+    """Esri JSON FeatureSet body (attributes plus x/y geometry), converted to
+    GeoJSON features; GeoJSON features pass through unchanged"""
+
+    for feature in iter_stream_features(text_stream(chunks)):
+        if 'attributes' not in feature:
+            yield feature
+            continue
+        geometry = feature.get('geometry') or {}
+        wkid = (geometry.get('spatialReference') or {}).get('wkid')
+        lon_lat = None
+        if geometry.get('x') is not None and geometry.get('y') is not None:
+            lon_lat = _point_lonlat(float(geometry['x']), float(geometry['y']), wkid)
+        yield _feature(lon_lat, dict(feature['attributes']))
+
+def _srs_axes(srs_name):
+    """(epsg, lat_first) for a GML srsName. The URN and http URI forms of
+    EPSG:4326 use latitude/longitude axis order, the short form does not."""
+
+    if not srs_name:
+        return None, False
+    match = EPSG_CODE.search(srs_name)
+    epsg = int(match.group(1)) if match else None
+    lat_first = epsg == 4326 and ('urn:' in srs_name.lower() or '/def/crs/' in srs_name.lower())
+    return epsg, lat_first
+
+def _gml_point(geometry_property, default_srs):
+    srs_name = default_srs
+    for elem in geometry_property.iter():
+        if elem.get('srsName'):
+            srs_name = elem.get('srsName')
+        if _local(elem.tag) in ('pos', 'coordinates') and elem.text:
+            values = [float(v) for v in re.split(r'[\s,]+', elem.text.strip())[:2]]
+            epsg, lat_first = _srs_axes(srs_name)
+            if lat_first:
+                return values[1], values[0]
+            return _point_lonlat(values[0], values[1], epsg)
+    return None
+
+def iter_gml_features(chunks, property_types=None):
+    """WFS GML 3.2 FeatureCollection body parsed incrementally: every
+    wfs:member (or gml:featureMember) becomes a GeoJSON point feature and is
+    discarded from the tree once yielded"""
+
+    property_types = property_types or {}
+    context = ET.iterparse(binary_stream(chunks), events=('start', 'end'))
+    _, root = next(context)
+    default_srs = root.get('srsName')
+    depth = 1
+    member_depth = None
+
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            if member_depth is None and _local(elem.tag) in ('member', 'featureMember', 'featureMembers'):
+                member_depth = depth
+            continue
+
+        depth -= 1
+        if member_depth is None:
+            continue
+        if depth == member_depth:
+            # elem is a feature directly inside a member element
+            properties = {}
+            lon_lat = None
+            for child in elem:
+                if len(child):
+                    lon_lat = lon_lat or _gml_point(child, default_srs)
+                else:
+                    properties[_local(child.tag)] = child.text
+            feature_id = elem.get('{http://www.opengis.net/gml/3.2}id') or elem.get('{http://www.opengis.net/gml}id')
+            if feature_id is not None:
+                # The service's GeoJSON output carries the same id as GmlID
+                properties.setdefault('GmlID', feature_id)
+            yield _feature(lon_lat, _typed(properties, property_types))
+            elem.clear()
+        elif depth == member_depth - 1:
+            root.clear()
+
+def _find_column(fieldnames, candidates):
+    lowered = {name.lower(): name for name in fieldnames}
+    for candidate in candidates:
+        if candidate in lowered:
+            return lowered[candidate]
+    return None
+
+def iter_csv_features(chunks, property_types=None):
+    """WFS CSV body read row by row. The geometry comes from a WKT POINT
+    column or from x/y (lon/lat) columns; projected values are taken to be
+    the layer's native UTM 33N."""
+
+    property_types = property_types or {}
+    reader = csv.DictReader(text_stream(chunks, newline=''))
+    fieldnames = reader.fieldnames or []
+    x_column = _find_column(fieldnames, X_COLUMNS)
+    y_column = _find_column(fieldnames, Y_COLUMNS)
+    wkt_column = None
+
+    for row in reader:
+        if wkt_column is None and x_column is None:
+            wkt_column = next((name for name, value in row.items()
+                               if isinstance(value, str) and value.strip().upper().startswith('POINT')), None)
+
+        lon_lat = None
+        if wkt_column is not None:
+            numbers = re.findall(r'-?\d+(?:\.\d+)?(?:[eE]-?\d+)?', row.pop(wkt_column) or '')
+            if len(numbers) >= 2:
+                lon_lat = _point_lonlat(float(numbers[0]), float(numbers[1]))
+        elif x_column is not None and y_column is not None:
+            x, y = row.pop(x_column), row.pop(y_column)
+            if x and y:
+                lon_lat = _point_lonlat(float(x), float(y))
+
+        yield _feature(lon_lat, _typed(dict(row), property_types))
+
+def iter_kml_features(chunks, property_types=None):
+    """KML body; the layer's attributes come from each placemark's
+    ExtendedData/SchemaData"""
+
+    for feature in iter_kml_stream_features(binary_stream(chunks), placemark_fields=False):
+        _typed(feature['properties'], property_types or {})
+        yield feature
+
+# Output formats we can read straight off the wire, in order of preference
+FEATURE_DECODERS = {
+    'GEOJSON': iter_geojson_features,
+    'ESRIGEOJSON': iter_esri_features,
+    'GML32': iter_gml_features,
+    'CSV': iter_csv_features,
+    'KML': iter_kml_features,
+}
+
+def looks_like(output_format, head):
+    """Cheap check on the first bytes of a 200 response that the service
+    really answered in output_format rather than with an error document"""
+
+    head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if not head:
+        return False
+    if output_format in ('GEOJSON', 'ESRIGEOJSON'):
+        return head.startswith(b'{') and b'"error"' not in head[:512]
+    if output_format == 'GML32':
+        return head.startswith(b'<') and b'ExceptionReport' not in head and b'FeatureCollection' in head
+    if output_format == 'KML':
+        return head.startswith(b'<') and b'<kml' in head
+    if output_format == 'CSV':
+        first_line = head.split(b'\n', 1)[0]
+        return not head.startswith((b'<', b'{')) and b',' in first_line
+    return False
+
+def decode_features(output_format, chunks, property_types=None):
+    """Iterate GeoJSON-style features from a response body in output_format"""
+    return FEATURE_DECODERS[output_format](chunks, property_types)
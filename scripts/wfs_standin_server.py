@@ -0,0 +1,206 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import time
+from xml.sax.saxutils import escape
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from fountain_filter import filter_features, parse_wfs_filter
+
+STANDIN_FORMATS = ('GEOJSON', 'GML32', 'CSV')
+
+def render_gml(features):
+    """GML 3.2 FeatureCollection with lat/lon ordered urn:ogc:def:crs:EPSG::4326 points"""
+
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+             'xmlns:gml="http://www.opengis.net/gml/3.2" xmlns:Trinkbrunnen_BWB="urn:standin:Trinkbrunnen_BWB" '
+             f'numberMatched="{len(features)}" numberReturned="{len(features)}">\n']
+    for feature in features:
+        properties = dict(feature.get('properties') or {})
+        gml_id = properties.pop('GmlID', None)
+        parts.append('<wfs:member><Trinkbrunnen_BWB:Trinkbrunnen_BWB'
+                     + (f' gml:id="{escape(str(gml_id))}"' if gml_id else '') + '>')
+        for name, value in properties.items():
+            text = '' if value is None else escape(str(value))
+            parts.append(f'<Trinkbrunnen_BWB:{name}>{text}</Trinkbrunnen_BWB:{name}>')
+        geometry = feature.get('geometry')
+        if geometry:
+            lon, lat = geometry['coordinates'][:2]
+            parts.append('<Trinkbrunnen_BWB:Shape><gml:Point srsName="urn:ogc:def:crs:EPSG::4326">'
+                         f'<gml:pos>{lat!r} {lon!r}</gml:pos></gml:Point></Trinkbrunnen_BWB:Shape>')
+        parts.append('</Trinkbrunnen_BWB:Trinkbrunnen_BWB></wfs:member>\n')
+    parts.append('</wfs:FeatureCollection>\n')
+    return ''.join(parts)
+
+def render_csv(features):
+    """CSV with the properties as columns and the point as a WKT column"""
+
+    names = []
+    for feature in features:
+        for name in feature.get('properties') or {}:
+            if name not in names:
+                names.append(name)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(names + ['Shape'])
+    for feature in features:
+        properties = feature.get('properties') or {}
+        geometry = feature.get('geometry')
+        wkt = f"POINT ({geometry['coordinates'][0]!r} {geometry['coordinates'][1]!r})" if geometry else ''
+        writer.writerow(['' if properties.get(name) is None else properties.get(name) for name in names] + [wkt])
+    return out.getvalue()
+
+def make_handler(features, crs, version=None, last_modified=None, formats=STANDIN_FORMATS, delays=None):
+    """Request handler answering WFS 2.0 GetFeature requests from a local
+    snapshot, with resultType=hits, startIndex/count paging and the
+    FILTER/BBOX subset that fountain_filter writes.
+
+    Feature responses carry an ETag derived from version and a Last-Modified
+    date, honour If-None-Match / If-Modified-Since with 304, and are gzipped
+    when the client accepts it. Output formats outside formats get an OWS
+    exception report; delays (format -> seconds) slow individual formats down.
+    """
+
+    delays = delays or {}
+
+    class StandInWFSHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = {key.lower(): values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+            if query.get('request', '').lower() != 'getfeature':
+                self.send_error(400, "Only GetFeature is supported")
+                return
+
+            try:
+                where, bbox = parse_wfs_filter(query.get('filter'), query.get('bbox'))
+            except (ValueError, KeyError, SyntaxError):
+                body = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1" version="2.0.0">'
+                        '<ows:Exception exceptionCode="InvalidParameterValue" locator="filter"/>'
+                        '</ows:ExceptionReport>')
+                self.respond(body.encode('utf-8'), 'text/xml; charset=utf-8', status=400)
+                return
+            matching = features
+            if where or bbox is not None:
+                matching = list(filter_features(features, where, bbox))
+
+            if query.get('resulttype', '').lower() == 'hits':
+                body = (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                        f'<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+                        f'numberMatched="{len(matching)}" numberReturned="0"/>')
+                self.respond(body.encode('utf-8'), 'text/xml; charset=utf-8')
+                return
+
+            etag = f'"{version}-{hashlib.sha1(self.path.encode("utf-8")).hexdigest()[:12]}"' if version else None
+            if self.not_modified(etag):
+                self.send_response(304)
+                self.send_validators(etag)
+                self.end_headers()
+                return
+
+            output_format = query.get('outputformat', 'GEOJSON').upper()
+            time.sleep(delays.get(output_format, 0))
+            if output_format not in formats:
+                body = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1" version="2.0.0">'
+                        '<ows:Exception exceptionCode="InvalidParameterValue" locator="outputFormat"/>'
+                        '</ows:ExceptionReport>')
+                self.respond(body.encode('utf-8'), 'text/xml; charset=utf-8', status=400)
+                return
+
+            start = int(query.get('startindex', 0))
+            count = int(query.get('count') or query.get('maxfeatures') or len(matching))
+            selected = matching[start:start + count]
+            if output_format == 'GML32':
+                self.respond(render_gml(selected).encode('utf-8'), 'application/gml+xml; version=3.2', etag)
+            elif output_format == 'CSV':
+                self.respond(render_csv(selected).encode('utf-8'), 'text/csv; charset=utf-8', etag)
+            else:
+                page = {'type': 'FeatureCollection', 'features': selected, 'totalFeatures': len(matching),
+                        'numberMatched': len(matching), 'numberReturned': len(selected),
+                        'timeStamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())}
+                if crs:
+                    page['crs'] = crs
+                self.respond(json.dumps(page, ensure_ascii=False).encode('utf-8'), 'application/geo+json', etag)
+
+        def not_modified(self, etag):
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match is not None:
+                return etag is not None and etag in [tag.strip() for tag in if_none_match.split(',')]
+            if_modified_since = self.headers.get('If-Modified-Since')
+            if if_modified_since and last_modified is not None:
+                try:
+                    return parsedate_to_datetime(if_modified_since).timestamp() >= int(last_modified)
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def send_validators(self, etag):
+            if etag:
+                self.send_header('ETag', etag)
+            if last_modified is not None:
+                self.send_header('Last-Modified', formatdate(last_modified, usegmt=True))
+
+        def respond(self, body, content_type, etag=None, status=200):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_validators(etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            print(f"[stand-in WFS] {self.address_string()} {format % args}")
+
+    return StandInWFSHandler
+
+def serve(snapshot, host='127.0.0.1', port=8765, validators=True, formats=STANDIN_FORMATS, delays=None):
+    with open(snapshot, 'rb') as f:
+        raw = f.read()
+    data = json.loads(raw)
+
+    version = hashlib.sha256(raw).hexdigest()[:16] if validators else None
+    last_modified = int(os.path.getmtime(snapshot)) if validators else None
+    server = ThreadingHTTPServer((host, port), make_handler(data['features'], data.get('crs'), version, last_modified,
+                                                                 formats, delays))
+    print(f"Serving {len(data['features'])} features from {snapshot} at http://{host}:{server.server_port}/")
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the BWB Trinkbrunnen WFS")
+    parser.add_argument('--snapshot', default='../data/berlin_trinkbrunnen_wfs.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-validators', action='store_true',
+                        help="Send no ETag/Last-Modified and ignore conditional headers")
+    parser.add_argument('--formats', default=','.join(STANDIN_FORMATS),
+                        help=f"Comma separated output formats to support (default: {','.join(STANDIN_FORMATS)})")
+    parser.add_argument('--delay', action='append', default=[], metavar='FORMAT=SECONDS',
+                        help="Answer requests for FORMAT only after SECONDS (repeatable)")
+    args = parser.parse_args()
+
+    formats = tuple(name.strip().upper() for name in args.formats.split(',') if name.strip())
+    delays = {}
+    for item in args.delay:
+        name, _, seconds = item.partition('=')
+        delays[name.strip().upper()] = float(seconds)
+
+    server = serve(args.snapshot, args.host, args.port, validators=not args.no_validators,
+                   formats=formats, delays=delays)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()